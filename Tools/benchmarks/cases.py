@@ -0,0 +1,99 @@
+"""
+Benchmark cases: one entry per tool core function.
+
+A case's `run(tool, img_handler, img, workdir)` performs exactly one call of
+the core method on `img`; the input is served from memory (harness.INPUT_URI)
+so timings cover the image work, not disk I/O. Text-producing tools still
+write their small .txt reports under `workdir`.
+"""
+
+import os
+
+import numpy as np
+
+from utils.messages import WatermarkParameters
+
+from .harness import INPUT_URI, OUTPUT_URI
+
+
+class Case:
+    def __init__(self, tool, name, run):
+        self.tool = tool
+        self.name = name
+        self.run = run
+
+    @property
+    def key(self):
+        return f'{self.tool}.{self.name}'
+
+
+def _cut_box(img):
+    w, h = img.size
+    return (w // 8, h // 8, w * 7 // 8, h * 7 // 8)
+
+
+def _pyramid_targets(img):
+    w, h = img.size
+    return [((w, h), OUTPUT_URI), ((w // 2, h // 2), OUTPUT_URI), ((w // 4, h // 4), OUTPUT_URI), ((320, 240), OUTPUT_URI)]
+
+
+def _cut_ai(tool, handler, img, workdir):
+    saliency_map = tool.get_saliency_map(img)
+    return tool.find_optimal_crop(np.asarray(img), saliency_map)
+
+
+CASES = [
+    Case('brightness', 'adjust_brightness',
+         lambda t, h, img, d: t.adjust_brightness(INPUT_URI, OUTPUT_URI, 1.3)),
+    Case('contrast', 'contrast_image',
+         lambda t, h, img, d: t.contrast_image(INPUT_URI, OUTPUT_URI, 1.3)),
+    Case('saturation', 'saturation_image',
+         lambda t, h, img, d: t.saturation_image(INPUT_URI, OUTPUT_URI, 1.3)),
+    Case('binarization', 'add_binarization',
+         lambda t, h, img, d: t.add_binarization(INPUT_URI, OUTPUT_URI, 128)),
+    Case('border', 'add_border',
+         lambda t, h, img, d: t.add_border(INPUT_URI, OUTPUT_URI, (255, 0, 0), 20)),
+    Case('rotate', 'rotate_image[30]',
+         lambda t, h, img, d: t.rotate_image(INPUT_URI, OUTPUT_URI, 30)),
+    Case('rotate', 'rotate_image[90]',
+         lambda t, h, img, d: t.rotate_image(INPUT_URI, OUTPUT_URI, 90)),
+    Case('rotate', 'rotate_image[30,opencv]',
+         lambda t, h, img, d: t.rotate_image(INPUT_URI, OUTPUT_URI, 30, backend='opencv')),
+    Case('resize', 'resize_image[half]',
+         lambda t, h, img, d: t.resize_image(INPUT_URI, OUTPUT_URI, (img.width // 2, img.height // 2))),
+    Case('resize', 'resize_image[half,opencv]',
+         lambda t, h, img, d: t.resize_image(INPUT_URI, OUTPUT_URI, (img.width // 2, img.height // 2),
+                                             backend='opencv')),
+    # one decode, four outputs (full, half, quarter, thumbnail)
+    Case('resize', 'resize_pyramid[4]',
+         lambda t, h, img, d: t.resize_pyramid(INPUT_URI, _pyramid_targets(img), 'pillow')),
+    Case('cut', 'cut_image',
+         lambda t, h, img, d: t.cut_image(INPUT_URI, OUTPUT_URI, _cut_box(img))),
+    # after the first run the overlay comes from the cache: this is the per-image cost
+    Case('watermark', 'add_watermark[text]',
+         lambda t, h, img, d: t.add_watermark(INPUT_URI, OUTPUT_URI, WatermarkParameters(INPUT_URI, OUTPUT_URI))),
+    Case('watermark', 'add_watermark[tiled]',
+         lambda t, h, img, d: t.add_watermark(INPUT_URI, OUTPUT_URI,
+                                              WatermarkParameters(INPUT_URI, OUTPUT_URI, tile=True))),
+    Case('expand_ai', '_expand_image[reflect]',
+         lambda t, h, img, d: t._expand_image(img, {'mode': 'reflect', 'percent': 25})),
+    Case('expand_ai', '_expand_image[edge]',
+         lambda t, h, img, d: t._expand_image(img, {'mode': 'edge', 'percent': 25})),
+    Case('upgrade_ai', 'enhance_image',
+         lambda t, h, img, d: t.enhance_image(INPUT_URI, OUTPUT_URI)),
+    Case('cut_ai', 'get_saliency_map+find_optimal_crop', _cut_ai),
+    Case('bg_remove_ai', 'background_remove',
+         lambda t, h, img, d: t.background_remove(INPUT_URI, OUTPUT_URI)),
+    Case('text_ai', 'ocr',
+         lambda t, h, img, d: t.ocr(INPUT_URI, os.path.join(d, 'out'))),
+    Case('obj_ai', 'detect_objects',
+         lambda t, h, img, d: t.detect_objects(INPUT_URI, os.path.join(d, 'out'))),
+    Case('people_ai', 'count_people',
+         lambda t, h, img, d: t.count_people(INPUT_URI, os.path.join(d, 'out'))),
+]
+
+
+def select_cases(tools=None):
+    if not tools:
+        return list(CASES)
+    return [case for case in CASES if case.tool in tools]
@@ -0,0 +1,186 @@
+"""
+Equivalence and speed check of composed geometric chains (utils/compose.py).
+
+Usage (from Tools/):
+
+    python -m benchmarks.compose                    # 2 and 12 MP, RGB and RGBA
+    python -m benchmarks.compose --sizes 48 --modes RGB
+
+Every chain is run step by step, as the tools would one job at a time, and
+composed into a single resample. The composed output must have the same size
+and mode, and its pixels must agree: chains the tools resample once (a single
+nearest-neighbour rotation, plus cuts, borders and quarter turns) may differ
+only where sampling falls on a tie (at most --max-nearest-diff of the pixels),
+chains they resample more than once (a resize, a second rotation), now
+sampled a single time, by at most --max-mad levels on average. Any
+disagreement makes the run exit with status 1.
+
+Both ways are timed next to each other.
+"""
+
+import sys
+import time
+import argparse
+import statistics
+from types import SimpleNamespace
+
+import numpy as np
+
+import utils.compose as compose
+import utils.geometry as geometry
+
+from .corpus import synthetic_image, dimensions
+
+DEFAULT_SIZES = (2, 12)
+DEFAULT_MODES = ('RGB', 'RGBA')
+DEFAULT_MAX_NEAREST_DIFF = 0.01
+DEFAULT_MAX_MAD = 3.0
+
+NEAREST = 'nearest'
+RESAMPLED = 'resampled'
+
+
+def rotate(degrees):
+    return 'rotate', SimpleNamespace(degrees=degrees)
+
+
+def resize(scale):
+    return 'resize', scale
+
+
+def cut(left, top, right, bottom):
+    # fractions of the image the chain has reached
+    return 'cut', (left, top, right, bottom)
+
+
+def border(width):
+    return 'border', SimpleNamespace(borderWidth=width, r=40, g=90, b=200)
+
+
+# name -> (sampling, steps); resizes and cuts are relative to the image they apply to
+CHAINS = {
+    'rotate+cut': (NEAREST, [rotate(30), cut(0.1, 0.1, 0.9, 0.9)]),
+    'cut+rotate': (NEAREST, [cut(0.1, 0.1, 0.8, 0.7), rotate(-15)]),
+    'rotate[90]+cut+border': (NEAREST, [rotate(90), cut(0.0, 0.2, 0.5, 0.9), border(12)]),
+    'border+rotate+cut': (NEAREST, [border(20), rotate(-77), cut(0.05, 0.05, 0.6, 0.7)]),
+    'rotate+border+rotate+cut': (RESAMPLED, [rotate(20), border(15), rotate(-35), cut(0.1, 0.1, 0.8, 0.8)]),
+    'rotate+resize': (RESAMPLED, [rotate(30), resize(0.5)]),
+    'resize+cut': (RESAMPLED, [resize(0.6), cut(0.1, 0.1, 0.9, 0.8)]),
+    'cut+resize+rotate': (RESAMPLED, [cut(0.1, 0.1, 0.8, 0.7), resize(0.7), rotate(-15)]),
+    'rotate+resize+rotate+border': (RESAMPLED, [rotate(10), resize(0.4), rotate(-25), border(6)]),
+    'resize[up]+cut': (RESAMPLED, [resize(1.5), cut(0.3, 0.3, 0.6, 0.6)]),
+}
+
+
+def concrete(steps, size):
+    """The chain's steps with their parameters for an input of `size`, as the tools get them."""
+    out = []
+    for procedure, params in steps:
+        width, height = size
+        if procedure == 'resize':
+            params = SimpleNamespace(width=max(1, round(width * params)), height=max(1, round(height * params)))
+        elif procedure == 'cut':
+            left, top, right, bottom = params
+            params = SimpleNamespace(left=round(width * left), top=round(height * top),
+                                     right=round(width * right), bottom=round(height * bottom))
+        out.append((procedure, params))
+        size = step_size(size, procedure, params)
+    return out
+
+
+def step_size(size, procedure, params):
+    width, height = size
+    match procedure:
+        case 'rotate':
+            angle = params.degrees % 360
+            if angle % 90 == 0:
+                return (height, width) if angle % 180 else size
+            return geometry.rotate_matrix(size, angle, True)[0]
+        case 'resize':
+            return params.width, params.height
+        case 'cut':
+            return params.right - params.left, params.bottom - params.top
+        case 'border':
+            return width + 2 * params.borderWidth, height + 2 * params.borderWidth
+
+
+def sequential(img, steps):
+    for procedure, params in steps:
+        img = compose.apply_step(img, procedure, params)
+    return img
+
+
+def compare(sampling, expected, actual):
+    """(ok, metric): the fraction of differing pixels for nearest sampling, else the mean absolute difference."""
+    if expected.size != actual.size or expected.mode != actual.mode:
+        return False, f'{actual.size} {actual.mode}, expected {expected.size} {expected.mode}'
+    a = np.asarray(expected).astype(np.int16)
+    b = np.asarray(actual).astype(np.int16)
+    if sampling == NEAREST:
+        differs = a != b
+        if differs.ndim == 3:
+            differs = differs.any(axis=-1)
+        return differs.mean() <= ARGS.max_nearest_diff, float(differs.mean())
+    mad = float(np.abs(a - b).mean())
+    return mad <= ARGS.max_mad, mad
+
+
+def median_s(fn, repeat):
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        runs.append(time.perf_counter() - start)
+    return statistics.median(runs)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default=','.join(str(s) for s in DEFAULT_SIZES), help='megapixels, comma-separated')
+    parser.add_argument('--modes', default=','.join(DEFAULT_MODES), help='PIL modes, comma-separated')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--max-nearest-diff', type=float, default=DEFAULT_MAX_NEAREST_DIFF,
+                        help='fraction of pixels nearest-neighbour chains may differ in')
+    parser.add_argument('--max-mad', type=float, default=DEFAULT_MAX_MAD,
+                        help='mean absolute difference (levels) allowed for chains resampled more than once')
+    return parser.parse_args(argv)
+
+
+ARGS = None
+
+
+def main(argv=None):
+    global ARGS
+    ARGS = parse_args(argv)
+    sizes = [int(s) for s in ARGS.sizes.split(',') if s]
+    modes = [m for m in ARGS.modes.split(',') if m]
+
+    failures = []
+    print(f'{"case":<45} {"check":>10} {"steps":>10} {"composed":>10}')
+    for megapixels in sizes:
+        for mode in modes:
+            img = synthetic_image(megapixels, mode)
+            img.load()
+            for name, (sampling, steps) in CHAINS.items():
+                key = f'{name}@{megapixels}MP/{mode}'
+                steps = concrete(steps, img.size)
+                ok, metric = compare(sampling, sequential(img, steps), compose.render(img, steps))
+                if not ok:
+                    failures.append(key)
+
+                timings = [median_s(lambda: sequential(img, steps), ARGS.repeat),
+                           median_s(lambda: compose.render(img, steps), ARGS.repeat)]
+                check = f'{metric:10.4f}' if isinstance(metric, float) else metric
+                print(f'{key:<45} {check:>10} ' + ' '.join(f'{t * 1000:8.1f}ms' for t in timings)
+                      + ('' if ok else '  MISMATCH'))
+
+    print(f'\nsizes: {", ".join(f"{s}MP ({dimensions(s)[0]}x{dimensions(s)[1]})" for s in sizes)}')
+    if failures:
+        print(f'{len(failures)} chain(s) where the composed output disagrees: {", ".join(failures)}')
+        return 1
+    print('composed chains agree')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
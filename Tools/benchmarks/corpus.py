@@ -0,0 +1,70 @@
+"""
+Deterministic synthetic image corpus for the tool benchmarks.
+
+Images are 4:3 and built from gradients, a sine pattern, hard-edged blocks and
+seeded noise, so edge/saliency/threshold based tools get realistic work, and
+the same (megapixels, mode, seed) always yields the same pixels.
+"""
+
+import math
+
+import numpy as np
+from PIL import Image
+
+SIZES_MP = (1, 12, 48)
+MODES = ("RGB", "RGBA", "P")
+
+_rgb_cache = {}
+
+
+def dimensions(megapixels):
+    width = round(math.sqrt(megapixels * 1_000_000 * 4 / 3))
+    return width, round(width * 3 / 4)
+
+
+def _synthetic_rgb(megapixels, seed):
+    width, height = dimensions(megapixels)
+    rng = np.random.default_rng(seed)
+
+    x = np.linspace(0, 1, width, dtype=np.float32)[None, :]
+    y = np.linspace(0, 1, height, dtype=np.float32)[:, None]
+
+    arr = np.empty((height, width, 3), dtype=np.uint8)
+    arr[..., 0] = (180 * x + 60 * y).astype(np.uint8)
+    arr[..., 1] = (120 * (1 - x) + 100 * y).astype(np.uint8)
+    arr[..., 2] = (110 + 100 * np.sin(x * 40) * np.cos(y * 30)).astype(np.uint8)
+
+    # a few solid blocks give the AI tools something salient to find
+    for _ in range(12):
+        bw, bh = rng.integers(width // 20, width // 5), rng.integers(height // 20, height // 5)
+        bx, by = rng.integers(0, width - bw), rng.integers(0, height - bh)
+        arr[by:by + bh, bx:bx + bw] = rng.integers(0, 256, 3, dtype=np.uint8)
+
+    arr += rng.integers(0, 16, arr.shape, dtype=np.uint8)
+    return Image.fromarray(arr, "RGB")
+
+
+def synthetic_image(megapixels, mode="RGB", seed=0):
+    """Return the synthetic image for (megapixels, mode, seed); RGB bases are cached."""
+    key = (megapixels, seed)
+    if key not in _rgb_cache:
+        _rgb_cache[key] = _synthetic_rgb(megapixels, seed)
+    base = _rgb_cache[key]
+
+    if mode == "RGB":
+        return base
+    if mode == "RGBA":
+        img = base.copy()
+        width, height = img.size
+        x = np.linspace(-1, 1, width, dtype=np.float32)[None, :]
+        y = np.linspace(-1, 1, height, dtype=np.float32)[:, None]
+        alpha = (255 * np.clip(1.4 - np.sqrt(x * x + y * y), 0, 1)).astype(np.uint8)
+        img.putalpha(Image.fromarray(alpha, "L"))
+        return img
+    if mode == "P":
+        return base.quantize(colors=256, method=Image.Quantize.MEDIANCUT)
+    return base.convert(mode)
+
+
+def clear_cache():
+    _rgb_cache.clear()
@@ -0,0 +1,247 @@
+"""
+In-process stand-in for RabbitMQ implementing the utils.rabbit_mq.Rabbit_MQ
+interface, so real tool workers can run as threads of one process.
+
+    broker = FakeBroker()
+    install(broker)          # every ToolMSG built from now on talks to `broker`
+    Brightness().exec(None)  # consumes brightness_queue until broker.close()
+
+Semantics follow what the tools rely on from pika and RabbitMQ: named queues
+shared by competing consumers, message priorities (higher first, FIFO within a
+priority), per-message TTL (expiration) with dead-lettering, fanout
+exchanges, auto or manual acks with prefetch, and add_callback_threadsafe
+callbacks run on the consumer's thread.
+"""
+
+import sys
+import time
+import queue
+import itertools
+import threading
+import collections
+
+from .harness import TOOLS_DIR
+
+
+class BrokerClosed(Exception):
+    pass
+
+
+class Properties:
+    def __init__(self, **kwargs):
+        self.priority = None
+        self.expiration = None
+        self.content_type = None
+        self.headers = None
+        self.__dict__.update(kwargs)
+
+
+class Method:
+    def __init__(self, delivery_tag, routing_key, message_count=0):
+        self.delivery_tag = delivery_tag
+        self.routing_key = routing_key
+        self.message_count = message_count
+        self.redelivered = False
+
+
+class FakeBroker:
+    def __init__(self):
+        self._queues = {}
+        self._lock = threading.Lock()
+        self._tags = itertools.count(1)
+        self._seq = itertools.count()
+        self._max_priority = {}
+        self._fanout = collections.defaultdict(list)
+        self._dead_letter = {}
+        self.closed = threading.Event()
+        self.published = collections.Counter()
+        self.expired = collections.Counter()
+
+    def queue(self, name):
+        with self._lock:
+            if name not in self._queues:
+                self._queues[name] = queue.PriorityQueue()
+            return self._queues[name]
+
+    def declare(self, name, max_priority=None, dead_letter=None):
+        """
+        max_priority: like x-max-priority; other queues ignore priorities.
+        dead_letter: queue that receives this queue's expired messages.
+        """
+        self.queue(name)
+        with self._lock:
+            if max_priority:
+                self._max_priority[name] = max_priority
+            if dead_letter:
+                self._dead_letter[name] = dead_letter
+
+    def bind_fanout(self, exchange):
+        """A new exclusive queue receiving every message published to `exchange`."""
+        name = f'{exchange}.{next(self._seq)}'
+        self.queue(name)
+        with self._lock:
+            self._fanout[exchange].append(name)
+        return name
+
+    def publish_fanout(self, exchange, body):
+        with self._lock:
+            names = list(self._fanout[exchange])
+        for name in names:
+            self.publish(name, body)
+
+    def publish(self, routing_key, body, properties=None):
+        if isinstance(body, str):
+            body = body.encode()
+        self._put(routing_key, body, properties or Properties())
+        with self._lock:
+            self.published[routing_key] += 1
+
+    def _put(self, name, body, properties):
+        priority = min(properties.priority or 0, self._max_priority.get(name, 0))
+        self.queue(name).put((-priority, next(self._seq), time.monotonic(), body, properties))
+
+    def get(self, name, timeout):
+        while True:
+            _, _, queued, body, properties = self.queue(name).get(timeout=timeout)
+            if not properties.expiration or (time.monotonic() - queued) * 1000 <= int(properties.expiration):
+                return next(self._tags), body, properties
+            # RabbitMQ drops expired messages when they reach the head of the queue
+            with self._lock:
+                self.expired[name] += 1
+                target = self._dead_letter.get(name)
+            if target:
+                self.publish(target, body)
+
+    def requeue(self, name, body, properties):
+        self._put(name, body, properties)
+
+    def depth(self, name):
+        return self.queue(name).qsize()
+
+    def close(self):
+        self.closed.set()
+
+
+class FakeChannel:
+    def __init__(self, connection):
+        self._connection = connection
+
+    def basic_ack(self, delivery_tag=0, multiple=False):
+        self._connection._settle(delivery_tag)
+
+    def basic_nack(self, delivery_tag=0, multiple=False, requeue=True):
+        self._connection._settle(delivery_tag, requeue=requeue)
+
+    def basic_reject(self, delivery_tag=0, requeue=True):
+        self._connection._settle(delivery_tag, requeue=requeue)
+
+    def basic_publish(self, exchange, routing_key, body, properties=None):
+        self._connection._broker.publish(routing_key, body, properties)
+
+
+class FakeRabbit_MQ:
+    """Drop-in for Rabbit_MQ; `broker` is bound by rabbit_mq_class()."""
+
+    broker = None
+    poll_interval = 0.02
+
+    def __init__(self, host=None, port=None, username=None, password=None, max_priority=None):
+        self._broker = self.broker
+        self._max_priority = max_priority
+        self._queue = ''
+        self._callbacks = queue.Queue()
+        self._unacked = {}
+        self._channel = FakeChannel(self)
+
+    def send_rabbit_msg(self, msg, queue, priority=None, content_type=None):
+        self._broker.publish(queue, msg, Properties(priority=priority, content_type=content_type))
+
+    def add_callback_threadsafe(self, callback):
+        self._callbacks.put(callback)
+
+    def _settle(self, delivery_tag, requeue=False):
+        entry = self._unacked.pop(delivery_tag, None)
+        if entry is not None and requeue:
+            self._broker.requeue(*entry)
+
+    def _run_callbacks(self, timeout):
+        try:
+            callback = self._callbacks.get(timeout=timeout) if timeout else self._callbacks.get_nowait()
+        except queue.Empty:
+            return
+        callback()
+        while True:
+            try:
+                self._callbacks.get_nowait()()
+            except queue.Empty:
+                return
+
+    def declare_queue(self, queue_name):
+        self._broker.declare(queue_name, self._max_priority)
+
+    def queue_depth(self, queue_name):
+        return self._broker.depth(queue_name)
+
+    def get_rabbit_msg(self, queue_name):
+        if self._broker.closed.is_set():
+            raise BrokerClosed()
+        try:
+            tag, body, properties = self._broker.get(queue_name, 0)
+        except queue.Empty:
+            return None
+        self._unacked[tag] = (queue_name, body, properties)
+        return Method(tag, queue_name, self._broker.depth(queue_name)), properties, body
+
+    def ack(self, delivery_tag):
+        self._settle(delivery_tag)
+
+    def sleep(self, seconds):
+        if self._broker.closed.is_set():
+            raise BrokerClosed()
+        self._run_callbacks(seconds)
+
+    def read_fanout_msg(self, exchange, callback):
+        name = self._broker.bind_fanout(exchange)
+        while not self._broker.closed.is_set():
+            try:
+                tag, body, properties = self._broker.get(name, self.poll_interval)
+            except queue.Empty:
+                continue
+            callback(self._channel, Method(tag, name), properties, body)
+        raise BrokerClosed()
+
+    def read_rabbit_msg(self, queue_name, callback, auto_ack=True, prefetch_count=None):
+        if self._queue == '':
+            self._queue = queue_name
+        self._broker.declare(self._queue, self._max_priority)
+
+        while not self._broker.closed.is_set():
+            self._run_callbacks(None)
+
+            if not auto_ack and prefetch_count and len(self._unacked) >= prefetch_count:
+                self._run_callbacks(self.poll_interval)
+                continue
+
+            try:
+                tag, body, properties = self._broker.get(self._queue, self.poll_interval)
+            except queue.Empty:
+                continue
+
+            if not auto_ack:
+                self._unacked[tag] = (self._queue, body, properties)
+            callback(self._channel, Method(tag, self._queue), properties, body)
+
+        raise BrokerClosed()
+
+
+def rabbit_mq_class(broker):
+    return type('FakeRabbit_MQ', (FakeRabbit_MQ,), {'broker': broker})
+
+
+def install(broker):
+    """Make utils.tool_msg.ToolMSG use `broker` instead of a pika connection."""
+    if TOOLS_DIR not in sys.path:
+        sys.path.insert(0, TOOLS_DIR)
+    import utils.tool_msg as tool_msg
+    tool_msg.Rabbit_MQ = rabbit_mq_class(broker)
+    return tool_msg
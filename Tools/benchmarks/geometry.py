@@ -0,0 +1,144 @@
+"""
+Equivalence and scaling check of the geometry backends (utils/geometry.py).
+
+Usage (from Tools/):
+
+    python -m benchmarks.geometry                   # 1 and 12 MP, all modes, 1 thread and every core
+    python -m benchmarks.geometry --sizes 48 --threads 1,2,4,8
+
+Every rotate/resize operation is run on both backends against the synthetic
+corpus. The OpenCV output must have Pillow's size and mode, and its pixels
+must agree: nearest-neighbour rotations may differ only where sampling falls
+on a tie (at most --max-nearest-diff of the pixels), interpolated ones and
+resizes (INTER_AREA vs Pillow's antialiased bicubic) by at most --max-mad
+levels on average. Any disagreement makes the run exit with status 1.
+
+Each OpenCV operation is then timed with every --threads setting next to
+Pillow, to show the latency scaling with cores.
+"""
+
+import os
+import sys
+import time
+import argparse
+import statistics
+
+import numpy as np
+from PIL import Image
+
+import utils.geometry as geometry
+
+from .corpus import synthetic_image, dimensions
+
+DEFAULT_SIZES = (1, 12)
+DEFAULT_MODES = ('RGB', 'RGBA', 'L', 'LA', 'P')
+DEFAULT_MAX_NEAREST_DIFF = 0.01
+DEFAULT_MAX_MAD = 1.5
+
+NEAREST = 'nearest'
+INTERPOLATED = 'interpolated'
+
+# name -> (sampling, fn(img, backend))
+OPERATIONS = {
+    'rotate[30]': (NEAREST, lambda img, backend: geometry.rotate(img, 30, backend=backend)),
+    'rotate[-17.5]': (NEAREST, lambda img, backend: geometry.rotate(img, -17.5, backend=backend)),
+    'rotate[30,bicubic]': (INTERPOLATED, lambda img, backend: geometry.rotate(
+        img, 30, backend=backend, resample=Image.Resampling.BICUBIC)),
+    'resize[half]': (INTERPOLATED, lambda img, backend: geometry.resize(
+        img, (img.width // 2, img.height // 2), backend=backend)),
+    'resize[0.37]': (INTERPOLATED, lambda img, backend: geometry.resize(
+        img, (round(img.width * 0.37), round(img.height * 0.37)), backend=backend)),
+    'resize[1.5x]': (INTERPOLATED, lambda img, backend: geometry.resize(
+        img, (img.width * 3 // 2, img.height * 3 // 2), backend=backend)),
+}
+
+
+def corpus_image(megapixels, mode):
+    if mode in ('L', 'LA'):
+        return synthetic_image(megapixels, 'RGBA').convert(mode)
+    return synthetic_image(megapixels, mode)
+
+
+def compare(sampling, expected, actual):
+    """(ok, metric): the fraction of differing pixels for nearest sampling, else the mean absolute difference."""
+    if expected.size != actual.size or expected.mode != actual.mode:
+        return False, f'{actual.size} {actual.mode}, expected {expected.size} {expected.mode}'
+    a = np.asarray(expected).astype(np.int16)
+    b = np.asarray(actual).astype(np.int16)
+    if sampling == NEAREST:
+        differs = a != b
+        if differs.ndim == 3:
+            differs = differs.any(axis=-1)
+        return differs.mean() <= ARGS.max_nearest_diff, float(differs.mean())
+    mad = float(np.abs(a - b).mean())
+    return mad <= ARGS.max_mad, mad
+
+
+def median_s(fn, img, backend, repeat):
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(img, backend)
+        runs.append(time.perf_counter() - start)
+    return statistics.median(runs)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default=','.join(str(s) for s in DEFAULT_SIZES), help='megapixels, comma-separated')
+    parser.add_argument('--modes', default=','.join(DEFAULT_MODES), help='PIL modes, comma-separated')
+    parser.add_argument('--threads', default=f'1,{os.cpu_count()}', help='OpenCV thread counts to time')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--max-nearest-diff', type=float, default=DEFAULT_MAX_NEAREST_DIFF,
+                        help='fraction of pixels nearest-neighbour outputs may differ in')
+    parser.add_argument('--max-mad', type=float, default=DEFAULT_MAX_MAD,
+                        help='mean absolute difference (levels) allowed for interpolated outputs')
+    return parser.parse_args(argv)
+
+
+ARGS = None
+
+
+def main(argv=None):
+    global ARGS
+    ARGS = parse_args(argv)
+    sizes = [int(s) for s in ARGS.sizes.split(',') if s]
+    modes = [m for m in ARGS.modes.split(',') if m]
+    threads = sorted({int(t) for t in ARGS.threads.split(',') if t})
+
+    cv2 = geometry._opencv()
+    if cv2 is None:
+        print('opencv-python is not installed, nothing to compare')
+        return 1
+
+    failures = []
+    print(f'{"case":<40} {"check":>10} {"pillow":>10} ' + ' '.join(f'{f"cv2 x{t}":>10}' for t in threads))
+    for megapixels in sizes:
+        for mode in modes:
+            img = corpus_image(megapixels, mode)
+            img.load()
+            for name, (sampling, fn) in OPERATIONS.items():
+                key = f'{name}@{megapixels}MP/{mode}'
+                ok, metric = compare(sampling, fn(img, geometry.PILLOW), fn(img, geometry.OPENCV))
+                if not ok:
+                    failures.append(key)
+
+                timings = [median_s(fn, img, geometry.PILLOW, ARGS.repeat)]
+                for count in threads:
+                    cv2.setNumThreads(count)
+                    timings.append(median_s(fn, img, geometry.OPENCV, ARGS.repeat))
+                check = f'{metric:10.4f}' if isinstance(metric, float) else metric
+                print(f'{key:<40} {check:>10} ' + ' '.join(f'{t * 1000:8.1f}ms' for t in timings)
+                      + ('' if ok else '  MISMATCH'))
+
+    print(f'\nsizes: {", ".join(f"{s}MP ({dimensions(s)[0]}x{dimensions(s)[1]})" for s in sizes)}; '
+          f'cpu_count: {os.cpu_count()}')
+    if failures:
+        print(f'{len(failures)} case(s) where the backends disagree: {", ".join(failures)}')
+        return 1
+    print('backends agree')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
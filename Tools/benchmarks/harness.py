@@ -0,0 +1,113 @@
+"""
+Loads tool classes for benchmarking without RabbitMQ.
+
+Each tool module is imported from its own folder (as its Dockerfile does), its
+ToolMSG is swapped for NullToolMSG before construction and its Img_Handler for
+MemoryImgHandler, so the core methods can be called directly and only the
+image work is measured.
+"""
+
+import os
+import sys
+import importlib.util
+
+from utils.img_handler import Img_Handler
+
+TOOLS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# tool -> (module file relative to Tools/, class name; None = module-level functions)
+TOOLS = {
+    'binarization': ('binarization/binarization.py', 'Binarization'),
+    'border': ('border/border.py', 'Border'),
+    'brightness': ('brightness/brightness.py', 'Brightness'),
+    'contrast': ('contrast/contrast.py', 'Contrast'),
+    'cut': ('cut/cut.py', 'Cut'),
+    'cut_ai': ('cut_ai/cut_ai.py', 'CutAI'),
+    'expand_ai': ('expand_ai/expand_ai.py', None),
+    'obj_ai': ('obj_ai/obj_ai.py', 'Object_ai'),
+    'people_ai': ('people_ai/people_ai.py', 'People_ai'),
+    'resize': ('resize/resize.py', 'Resize'),
+    'rotate': ('rotate/rotate.py', 'Rotate'),
+    'saturation': ('saturation/saturation.py', 'Saturation'),
+    'text_ai': ('text_ai/text_ai.py', 'Text_AI'),
+    'upgrade_ai': ('upgrade_ai/upgrade_ai.py', 'Upgrade_ai'),
+    'watermark': ('watermark/watermark.py', 'Watermark'),
+    'bg_remove_ai': ('bg_remove_ai/bg_remove_ai.py', 'Background_Remove_AI'),
+}
+
+INPUT_URI = 'mem://input'
+OUTPUT_URI = 'mem://output'
+
+
+class NullToolMSG:
+    """Stands in for ToolMSG: no broker connection, replies are only recorded."""
+
+    def __init__(self, *args, **kwargs):
+        self.sent = []
+
+    def send_msg(self, *args, **kwargs):
+        self.sent.append((args, kwargs))
+
+    def read_msg(self, *args, **kwargs):
+        raise RuntimeError("NullToolMSG cannot consume messages")
+
+    def run_threadsafe(self, callback):
+        callback()
+
+    def superseded(self, info):
+        return False
+
+
+class MemoryImgHandler(Img_Handler):
+    """Img_Handler that serves/stores PIL images from a dict instead of disk."""
+
+    def __init__(self):
+        self.images = {}
+
+    def get_img(self, img_path):
+        return self.images[img_path]
+
+    def store_img(self, img, img_path):
+        self.images[img_path] = img
+
+
+def load_module(tool):
+    """Import a tool's module by path (tool folders are not importable packages by name)."""
+    rel_path, _ = TOOLS[tool]
+    path = os.path.join(TOOLS_DIR, rel_path)
+
+    for entry in (TOOLS_DIR, os.path.dirname(path)):
+        if entry not in sys.path:
+            sys.path.insert(0, entry)
+
+    module_name = f'bench_tool_{tool}'
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+
+    spec = importlib.util.spec_from_file_location(module_name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    try:
+        spec.loader.exec_module(module)
+    except BaseException:
+        del sys.modules[module_name]
+        raise
+    return module
+
+
+def build_tool(tool):
+    """
+    Return (tool, img_handler): the tool instance (or module, for function-style
+    tools) wired to a MemoryImgHandler and a NullToolMSG.
+    """
+    module = load_module(tool)
+    _, class_name = TOOLS[tool]
+    img_handler = MemoryImgHandler()
+
+    if class_name is None:
+        return module, img_handler
+
+    module.ToolMSG = NullToolMSG
+    instance = getattr(module, class_name)()
+    instance._img_handler = img_handler
+    return instance, img_handler
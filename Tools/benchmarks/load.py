@@ -0,0 +1,617 @@
+"""
+End-to-end load generator: drives real tool workers through a broker the way
+the projects service does (tool -> project_queue -> next tool) and reports
+throughput and p50/p95/p99 latency per tool and per chain.
+
+Usage (from Tools/):
+
+    # generated jobs, in-process fake broker, worker threads inside this process
+    python -m benchmarks.load --generate "brightness>rotate>resize,contrast" --jobs 200 --workers 1,2,4
+
+    # replay tool messages / chains from a JSONL file at 20 jobs/s
+    python -m benchmarks.load --replay jobs.jsonl --rate 20
+
+    # against a real RabbitMQ (RABBITMQ_* env); workers are spawned as tool processes
+    python -m benchmarks.load --broker rabbitmq --generate rotate --jobs 500 --concurrency 32
+
+Replay lines are either a tool message as sent by the projects service
+({"messageId", "timestamp", "procedure", "parameters": {...}}) or a chain:
+{"inputImageURI": "...", "chain": [{"procedure": "rotate", "parameters": {...}}, ...]}.
+Each step's output becomes the next step's input, as in projects/routes.
+
+Load is either closed-loop (--concurrency jobs in flight) or open-loop
+(--rate jobs per second). --workers takes a list of worker counts per tool and
+repeats the run for each, giving a scaling curve (with --tool-host it is the
+host's total process count, shared by all tools). --preview-share marks that
+fraction of generated jobs as previews (`preview-` ids, higher queue priority)
+and the rest as bulk `request-` jobs; latency and tool queue wait are reported
+per priority class. --supersede makes every generated preview carry a cancel
+token and broadcasts a tombstone for it, like a user dragging a slider, so
+older previews still queued or in progress are dropped by the workers.
+--preview-deadline-ms gives previews a deadline and the matching message TTL.
+--wire msgpack sends the tool messages as MessagePack instead of JSON.
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+import datetime
+import tempfile
+import importlib.util
+import threading
+import statistics
+import subprocess
+
+from .corpus import synthetic_image
+from .harness import TOOLS, TOOLS_DIR, load_module
+from .fake_broker import FakeBroker, BrokerClosed, Properties, install
+from .run import machine_info
+
+PROJECT_QUEUE = 'project_queue'
+EXCHANGE = 'picturas'
+
+# --wire -> content_type of tool messages; None is the projects service's untyped JSON
+WIRE_CONTENT_TYPES = {'json': None, 'msgpack': 'application/msgpack'}
+
+# classes that consume a queue, where harness.TOOLS only lists module functions
+WORKER_CLASSES = {'expand_ai': 'ExpandAiTool'}
+
+# parameters used for generated jobs
+DEFAULT_PARAMS = {
+    'binarization': {'threshold': 128},
+    'border': {'borderWidth': 10, 'r': 255, 'g': 0, 'b': 0},
+    'brightness': {'brightness': 1.2},
+    'contrast': {'contrastFactor': 1.2},
+    'cut': {'left': 10, 'top': 10, 'right': 500, 'bottom': 400},
+    'expand_ai': {'mode': 'reflect', 'percent': 25},
+    'resize': {'width': 640, 'height': 480},
+    'rotate': {'degrees': 30},
+    'saturation': {'saturationFactor': 1.2},
+    'watermark': {'text': 'PictuRAS', 'position': 'bottom-right', 'opacity': 0.5, 'scale': 0.2},
+    'obj_ai': {'confidenceThreshold': 0.2},
+    'people_ai': {'confidenceThreshold': 0.4},
+}
+
+
+def _now_iso():
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+
+def percentiles(values):
+    if not values:
+        return {'count': 0}
+    ordered = sorted(values)
+
+    def pick(q):
+        return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+    return {
+        'count': len(ordered),
+        'mean_ms': statistics.fmean(ordered) * 1000,
+        'p50_ms': pick(0.50) * 1000,
+        'p95_ms': pick(0.95) * 1000,
+        'p99_ms': pick(0.99) * 1000,
+        'max_ms': ordered[-1] * 1000,
+    }
+
+
+# ---------------------------------------------------------------- transports
+
+class FakeTransport:
+    """Publishes to / consumes project_queue from an in-process FakeBroker."""
+
+    def __init__(self, broker):
+        self._broker = broker
+        self._thread = None
+
+    def start(self, on_reply):
+        def consume():
+            while not self._broker.closed.is_set():
+                try:
+                    _, body, _ = self._broker.get(PROJECT_QUEUE, 0.05)
+                except Exception:
+                    continue
+                on_reply(body)
+
+        self._thread = threading.Thread(target=consume, name='load-replies', daemon=True)
+        self._thread.start()
+
+    def publish(self, queue, body, priority=None, expiration=None, content_type=None):
+        self._broker.publish(queue, body, Properties(priority=priority, expiration=expiration, content_type=content_type))
+
+    def broadcast(self, exchange, body):
+        self._broker.publish_fanout(exchange, body)
+
+    def stop(self):
+        self._broker.close()
+        if self._thread:
+            self._thread.join()
+
+
+class RabbitTransport:
+    """
+    One pika connection on its own thread: it consumes project_queue, and every
+    publish is handed to it with add_callback_threadsafe.
+    """
+
+    def __init__(self, host, port, username, password):
+        import pika
+        self._pika = pika
+        self._params = pika.ConnectionParameters(host, int(port), '/', pika.PlainCredentials(username, password))
+        self._connection = None
+        self._channel = None
+        self._ready = threading.Event()
+        self._thread = None
+
+    def start(self, on_reply):
+        def run():
+            self._connection = self._pika.BlockingConnection(self._params)
+            self._channel = self._connection.channel()
+            self._channel.exchange_declare(exchange=EXCHANGE, exchange_type='direct', durable=True)
+            self._channel.queue_declare(queue=PROJECT_QUEUE, durable=True)
+            self._channel.queue_bind(queue=PROJECT_QUEUE, exchange=EXCHANGE, routing_key=PROJECT_QUEUE)
+            self._channel.basic_consume(
+                queue=PROJECT_QUEUE,
+                on_message_callback=lambda ch, method, props, body: on_reply(body),
+                auto_ack=True,
+            )
+            self._ready.set()
+            try:
+                self._channel.start_consuming()
+            finally:
+                self._connection.close()
+
+        self._thread = threading.Thread(target=run, name='load-rabbit', daemon=True)
+        self._thread.start()
+        self._ready.wait(30)
+
+    def publish(self, queue, body, priority=None, expiration=None, content_type=None):
+        properties = self._pika.BasicProperties(priority=priority, expiration=expiration, content_type=content_type)
+        self._connection.add_callback_threadsafe(
+            lambda: self._channel.basic_publish(exchange=EXCHANGE, routing_key=queue, body=body, properties=properties)
+        )
+
+    def broadcast(self, exchange, body):
+        self._connection.add_callback_threadsafe(
+            lambda: self._channel.basic_publish(exchange=exchange, routing_key='', body=body)
+        )
+
+    def stop(self):
+        if self._connection:
+            self._connection.add_callback_threadsafe(self._channel.stop_consuming)
+        if self._thread:
+            self._thread.join(10)
+
+
+# ------------------------------------------------------------------- workers
+
+def _worker_class(tool):
+    module = load_module(tool)
+    return getattr(module, WORKER_CLASSES.get(tool) or TOOLS[tool][1])
+
+
+def _serve(instance):
+    try:
+        instance.exec(None)
+    except BrokerClosed:
+        pass
+
+
+def start_thread_workers(tools, count):
+    """Real tool instances as threads, consuming from the installed FakeBroker; returns their ToolMSGs."""
+    instances = []
+    for tool in tools:
+        cls = _worker_class(tool)
+        for i in range(count):
+            instance = cls()
+            threading.Thread(target=_serve, args=(instance,), name=f'{tool}-{i}', daemon=True).start()
+            instances.append(instance)
+    return [instance._tool_msg for instance in instances]
+
+
+def start_tool_host(tools, workers):
+    """tool_host/tool_host.py serving every tool with `workers` processes; returns its ToolMSGs."""
+    path = os.path.join(TOOLS_DIR, 'tool_host', 'tool_host.py')
+    spec = importlib.util.spec_from_file_location('load_tool_host', path)
+    module = importlib.util.module_from_spec(spec)
+    # the pool pickles _run_job by module name
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+
+    host = module.ToolHost(tools, workers)
+
+    def serve():
+        try:
+            host.run()
+        except BrokerClosed:
+            pass
+
+    threading.Thread(target=serve, name='tool-host', daemon=True).start()
+    return list(host._tool_msgs.values())
+
+
+def expired_counts(tool_msgs):
+    """Jobs the workers dropped for their deadline, per tool and priority class."""
+    counts = {}
+    for tool_msg in tool_msgs:
+        tool = tool_msg._queue
+        for cls, n in tool_msg.expired_stats.items():
+            counts.setdefault(tool, {}).setdefault(cls, 0)
+            counts[tool][cls] += n
+    return counts
+
+
+def queue_wait(tool_msgs):
+    """Merge the workers' ToolMSG.wait_stats into mean/max wait per priority class."""
+    merged = {}
+    for tool_msg in tool_msgs:
+        for cls, stats in tool_msg.wait_stats.items():
+            total = merged.setdefault(cls, {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+            total['count'] += stats['count']
+            total['total_ms'] += stats['total_ms']
+            total['max_ms'] = max(total['max_ms'], stats['max_ms'])
+    return {
+        cls: {'count': s['count'], 'mean_ms': s['total_ms'] / s['count'], 'max_ms': s['max_ms']}
+        for cls, s in sorted(merged.items()) if s['count']
+    }
+
+
+def start_process_workers(tools, count):
+    """Tool scripts as subprocesses (as in their containers), for --broker rabbitmq."""
+    env = dict(os.environ, PYTHONPATH=TOOLS_DIR + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    procs = []
+    for tool in tools:
+        path = os.path.join(TOOLS_DIR, TOOLS[tool][0])
+        for _ in range(count):
+            procs.append(subprocess.Popen(
+                [sys.executable, '-u', path],
+                cwd=os.path.dirname(path),
+                env=env,
+                stdout=subprocess.DEVNULL,
+            ))
+    return procs
+
+
+# -------------------------------------------------------------------- driver
+
+class Job:
+    def __init__(self, index, input_uri, steps, workdir, kind='request', cancel=None):
+        self.index = index
+        self.kind = kind
+        self.cancel = cancel
+        self.input_uri = input_uri
+        self.steps = steps
+        self.workdir = workdir
+        self.step = 0
+        self.started = None
+        self.finished = None
+        self.error = None
+        self.cancelled = False
+        self.expired = False
+
+    @property
+    def chain(self):
+        return '>'.join(step['procedure'] for step in self.steps)
+
+
+class Driver:
+    """Plays the projects service: sends step N+1 when step N's reply arrives."""
+
+    def __init__(self, transport, tool_queues, msg_priority, cancel_exchange, preview_deadline_ms=None, content_type=None):
+        self._transport = transport
+        # None: plain JSON without a content type, as the projects service sends
+        self._content_type = content_type
+        if content_type:
+            from utils.messages import encode
+            self._encode = lambda msg: encode(msg, content_type)
+        else:
+            self._encode = json.dumps
+        self._preview_deadline_ms = preview_deadline_ms
+        self._msg_priority = msg_priority
+        self._cancel_exchange = cancel_exchange
+        self._queues = tool_queues
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._done = threading.Semaphore(0)
+        self.step_latency = {}
+        self.step_errors = {}
+        self.class_latency = {}
+        self.jobs = []
+
+    def start_job(self, job):
+        job.started = time.perf_counter()
+        with self._lock:
+            self.jobs.append(job)
+        if job.cancel:
+            # supersedes every older job of the scope, as the projects service does
+            self._transport.broadcast(self._cancel_exchange, json.dumps(job.cancel))
+        self._send_step(job, job.input_uri)
+
+    def _send_step(self, job, input_uri):
+        step = job.steps[job.step]
+        procedure = step['procedure']
+        ext = os.path.splitext(input_uri)[1] or '.png'
+        output_uri = step.get('outputImageURI') or os.path.join(job.workdir, f'job{job.index}-step{job.step}{ext}')
+
+        msg_id = f'{job.kind}-{uuid.uuid4()}'
+        msg = {
+            'messageId': msg_id,
+            'timestamp': _now_iso(),
+            'procedure': procedure,
+            'parameters': {**step.get('parameters', {}), 'inputImageURI': input_uri, 'outputImageURI': output_uri},
+        }
+        if job.cancel:
+            msg['cancel'] = job.cancel
+        expiration = None
+        if job.kind == 'preview' and self._preview_deadline_ms:
+            deadline = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(milliseconds=self._preview_deadline_ms)
+            msg['deadline'] = deadline.isoformat()
+            expiration = str(self._preview_deadline_ms)
+        with self._lock:
+            self._pending[msg_id] = (job, time.perf_counter(), output_uri)
+        self._transport.publish(self._queues[procedure], self._encode(msg), self._msg_priority(msg_id), expiration,
+                                self._content_type)
+
+    def on_reply(self, body):
+        info = json.loads(body.decode() if isinstance(body, bytes) else body)
+        if 'status' not in info and 'procedure' in info:
+            # our own message, dead-lettered after its TTL
+            info['status'] = 'expired'
+        with self._lock:
+            # success replies carry our id as correlationId, error replies as messageId
+            key = info.get('correlationId') if info.get('correlationId') in self._pending else info.get('messageId')
+            entry = self._pending.pop(key, None)
+        if entry is None:
+            return
+
+        job, sent, output_uri = entry
+        procedure = job.steps[job.step]['procedure']
+        elapsed = time.perf_counter() - sent
+
+        with self._lock:
+            self.step_latency.setdefault(procedure, []).append(elapsed)
+            self.class_latency.setdefault(job.kind, []).append(elapsed)
+            if info.get('status') == 'error':
+                self.step_errors[procedure] = self.step_errors.get(procedure, 0) + 1
+
+        if info.get('status') == 'cancelled':
+            job.cancelled = True
+        elif info.get('status') == 'expired':
+            job.expired = True
+        elif info.get('status') != 'success':
+            job.error = info.get('error', {}).get('message', info.get('status'))
+        elif job.step + 1 < len(job.steps):
+            job.step += 1
+            self._send_step(job, info.get('output', {}).get('imageURI') or output_uri)
+            return
+
+        job.finished = time.perf_counter()
+        self._done.release()
+
+    def wait_one(self, timeout):
+        return self._done.acquire(timeout=timeout)
+
+
+def run_load(jobs, transport, tool_queues, msg_priority, cancel_exchange, concurrency=None, rate=None, timeout=600,
+             preview_deadline_ms=None, content_type=None):
+    driver = Driver(transport, tool_queues, msg_priority, cancel_exchange, preview_deadline_ms, content_type)
+    transport.start(driver.on_reply)
+
+    started = time.perf_counter()
+    deadline = started + timeout
+    completed = 0
+
+    if rate:
+        def feed():
+            for i, job in enumerate(jobs):
+                delay = started + i / rate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                driver.start_job(job)
+
+        threading.Thread(target=feed, name='load-feed', daemon=True).start()
+    else:
+        for job in jobs[:concurrency]:
+            driver.start_job(job)
+
+    next_job = concurrency or 0
+    while completed < len(jobs):
+        if not driver.wait_one(max(0.0, deadline - time.perf_counter())):
+            break
+        completed += 1
+        if not rate and next_job < len(jobs):
+            driver.start_job(jobs[next_job])
+            next_job += 1
+
+    duration = time.perf_counter() - started
+    transport.stop()
+
+    finished = [job for job in driver.jobs if job.finished is not None]
+    chains = {}
+    for job in finished:
+        chains.setdefault(job.chain, []).append(job)
+
+    return {
+        'duration_s': duration,
+        'jobs': len(jobs),
+        'completed': len(finished),
+        'failed': sum(1 for job in finished if job.error),
+        'cancelled': sum(1 for job in finished if job.cancelled),
+        'expired': sum(1 for job in finished if job.expired),
+        'timed_out': len(jobs) - len(finished),
+        'throughput_jobs_s': len(finished) / duration if duration else 0.0,
+        'throughput_steps_s': sum(len(v) for v in driver.step_latency.values()) / duration if duration else 0.0,
+        'per_tool': {
+            tool: {**percentiles(lat), 'errors': driver.step_errors.get(tool, 0)}
+            for tool, lat in sorted(driver.step_latency.items())
+        },
+        'per_chain': {
+            chain: {**percentiles([j.finished - j.started for j in js]), 'errors': sum(1 for j in js if j.error)}
+            for chain, js in sorted(chains.items())
+        },
+        # step latency (queue wait + processing) per priority class
+        'per_priority': {kind: percentiles(lat) for kind, lat in sorted(driver.class_latency.items())},
+    }
+
+
+# --------------------------------------------------------------------- input
+
+def generate_jobs(spec, count, megapixels, workdir, preview_share=0.0, supersede=False):
+    """
+    spec: comma-separated chains of '>'-joined tools, assigned round-robin.
+    preview_share: fraction of jobs sent as previews, spread evenly.
+    supersede: each preview gets a cancel token newer than the previous one.
+    """
+    chains = [[t for t in chain.split('>') if t] for chain in spec.split(',') if chain]
+    input_uri = os.path.join(workdir, f'input-{megapixels}mp.png')
+    synthetic_image(megapixels, 'RGB').save(input_uri)
+
+    # tombstones outlive a run in the workers' process, so every run gets its own scope
+    scope = f'load-{uuid.uuid4().hex[:8]}:preview'
+    jobs = []
+    for i in range(count):
+        steps = [{'procedure': tool, 'parameters': dict(DEFAULT_PARAMS.get(tool, {}))} for tool in chains[i % len(chains)]]
+        kind = 'preview' if int((i + 1) * preview_share) > int(i * preview_share) else 'request'
+        cancel = {'scope': scope, 'token': i} if supersede and kind == 'preview' else None
+        jobs.append(Job(i, input_uri, steps, workdir, kind, cancel))
+    return jobs
+
+
+def replay_jobs(path, workdir, repeat=1):
+    entries = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                entries.append(json.loads(line))
+
+    jobs = []
+    for r in range(repeat):
+        for entry in entries:
+            if 'chain' in entry:
+                steps = entry['chain']
+                input_uri = entry['inputImageURI']
+            else:
+                params = dict(entry.get('parameters', {}))
+                input_uri = params.pop('inputImageURI')
+                params.pop('outputImageURI', None)
+                steps = [{'procedure': entry['procedure'], 'parameters': params}]
+            kind = 'preview' if str(entry.get('messageId', entry.get('kind', ''))).startswith('preview') else 'request'
+            jobs.append(Job(len(jobs), input_uri, steps, workdir, kind, entry.get('cancel')))
+    return jobs
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--generate', help="chains to generate, e.g. 'brightness>rotate,resize'")
+    source.add_argument('--replay', help='JSONL file of tool messages or chains')
+    parser.add_argument('--jobs', type=int, default=100, help='generated jobs per run')
+    parser.add_argument('--repeat', type=int, default=1, help='times to replay the file per run')
+    parser.add_argument('--size', type=int, default=1, help='megapixels of generated inputs')
+    parser.add_argument('--preview-share', type=float, default=0.0, help='fraction of generated jobs sent as previews')
+    parser.add_argument('--supersede', action='store_true', help='each preview supersedes the previous ones')
+    parser.add_argument('--preview-deadline-ms', type=int, default=None, help='deadline and TTL of preview messages')
+    parser.add_argument('--broker', choices=('fake', 'rabbitmq'), default='fake')
+    parser.add_argument('--wire', choices=('json', 'msgpack'), default='json',
+                        help='encoding of tool messages (msgpack is sent with content_type application/msgpack)')
+    parser.add_argument('--workers', default='1', help='worker counts per tool, comma-separated (scaling sweep)')
+    parser.add_argument('--tool-host', action='store_true',
+                        help='serve all tools from one tool host; --workers is then its total process count')
+    parser.add_argument('--no-workers', action='store_true', help='do not start workers (they already run elsewhere)')
+    load = parser.add_mutually_exclusive_group()
+    load.add_argument('--concurrency', type=int, default=None, help='jobs in flight (closed loop, default 8)')
+    load.add_argument('--rate', type=float, default=None, help='jobs started per second (open loop)')
+    parser.add_argument('--timeout', type=float, default=600)
+    parser.add_argument('--output', default=None, help='report JSON')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    concurrency = args.concurrency or (None if args.rate else 8)
+
+    if TOOLS_DIR not in sys.path:
+        sys.path.insert(0, TOOLS_DIR)
+    from utils.tool_msg import ToolMSG, MAX_PRIORITY, CANCEL_EXCHANGE, msg_priority
+
+    runs = []
+    for workers in [int(w) for w in args.workers.split(',') if w]:
+        with tempfile.TemporaryDirectory(prefix='tool-load-') as workdir:
+            if args.generate:
+                jobs = generate_jobs(args.generate, args.jobs, args.size, workdir, args.preview_share, args.supersede)
+            else:
+                jobs = replay_jobs(args.replay, workdir, args.repeat)
+            tools = sorted({step['procedure'] for job in jobs for step in job.steps})
+
+            procs, tool_msgs = [], []
+            if args.broker == 'fake':
+                broker = FakeBroker()
+                install(broker)
+                # as rabbitMQ/definitions.json does before any tool connects
+                for tool in tools:
+                    broker.declare(ToolMSG.queues[tool], MAX_PRIORITY, dead_letter=PROJECT_QUEUE)
+                if not args.no_workers:
+                    if args.tool_host:
+                        tool_msgs = start_tool_host(tools, workers)
+                    else:
+                        tool_msgs = start_thread_workers(tools, workers)
+                transport = FakeTransport(broker)
+            else:
+                from utils import env
+                if not args.no_workers:
+                    procs = start_process_workers(tools, workers)
+                    time.sleep(2)
+                transport = RabbitTransport(env.RABBITMQ_HOST, env.RABBITMQ_PORT, env.RABBITMQ_USERNAME, env.RABBITMQ_PASSWORD)
+
+            try:
+                result = run_load(jobs, transport, ToolMSG.queues, msg_priority, CANCEL_EXCHANGE, concurrency, args.rate,
+                                  args.timeout, args.preview_deadline_ms, WIRE_CONTENT_TYPES[args.wire])
+            finally:
+                for proc in procs:
+                    proc.terminate()
+
+        result['workers'] = workers
+        if tool_msgs:
+            result['queue_wait'] = queue_wait(tool_msgs)
+            result['expired_in_worker'] = expired_counts(tool_msgs)
+            result['expired_in_broker'] = dict(broker.expired)
+        runs.append(result)
+
+        print(f'\nworkers/tool={workers}: {result["completed"]}/{result["jobs"]} jobs in {result["duration_s"]:.1f}s '
+              f'-> {result["throughput_jobs_s"]:.2f} jobs/s, {result["throughput_steps_s"]:.2f} steps/s '
+              f'({result["failed"]} failed, {result["cancelled"]} cancelled, {result["expired"]} expired, {result["timed_out"]} timed out)')
+        for scope in ('per_tool', 'per_chain', 'per_priority'):
+            for name, stats in result[scope].items():
+                if stats['count']:
+                    print(f'  {name:<40} n={stats["count"]:<5} p50 {stats["p50_ms"]:8.1f}ms  '
+                          f'p95 {stats["p95_ms"]:8.1f}ms  p99 {stats["p99_ms"]:8.1f}ms  errors {stats.get("errors", 0)}')
+        for tool, classes in result.get('expired_in_worker', {}).items():
+            print(f'  expired in worker [{tool}] {classes}')
+        if result.get('expired_in_broker'):
+            print(f'  expired in broker {result["expired_in_broker"]}')
+        for cls, stats in result.get('queue_wait', {}).items():
+            print(f'  queue wait [{cls}]{"":<26} n={stats["count"]:<5} mean {stats["mean_ms"]:8.1f}ms  max {stats["max_ms"]:8.1f}ms')
+
+    if len(runs) > 1:
+        print('\nscaling:')
+        for run in runs:
+            print(f'  workers={run["workers"]:<3} {run["throughput_jobs_s"]:8.2f} jobs/s')
+
+    report = {
+        'meta': machine_info(),
+        'config': {k: v for k, v in vars(args).items()},
+        'runs': runs,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print(f'report written to {args.output}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
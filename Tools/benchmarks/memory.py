@@ -0,0 +1,349 @@
+"""
+Peak-memory benchmarks per tool, image size and mode.
+
+Usage (from Tools/):
+
+    python -m benchmarks.memory                        # full matrix, compare with memory_baseline.json
+    python -m benchmarks.memory --sizes 1,12 --tools rotate
+    python -m benchmarks.memory --update-baseline      # record baseline + memory_model.json
+    python -m benchmarks.memory --max-mp 100 --compose # print mem_limit per compose service
+
+Each (case, size, mode) runs in a fresh subprocess so allocator state from
+other cases cannot leak into the numbers. The child builds the tool, decodes
+the input (as Img_Handler.get_img would) and records:
+
+  - base_rss:   RSS after the tool is built (interpreter, libs, model weights)
+  - peak_bytes: peak RSS during the call minus base_rss (input + working set)
+  - tracemalloc peak and top allocation sites, from a second traced call
+
+Peak bytes are fitted per tool/mode as fixed + bytes_per_mp * megapixels; the
+resulting model (memory_model.json) gives each tool's container memory limit
+for a maximum accepted image size. A case whose peak grows past --tolerance
+over the baseline makes the run exit with status 1.
+"""
+
+import os
+import sys
+import gc
+import json
+import math
+import time
+import argparse
+import datetime
+import tempfile
+import threading
+import subprocess
+import tracemalloc
+
+from .corpus import SIZES_MP, MODES, synthetic_image
+from .cases import CASES, select_cases
+from .harness import INPUT_URI, OUTPUT_URI, build_tool, load_module
+from .run import machine_info
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+TOOLS_DIR = os.path.dirname(BENCH_DIR)
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, 'memory_baseline.json')
+DEFAULT_MODEL = os.path.join(BENCH_DIR, 'memory_model.json')
+DEFAULT_TOLERANCE = 0.10
+DEFAULT_HEADROOM = 1.25
+TOP_SITES = 10
+MIB = 1024 * 1024
+
+# tool -> docker-compose service
+COMPOSE_SERVICES = {
+    'bg_remove_ai': 'bg_remove_ai_tool',
+    'binarization': 'binarization_tool',
+    'border': 'border_tool',
+    'brightness': 'brightness_tool',
+    'contrast': 'contrast_tool',
+    'cut': 'cut_tool',
+    'cut_ai': 'cut_ai_tool',
+    'expand_ai': 'expand_ai_tool',
+    'obj_ai': 'obj_ai_tool',
+    'people_ai': 'people_ai_tool',
+    'resize': 'resize_tool',
+    'rotate': 'rotate_tool',
+    'saturation': 'saturation_tool',
+    'text_ai': 'text_ai_tool',
+    'upgrade_ai': 'upgrade_ai_tool',
+    'watermark': 'watermark_tool',
+}
+
+
+# ---------------------------------------------------------------- child side
+
+def _status_kib(field):
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1])
+    raise KeyError(field)
+
+
+def _current_rss():
+    try:
+        return _status_kib('VmRSS') * 1024
+    except (OSError, KeyError):
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss if sys.platform == 'darwin' else rss * 1024
+
+
+class PeakRSS:
+    """
+    Peak RSS over a block. On Linux the kernel high-water mark is reset through
+    /proc/self/clear_refs; elsewhere RSS is sampled from a background thread.
+    """
+
+    def __init__(self, interval=0.001):
+        self._interval = interval
+        self._sampler = None
+        self._stop = threading.Event()
+        self.peak = 0
+
+    def __enter__(self):
+        try:
+            with open('/proc/self/clear_refs', 'w') as f:
+                f.write('5')
+            self._hwm = True
+        except OSError:
+            self._hwm = False
+            self.peak = _current_rss()
+            self._sampler = threading.Thread(target=self._sample, daemon=True)
+            self._sampler.start()
+        return self
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, _current_rss())
+            time.sleep(self._interval)
+
+    def __exit__(self, *exc):
+        if self._hwm:
+            self.peak = _status_kib('VmHWM') * 1024
+        else:
+            self._stop.set()
+            self._sampler.join()
+            self.peak = max(self.peak, _current_rss())
+        return False
+
+
+def measure_case(case_key, image_path, workdir):
+    from PIL import Image
+
+    case = next(c for c in CASES if c.key == case_key)
+    tool, handler = build_tool(case.tool)
+
+    gc.collect()
+    base_rss = _current_rss()
+
+    img = Image.open(image_path)
+    with PeakRSS() as peak:
+        img.load()
+        handler.images[INPUT_URI] = img
+        case.run(tool, handler, img, workdir)
+
+    handler.images.pop(OUTPUT_URI, None)
+    gc.collect()
+
+    tracemalloc.start(25)
+    case.run(tool, handler, img, workdir)
+    _, traced_peak = tracemalloc.get_traced_memory()
+    snapshot = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    sites = [
+        {'site': f'{stat.traceback[0].filename}:{stat.traceback[0].lineno}', 'bytes': stat.size, 'count': stat.count}
+        for stat in snapshot.statistics('lineno')[:TOP_SITES]
+    ]
+
+    return {
+        'base_rss': base_rss,
+        'peak_rss': peak.peak,
+        'peak_bytes': max(0, peak.peak - base_rss),
+        'tracemalloc_peak': traced_peak,
+        'top_sites': sites,
+    }
+
+
+# --------------------------------------------------------------- parent side
+
+def run_child(case, image_path, workdir, timeout):
+    cmd = [sys.executable, '-m', 'benchmarks.memory', '--child', case.key, image_path, workdir]
+    proc = subprocess.run(cmd, cwd=TOOLS_DIR, capture_output=True, text=True, timeout=timeout)
+    if proc.returncode != 0:
+        lines = (proc.stderr or proc.stdout).strip().splitlines()
+        raise RuntimeError(lines[-1] if lines else f'exit status {proc.returncode}')
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def fit_model(results):
+    """Least-squares fit of peak_bytes = fixed + bytes_per_mp * MP per tool and mode."""
+    points = {}
+    for key, res in results.items():
+        case_key, rest = key.split('@')
+        tool = case_key.split('.')[0]
+        size, mode = rest.split('/')
+        points.setdefault(tool, {}).setdefault(mode, []).append((float(size[:-2]), res['peak_bytes'], res['base_rss']))
+
+    model = {}
+    for tool, modes in sorted(points.items()):
+        entry = {'modes': {}}
+        for mode, pts in sorted(modes.items()):
+            n = len(pts)
+            mean_x = sum(p[0] for p in pts) / n
+            mean_y = sum(p[1] for p in pts) / n
+            var_x = sum((p[0] - mean_x) ** 2 for p in pts)
+            slope = sum((p[0] - mean_x) * (p[1] - mean_y) for p in pts) / var_x if var_x else mean_y / max(mean_x, 1)
+            fixed = max(0.0, mean_y - slope * mean_x)
+            entry['modes'][mode] = {'bytes_per_mp': round(slope), 'fixed_bytes': round(fixed), 'points': n}
+        entry['bytes_per_mp'] = max(m['bytes_per_mp'] for m in entry['modes'].values())
+        entry['fixed_bytes'] = max(m['fixed_bytes'] for m in entry['modes'].values())
+        entry['base_rss'] = max(p[2] for pts in modes.values() for p in pts)
+        model[tool] = entry
+    return model
+
+
+def recommended_limit(entry, max_mp, headroom):
+    need = entry['base_rss'] + entry['fixed_bytes'] + entry['bytes_per_mp'] * max_mp
+    return int(math.ceil(need * headroom / (64 * MIB)) * 64 * MIB)
+
+
+def compare(results, baseline, tolerance):
+    regressions, rows = [], []
+    for key, cur in sorted(results.items()):
+        base = baseline.get(key)
+        if base is None:
+            continue
+        ratio = cur['peak_bytes'] / base['peak_bytes'] if base['peak_bytes'] > 0 else float('inf')
+        rows.append((key, base['peak_bytes'], cur['peak_bytes'], ratio))
+        # ignore sub-MiB wobble of the tiny cases (page granularity, allocator caches)
+        if ratio > 1 + tolerance and cur['peak_bytes'] - base['peak_bytes'] > MIB:
+            regressions.append(key)
+    return regressions, rows
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tools', default='', help='comma-separated tool names (default: all)')
+    parser.add_argument('--sizes', default=','.join(str(s) for s in SIZES_MP), help='megapixels, comma-separated')
+    parser.add_argument('--modes', default=','.join(MODES), help='PIL modes, comma-separated')
+    parser.add_argument('--timeout', type=float, default=600, help='per-case subprocess timeout (s)')
+    parser.add_argument('--output', default=None, help='results JSON (default: benchmarks/results/memory-<timestamp>.json)')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--model', default=DEFAULT_MODEL, help='bytes-per-megapixel model written with --update-baseline')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='allowed peak growth before failing (0.10 = 10%%)')
+    parser.add_argument('--max-mp', type=float, default=max(SIZES_MP), help='largest image accepted, for --compose')
+    parser.add_argument('--headroom', type=float, default=DEFAULT_HEADROOM)
+    parser.add_argument('--compose', action='store_true', help='print mem_limit per docker-compose service and exit')
+    parser.add_argument('--update-baseline', action='store_true')
+    parser.add_argument('--child', nargs=3, metavar=('CASE', 'IMAGE', 'WORKDIR'), help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def print_compose_limits(model, max_mp, headroom):
+    print(f'# mem_limit for inputs up to {max_mp:g} MP (headroom x{headroom:g})')
+    for tool, entry in sorted(model.items()):
+        limit = recommended_limit(entry, max_mp, headroom)
+        print(f'{COMPOSE_SERVICES.get(tool, tool)}:\n  mem_limit: {limit // MIB}m'
+              f'  # {entry["bytes_per_mp"] / MIB:.1f} MiB/MP + {(entry["base_rss"] + entry["fixed_bytes"]) / MIB:.0f} MiB')
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.child:
+        case_key, image_path, workdir = args.child
+        print(json.dumps(measure_case(case_key, image_path, workdir)))
+        return 0
+
+    if args.compose:
+        with open(args.model) as f:
+            print_compose_limits(json.load(f)['tools'], args.max_mp, args.headroom)
+        return 0
+
+    tools = [t for t in args.tools.split(',') if t]
+    sizes = [int(s) for s in args.sizes.split(',') if s]
+    modes = [m for m in args.modes.split(',') if m]
+    cases = select_cases(tools)
+
+    skipped = {}
+    for tool in sorted({case.tool for case in cases}):
+        try:
+            load_module(tool)
+        except Exception as e:
+            skipped[tool] = f'{type(e).__name__}: {e}'
+            print(f'[skip] {tool}: {skipped[tool]}')
+    cases = [case for case in cases if case.tool not in skipped]
+
+    results, errors = {}, {}
+    with tempfile.TemporaryDirectory(prefix='tool-mem-') as workdir:
+        for megapixels in sizes:
+            for mode in modes:
+                # uncompressed TIFF keeps the child's decode cheap and lossless for every mode
+                image_path = os.path.join(workdir, f'{megapixels}mp-{mode}.tiff')
+                synthetic_image(megapixels, mode).save(image_path, format='TIFF')
+
+                for case in cases:
+                    key = f'{case.key}@{megapixels}MP/{mode}'
+                    try:
+                        results[key] = run_child(case, image_path, workdir, args.timeout)
+                        res = results[key]
+                        print(f'{key:<60} peak {res["peak_bytes"] / MIB:9.1f} MiB  base {res["base_rss"] / MIB:7.1f} MiB')
+                    except Exception as e:
+                        errors[key] = f'{type(e).__name__}: {e}'
+                        print(f'{key:<60} {"error":>14}  {errors[key]}')
+
+                os.remove(image_path)
+
+    model = fit_model(results)
+    report = {'meta': machine_info(), 'results': results, 'skipped': skipped, 'errors': errors, 'model': model}
+
+    output = args.output
+    if output is None:
+        results_dir = os.path.join(BENCH_DIR, 'results')
+        os.makedirs(results_dir, exist_ok=True)
+        output = os.path.join(results_dir, f'memory-{datetime.datetime.now().strftime("%Y%m%d-%H%M%S")}.json')
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print(f'results written to {output}')
+
+    if args.update_baseline:
+        baseline = {'meta': report['meta'], 'results': {}}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline['results'] = json.load(f).get('results', {})
+        # sites are useful in the run report, not in the committed baseline
+        baseline['results'].update({
+            key: {k: v for k, v in res.items() if k != 'top_sites'} for key, res in results.items()
+        })
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write('\n')
+        with open(args.model, 'w') as f:
+            json.dump({'meta': report['meta'], 'tools': fit_model(baseline['results'])}, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f'baseline updated: {args.baseline}; model: {args.model}')
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f'no baseline at {args.baseline}, nothing to compare')
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions, rows = compare(results, baseline.get('results', {}), args.tolerance)
+    print(f'\n{"case":<60} {"baseline":>11} {"current":>11} {"ratio":>7}')
+    for key, base_b, cur_b, ratio in rows:
+        flag = '  REGRESSION' if key in regressions else ''
+        print(f'{key:<60} {base_b / MIB:8.1f}MiB {cur_b / MIB:8.1f}MiB {ratio:7.2f}{flag}')
+
+    if regressions:
+        print(f'\n{len(regressions)} case(s) use more than {args.tolerance:.0%} extra peak memory')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,207 @@
+"""
+Microbenchmarks for every tool's core image function (no RabbitMQ).
+
+Usage (from Tools/):
+
+    python -m benchmarks.run                       # full matrix, compare with baseline.json
+    python -m benchmarks.run --sizes 1 --tools rotate,resize
+    python -m benchmarks.run --update-baseline     # record the current numbers as baseline
+
+Every case in cases.CASES runs against the synthetic corpus (1, 12 and 48 MP in
+RGB, RGBA and P by default). Results are written as JSON; when a baseline is
+given, any case whose median is more than --threshold (and --min-delta-ms)
+slower makes the run exit with status 1. Tools whose dependencies (torch,
+rembg, ultralytics, tesseract, ...) are not installed are reported as skipped.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import datetime
+import platform
+import statistics
+import tempfile
+
+import numpy
+import PIL
+
+from .corpus import SIZES_MP, MODES, synthetic_image, dimensions
+from .cases import select_cases
+from .harness import INPUT_URI, OUTPUT_URI, build_tool
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, 'baseline.json')
+DEFAULT_RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+DEFAULT_THRESHOLD = 0.15
+# slowdowns smaller than this are timer/scheduler noise on the small images
+DEFAULT_MIN_DELTA_MS = 5.0
+
+
+def result_key(case, megapixels, mode):
+    return f'{case.key}@{megapixels}MP/{mode}'
+
+
+def machine_info():
+    return {
+        'python': platform.python_version(),
+        'pillow': PIL.__version__,
+        'numpy': numpy.__version__,
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+    }
+
+
+def time_case(case, tool, handler, img, workdir, repeat, warmup):
+    handler.images[INPUT_URI] = img
+    for _ in range(warmup):
+        case.run(tool, handler, img, workdir)
+
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        case.run(tool, handler, img, workdir)
+        runs.append(time.perf_counter() - start)
+        # drop the output so it doesn't inflate the next run's memory
+        handler.images.pop(OUTPUT_URI, None)
+
+    return {
+        'median_s': statistics.median(runs),
+        'min_s': min(runs),
+        'mean_s': statistics.fmean(runs),
+        'stdev_s': statistics.stdev(runs) if len(runs) > 1 else 0.0,
+        'runs': len(runs),
+    }
+
+
+def run_benchmarks(cases, sizes, modes, repeat, warmup, log=print):
+    results, skipped, errors = {}, {}, {}
+    tools = {}
+
+    for case in cases:
+        if case.tool in tools or case.tool in skipped:
+            continue
+        try:
+            tools[case.tool] = build_tool(case.tool)
+        except Exception as e:
+            skipped[case.tool] = f'{type(e).__name__}: {e}'
+            log(f'[skip] {case.tool}: {skipped[case.tool]}')
+
+    with tempfile.TemporaryDirectory(prefix='tool-bench-') as workdir:
+        for megapixels in sizes:
+            for mode in modes:
+                img = synthetic_image(megapixels, mode)
+                img.load()
+                for case in cases:
+                    if case.tool not in tools:
+                        continue
+                    key = result_key(case, megapixels, mode)
+                    tool, handler = tools[case.tool]
+                    try:
+                        results[key] = time_case(case, tool, handler, img, workdir, repeat, warmup)
+                        log(f'{key:<60} {results[key]["median_s"] * 1000:10.1f} ms')
+                    except Exception as e:
+                        errors[key] = f'{type(e).__name__}: {e}'
+                        log(f'{key:<60} {"error":>10}  {errors[key]}')
+
+    return results, skipped, errors
+
+
+def compare(results, baseline, threshold, min_delta_ms=DEFAULT_MIN_DELTA_MS):
+    """Return (regressions, rows) comparing medians of the cases present in both."""
+    regressions, rows = [], []
+    for key, cur in sorted(results.items()):
+        base = baseline.get(key)
+        if base is None:
+            continue
+        ratio = cur['median_s'] / base['median_s'] if base['median_s'] > 0 else float('inf')
+        rows.append((key, base['median_s'], cur['median_s'], ratio))
+        if ratio > 1 + threshold and (cur['median_s'] - base['median_s']) * 1000 > min_delta_ms:
+            regressions.append(key)
+    return regressions, rows
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tools', default='', help='comma-separated tool names (default: all)')
+    parser.add_argument('--sizes', default=','.join(str(s) for s in SIZES_MP), help='megapixels, comma-separated')
+    parser.add_argument('--modes', default=','.join(MODES), help='PIL modes, comma-separated')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--output', default=None, help='results JSON (default: benchmarks/results/<timestamp>.json)')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='allowed median slowdown before failing (0.15 = 15%%)')
+    parser.add_argument('--min-delta-ms', type=float, default=DEFAULT_MIN_DELTA_MS,
+                        help='ignore slowdowns smaller than this many milliseconds')
+    parser.add_argument('--update-baseline', action='store_true',
+                        help='merge the current results into the baseline file instead of comparing')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    tools = [t for t in args.tools.split(',') if t]
+    sizes = [int(s) for s in args.sizes.split(',') if s]
+    modes = [m for m in args.modes.split(',') if m]
+
+    print(f'sizes: {", ".join(f"{s}MP ({dimensions(s)[0]}x{dimensions(s)[1]})" for s in sizes)}; modes: {", ".join(modes)}')
+    results, skipped, errors = run_benchmarks(select_cases(tools), sizes, modes, args.repeat, args.warmup)
+
+    report = {
+        'meta': machine_info(),
+        'config': {'sizes': sizes, 'modes': modes, 'repeat': args.repeat, 'warmup': args.warmup},
+        'results': results,
+        'skipped': skipped,
+        'errors': errors,
+    }
+
+    output = args.output
+    if output is None:
+        os.makedirs(DEFAULT_RESULTS_DIR, exist_ok=True)
+        stamp = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+        output = os.path.join(DEFAULT_RESULTS_DIR, f'{stamp}.json')
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print(f'results written to {output}')
+
+    if args.update_baseline:
+        baseline = {'meta': report['meta'], 'results': {}}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline['results'] = json.load(f).get('results', {})
+        baseline['results'].update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f'baseline updated: {args.baseline}')
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f'no baseline at {args.baseline}, nothing to compare')
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get('meta', {}).get('machine') != report['meta']['machine'] \
+            or baseline.get('meta', {}).get('cpu_count') != report['meta']['cpu_count']:
+        print('warning: baseline was recorded on a different machine, ratios may not be meaningful')
+
+    regressions, rows = compare(results, baseline.get('results', {}), args.threshold, args.min_delta_ms)
+    print(f'\n{"case":<60} {"baseline":>10} {"current":>10} {"ratio":>7}')
+    for key, base_s, cur_s, ratio in rows:
+        flag = '  REGRESSION' if key in regressions else ''
+        print(f'{key:<60} {base_s * 1000:8.1f}ms {cur_s * 1000:8.1f}ms {ratio:7.2f}{flag}')
+
+    if regressions:
+        print(f'\n{len(regressions)} case(s) slower than baseline by more than {args.threshold:.0%}')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
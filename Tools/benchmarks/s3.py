@@ -0,0 +1,210 @@
+"""
+Check of the s3:// image path (utils/s3.py) against a local S3 stand-in.
+
+Usage (from Tools/):
+
+    python -m benchmarks.s3                                     # in-process moto server
+    python -m benchmarks.s3 --endpoint http://localhost:9000    # a running MinIO (S3_ACCESS_KEY/S3_SECRET_KEY)
+
+Without --endpoint a moto server (pip install "moto[server]") is started on a
+free local port. Every S3 request the client makes is counted, and:
+
+  - a header probe (admission.read_header) must cost a single small ranged
+    GET, with no HEAD;
+  - a full decode must return the pixels of the same file read from disk, in
+    at most --max-read-requests GETs (the ranged reads grow as they go);
+  - an output over the multipart threshold must go up as a multipart upload
+    of several parts, and a small one as a single PUT with its content type,
+    both reading back byte for byte;
+  - a missing key or bucket must raise FileNotFoundError, an empty object
+    read as empty, and a write whose block raised must upload nothing.
+
+Any failed check makes the run exit with status 1.
+"""
+
+import io
+import sys
+import logging
+import socket
+import argparse
+import collections
+
+from PIL import Image
+
+import utils.env as env
+import utils.s3 as s3
+from utils import admission
+from utils.img_handler import Img_Handler
+
+from .corpus import synthetic_image
+
+BUCKET = 'picturas-bench'
+DEFAULT_MEGAPIXELS = 12
+DEFAULT_MAX_READ_REQUESTS = 32
+# S3's smallest multipart part
+MULTIPART_MB = 5
+
+
+class RequestLog:
+    """S3 operations and GetObject bytes, from the client's event hooks."""
+
+    def __init__(self, client):
+        self.calls = collections.Counter()
+        self.read_bytes = 0
+        client.meta.events.register('before-call.s3', self._before)
+        client.meta.events.register('after-call.s3.GetObject', self._after_get)
+
+    def _before(self, model, **kwargs):
+        self.calls[model.name] += 1
+
+    def _after_get(self, parsed, **kwargs):
+        self.read_bytes += parsed.get('ContentLength', 0)
+
+    def reset(self):
+        self.calls.clear()
+        self.read_bytes = 0
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_moto():
+    from moto.server import ThreadedMotoServer
+
+    # the server's per-request access log
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    port = free_port()
+    server = ThreadedMotoServer(ip_address='127.0.0.1', port=port, verbose=False)
+    server.start()
+    return server, f'http://127.0.0.1:{port}'
+
+
+def png_bytes(img):
+    fp = io.BytesIO()
+    img.save(fp, format='PNG')
+    return fp.getvalue()
+
+
+def check_reads(client, log, img):
+    uri = f's3://{BUCKET}/input.png'
+    data = png_bytes(img)
+    client.put_object(Bucket=BUCKET, Key='input.png', Body=data)
+
+    log.reset()
+    header = admission.read_header(uri)
+    yield ('header probe', header[:2] == img.size and log.calls['GetObject'] == 1 and not log.calls['HeadObject'],
+           f"{log.calls['GetObject']} GET, {log.calls['HeadObject']} HEAD, {log.read_bytes / 1024:.0f} KiB of "
+           f"{len(data) / 1024:.0f} KiB")
+
+    log.reset()
+    decoded = Img_Handler().get_img(uri)
+    decoded.load()
+    same = decoded.tobytes() == Image.open(io.BytesIO(data)).tobytes()
+    yield ('full decode', same and log.calls['GetObject'] <= ARGS.max_read_requests and log.read_bytes == len(data),
+           f"{log.calls['GetObject']} GETs, {log.read_bytes / 1024:.0f} KiB read" + ('' if same else ', pixels differ'))
+
+
+def check_writes(client, log, img):
+    # BMP: an uncompressed output, over the threshold whatever the pixels
+    env.S3_MULTIPART_THRESHOLD_MB = MULTIPART_MB
+    env.S3_MULTIPART_CHUNK_MB = MULTIPART_MB
+    expected = io.BytesIO()
+    img.save(expected, format='BMP')
+    expected = expected.getvalue()
+
+    log.reset()
+    Img_Handler().write_img(img, f's3://{BUCKET}/output.bmp')
+    body = client.get_object(Bucket=BUCKET, Key='output.bmp')['Body'].read()
+    parts = log.calls['UploadPart']
+    yield ('multipart upload', log.calls['CreateMultipartUpload'] == 1 and parts >= 2 and body == expected,
+           f"{parts} parts of {MULTIPART_MB} MiB for {len(expected) / 2 ** 20:.1f} MiB"
+           + ('' if body == expected else ', content differs'))
+
+    small = img.resize((64, 48))
+    log.reset()
+    Img_Handler().write_img(small, f's3://{BUCKET}/small.png')
+    response = client.get_object(Bucket=BUCKET, Key='small.png')
+    same = response['Body'].read() == png_bytes(small)
+    yield ('single upload', log.calls['PutObject'] == 1 and not log.calls['CreateMultipartUpload'] and same
+           and response['ContentType'] == 'image/png', f"content type {response['ContentType']}")
+
+
+def check_errors(client, log):
+    for name, uri in (('missing key', f's3://{BUCKET}/missing.png'), ('missing bucket', 's3://no-such-bucket/a.png')):
+        try:
+            Img_Handler().get_img(uri)
+            yield name, False, 'no error'
+        except FileNotFoundError as e:
+            yield name, True, str(e)
+        except Exception as e:
+            yield name, False, f'{type(e).__name__}: {e}'
+
+    client.put_object(Bucket=BUCKET, Key='empty.png', Body=b'')
+    with s3.open_read(f's3://{BUCKET}/empty.png') as fp:
+        data = fp.read()
+    yield 'empty object', data == b'', f'{len(data)} bytes'
+
+    try:
+        with s3.open_write(f's3://{BUCKET}/aborted.png') as fp:
+            fp.write(b'partial')
+            raise RuntimeError('encoder failed')
+    except RuntimeError:
+        pass
+    listed = client.list_objects_v2(Bucket=BUCKET, Prefix='aborted.png').get('KeyCount', 0)
+    yield 'aborted write', listed == 0, f'{listed} object(s) left'
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--endpoint', default='', help='S3 endpoint to test against (default: a local moto server)')
+    parser.add_argument('--megapixels', type=int, default=DEFAULT_MEGAPIXELS)
+    parser.add_argument('--max-read-requests', type=int, default=DEFAULT_MAX_READ_REQUESTS,
+                        help='GETs allowed for a full decode')
+    return parser.parse_args(argv)
+
+
+ARGS = None
+
+
+def main(argv=None):
+    global ARGS
+    ARGS = parse_args(argv)
+
+    server = None
+    endpoint = ARGS.endpoint
+    if not endpoint:
+        server, endpoint = start_moto()
+        env.S3_ACCESS_KEY = env.S3_SECRET_KEY = 'test'
+    env.S3_ENDPOINT_URL = endpoint
+    s3._client = None
+
+    try:
+        client = s3.client()
+        log = RequestLog(client)
+        if BUCKET not in {b['Name'] for b in client.list_buckets().get('Buckets', [])}:
+            client.create_bucket(Bucket=BUCKET)
+
+        img = synthetic_image(ARGS.megapixels, 'RGB')
+        failures = []
+        for name, ok, detail in [*check_reads(client, log, img), *check_writes(client, log, img),
+                                 *check_errors(client, log)]:
+            print(f'{name:<20} {"ok" if ok else "FAIL":<5} {detail}')
+            if not ok:
+                failures.append(name)
+    finally:
+        if server is not None:
+            server.stop()
+
+    print(f'\nendpoint: {endpoint}; input: {ARGS.megapixels}MP ({img.width}x{img.height})')
+    if failures:
+        print(f'{len(failures)} failed check(s): {", ".join(failures)}')
+        return 1
+    print('s3 path ok')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
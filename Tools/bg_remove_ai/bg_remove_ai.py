@@ -1,5 +1,4 @@
 import sys
-import json
 import datetime
 import pytz
 
@@ -8,6 +7,7 @@ import utils.env as env
 
 from utils.img_handler import Img_Handler
 from utils.tool_msg import ToolMSG
+import utils.progressive as progressive
 
 class Background_Remove_AI:
     def __init__(self):
@@ -29,15 +29,12 @@ class Background_Remove_AI:
         new_image = remove(image)
         self._img_handler.store_img(new_image, store_image_path)
 
-    def background_remove_callback(self, ch, method, properties, body):
-        json_str = body.decode()
-        info = json.loads(json_str)
-        
-        msg_id = info['messageId']
-        timestamp = datetime.datetime.fromisoformat(info['timestamp'])
-        procedure = info['procedure']
-        img_path = info['parameters']['inputImageURI']
-        store_img_path = info['parameters']['outputImageURI']
+    def background_remove_callback(self, ch, method, properties, info):
+        msg_id = info.messageId
+        timestamp = info.timestamp
+        procedure = info.procedure
+        img_path = info.parameters.inputImageURI
+        store_img_path = info.parameters.outputImageURI
 
         resp_msg_id = f'bg-remove-ai-{self._counter}-{msg_id}'
         self._counter += 1
@@ -47,10 +44,14 @@ class Background_Remove_AI:
             processing_time = (cur_timestamp - timestamp).total_seconds() * 1000
             cur_timestamp = cur_timestamp.isoformat()
 
-            self._tool_msg.send_msg(msg_id, resp_msg_id, cur_timestamp, 'error', processing_time, None, self._codes['wrong_procedure'], "The procedure received does not fit into this tool", img_path)
+            self._tool_msg.send_msg(msg_id, resp_msg_id, cur_timestamp, 'error', processing_time, None, err_code=self._codes['wrong_procedure'], err_msg="The procedure received does not fit into this tool", og_img_uri=img_path)
             return
 
         try:
+            # progressive previews: the cut-out of a downscaled proxy first
+            progressive.send_proxy_result(self._tool_msg, info, resp_msg_id, img_path, store_img_path,
+                                          lambda src, dst, scale: self.background_remove(src, dst))
+
             self.background_remove(img_path, store_img_path)
 
             cur_timestamp = datetime.datetime.now(pytz.utc)
@@ -63,7 +64,7 @@ class Background_Remove_AI:
             processing_time = (cur_timestamp - timestamp).total_seconds() * 1000
             cur_timestamp = cur_timestamp.isoformat()
 
-            self._tool_msg.send_msg(msg_id, resp_msg_id, cur_timestamp, 'error', processing_time, None, self._codes['error_processing'], "An error occured while processing the request", img_path)
+            self._tool_msg.send_msg(msg_id, resp_msg_id, cur_timestamp, 'error', processing_time, None, err_code=self._codes['error_processing'], err_msg="An error occured while processing the request", og_img_uri=img_path)
 
     def exec(self, args):
         while True:
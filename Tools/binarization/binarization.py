@@ -1,5 +1,4 @@
 import sys
-import json
 import datetime
 
 import pytz
@@ -26,26 +25,21 @@ class Binarization:
         }
 
     def add_binarization(self, img_path, output_path, threshold):
-        # load image
-        img = self._img_handler.get_img(img_path)
-
-        # add binarization
-        new_img = ImageOps.grayscale(img)
-        new_img = new_img.point(lambda x: 0 if x < threshold else 255)
-
-        # save image
-        self._img_handler.store_img(new_img, output_path)
-
-    def binarization_callback(self, ch, method, properties, body):
-        json_str = body.decode()
-        info = json.loads(json_str)
-
-        msg_id = info['messageId']
-        timestamp = datetime.datetime.fromisoformat(info['timestamp'])
-        procedure = info['procedure']
-        img_path = info['parameters']['inputImageURI']
-        store_img_path = info['parameters']['outputImageURI']
-        threshold = info['parameters']['threshold']
+        def binarize(img):
+            # add binarization
+            new_img = ImageOps.grayscale(img)
+            return new_img.point(lambda x: 0 if x < threshold else 255)
+
+        # load image, binarize every frame and save it
+        self._img_handler.apply(img_path, output_path, binarize)
+
+    def binarization_callback(self, ch, method, properties, info):
+        msg_id = info.messageId
+        timestamp = info.timestamp
+        procedure = info.procedure
+        img_path = info.parameters.inputImageURI
+        store_img_path = info.parameters.outputImageURI
+        threshold = info.parameters.threshold
 
         resp_msg_id = f'binarization-{self._counter}-{msg_id}'
         self._counter += 1
@@ -55,7 +49,7 @@ class Binarization:
             processing_time = (cur_timestamp - timestamp).total_seconds() * 1000
             cur_timestamp = cur_timestamp.isoformat()
 
-            self._tool_msg.send_msg(msg_id, resp_msg_id, cur_timestamp, 'error', processing_time, None, self._codes['wrong_procedure'], "The procedure received does not fit into this tool", img_path)
+            self._tool_msg.send_msg(msg_id, resp_msg_id, cur_timestamp, 'error', processing_time, None, err_code=self._codes['wrong_procedure'], err_msg="The procedure received does not fit into this tool", og_img_uri=img_path)
             return
 
         try:
@@ -71,7 +65,7 @@ class Binarization:
             processing_time = (cur_timestamp - timestamp).total_seconds() * 1000
             cur_timestamp = cur_timestamp.isoformat()
 
-            self._tool_msg.send_msg(msg_id, resp_msg_id, cur_timestamp, 'error', processing_time, None, self._codes['error_processing'], str(e), img_path)
+            self._tool_msg.send_msg(msg_id, resp_msg_id, cur_timestamp, 'error', processing_time, None, err_code=self._codes['error_processing'], err_msg=str(e), og_img_uri=img_path)
 
     def exec(self, args):
         while True:
@@ -1,6 +1,5 @@
 from PIL import Image, ImageOps
 import sys
-import json
 import datetime
 import pytz
 from utils.img_handler import Img_Handler
@@ -20,29 +19,24 @@ class Border:
         }
 
     def add_border(self, img_path, output_path, border_color, border_width):
-        # get image
-        img = self._img_handler.get_img(img_path)
-        
-        # add border
-        image_with_border = ImageOps.expand(img, border=border_width, fill=border_color)
-        
-        # save image
-        self._img_handler.store_img(image_with_border, output_path)
+        def expand(img):
+            # add border
+            return ImageOps.expand(img, border=border_width, fill=border_color)
+
+        # get image, add the border to every frame and save it
+        self._img_handler.apply(img_path, output_path, expand)
 
     #########################################
-    def border_callback(self, ch, method, properties, body):
-        json_str = body.decode()
-        info = json.loads(json_str)
-        
-        msg_id = info['messageId']
-        timestamp = datetime.datetime.fromisoformat(info['timestamp'])
-        procedure = info['procedure']
-        img_path = info['parameters']['inputImageURI']
-        store_img_path = info['parameters']['outputImageURI']
-        border_width = info['parameters']['borderWidth']
-        r = info['parameters']['r']
-        g = info['parameters']['g']
-        b = info['parameters']['b']
+    def border_callback(self, ch, method, properties, info):
+        msg_id = info.messageId
+        timestamp = info.timestamp
+        procedure = info.procedure
+        img_path = info.parameters.inputImageURI
+        store_img_path = info.parameters.outputImageURI
+        border_width = info.parameters.borderWidth
+        r = info.parameters.r
+        g = info.parameters.g
+        b = info.parameters.b
         border_color = (r, g, b)
         
         resp_msg_id = f'border-{self._counter}-{msg_id}'
@@ -53,7 +47,7 @@ class Border:
             processing_time = (cur_timestamp - timestamp).total_seconds() * 1000
             cur_timestamp = cur_timestamp.isoformat()
 
-            self._tool_msg.send_msg(msg_id, resp_msg_id, cur_timestamp, 'error', processing_time, None, self._codes['wrong_procedure'], "The procedure received does not fit into this tool", img_path)
+            self._tool_msg.send_msg(msg_id, resp_msg_id, cur_timestamp, 'error', processing_time, None, err_code=self._codes['wrong_procedure'], err_msg="The procedure received does not fit into this tool", og_img_uri=img_path)
             return
 
         try:
@@ -69,7 +63,7 @@ class Border:
             processing_time = (cur_timestamp - timestamp).total_seconds() * 1000
             cur_timestamp = cur_timestamp.isoformat()
             
-            self._tool_msg.send_msg(msg_id, resp_msg_id, cur_timestamp, 'error', processing_time, None, self._codes['error_processing'], "An error occured while processing the request", img_path)
+            self._tool_msg.send_msg(msg_id, resp_msg_id, cur_timestamp, 'error', processing_time, None, err_code=self._codes['error_processing'], err_msg="An error occured while processing the request", og_img_uri=img_path)
 
     def exec(self, args):
         while True:
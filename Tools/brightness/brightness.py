@@ -1,6 +1,5 @@
 import os
 import sys
-import json
 import datetime
 
 import pytz
@@ -27,30 +26,25 @@ class Brightness:
         }
         
     def adjust_brightness(self, img_path, store_img_path, brightness_factor):
-        # Load the image
-        img = self._img_handler.get_img(img_path)
-        
-        # Only convert palette images 
-        if img.mode == 'P':
-            img = img.convert('RGB')
-        
-        # adjust brightness
-        enhancer = ImageEnhance.Brightness(img)
-        new_img = enhancer.enhance(brightness_factor)
-        
-        # save image
-        self._img_handler.store_img(new_img, store_img_path)
+        def adjust(img):
+            # Only convert palette images 
+            if img.mode == 'P':
+                img = img.convert('RGB')
+
+            # adjust brightness
+            enhancer = ImageEnhance.Brightness(img)
+            return enhancer.enhance(brightness_factor)
 
-    def brightness_callback(self, ch, method, properties, body):
-        json_str = body.decode()
-        info = json.loads(json_str)
+        # Load the image, adjust every frame and save it
+        self._img_handler.apply(img_path, store_img_path, adjust)
 
-        msg_id = info['messageId']
-        timestamp = datetime.datetime.fromisoformat(info['timestamp'])
-        procedure = info['procedure']
-        img_path = info['parameters']['inputImageURI']
-        store_img_path = info['parameters']['outputImageURI']
-        brightness_factor = info['parameters']['brightness']
+    def brightness_callback(self, ch, method, properties, info):
+        msg_id = info.messageId
+        timestamp = info.timestamp
+        procedure = info.procedure
+        img_path = info.parameters.inputImageURI
+        store_img_path = info.parameters.outputImageURI
+        brightness_factor = info.parameters.brightness
 
         resp_msg_id = f'brightness-{self._counter}-{msg_id}'
         self._counter += 1
@@ -67,9 +61,9 @@ class Brightness:
                 'error', 
                 processing_time, 
                 None,
-                self._codes['wrong_procedure'], 
-                "The procedure received does not fit into this tool", 
-                img_path
+                err_code=self._codes['wrong_procedure'], 
+                err_msg="The procedure received does not fit into this tool", 
+                og_img_uri=img_path
             )
             return
 
@@ -100,9 +94,9 @@ class Brightness:
                 'error',
                 processing_time,
                 None,
-                self._codes['error_processing'],
-                str(e),
-                img_path
+                err_code=self._codes['error_processing'],
+                err_msg=str(e),
+                og_img_uri=img_path
             )
 
     def exec(self, args):
@@ -1,12 +1,12 @@
 from processor import process_image
 import sys
-import json
 import datetime
 import pytz
 
 from PIL import Image
 
 from utils.img_handler import Img_Handler
+import utils.jpeg_lossless as jpeg_lossless
 from utils.tool_msg import ToolMSG
 import utils.env as env
 import utils.env as env
@@ -27,33 +27,28 @@ class Cut:
         }
     
     def cut_image(self, img_path, store_img_path, dimensions):
-        # load image
-        img = self._img_handler.get_img(img_path)
-        
         # Validate dimensions
         # left, top, right, bottom = map(float, dimensions) 
         # dimensions = (round(left), round(top), round(right), round(bottom))
-        
-        # cut image
-        new_img = img.crop(dimensions)
-        
-        # store image
-        self._img_handler.store_img(new_img, store_img_path)
+
+        # JPEG to JPEG from an MCU boundary: lossless, without decoding
+        if jpeg_lossless.crop(img_path, store_img_path, dimensions):
+            return
+
+        # load image, cut every frame and store it
+        self._img_handler.apply(img_path, store_img_path, lambda img: img.crop(dimensions))
             
-    def cut_callback(self, ch, method, properties, body):
-        json_str = body.decode()
-        info = json.loads(json_str)
-        
-        msg_id = info['messageId']
-        timestamp = datetime.datetime.fromisoformat(info['timestamp'])
-        procedure = info['procedure']
-        img_path = info['parameters']['inputImageURI']
-        store_img_path = info['parameters']['outputImageURI']
+    def cut_callback(self, ch, method, properties, info):
+        msg_id = info.messageId
+        timestamp = info.timestamp
+        procedure = info.procedure
+        img_path = info.parameters.inputImageURI
+        store_img_path = info.parameters.outputImageURI
         
-        left = info['parameters']['left']
-        top = info['parameters']['top']
-        right = info['parameters']['right']
-        bottom = info['parameters']['bottom']
+        left = info.parameters.left
+        top = info.parameters.top
+        right = info.parameters.right
+        bottom = info.parameters.bottom
         
         resp_msg_id = f'cut-{self._counter}-{msg_id}'
         self._counter += 1
@@ -69,9 +64,9 @@ class Cut:
                                     'error', 
                                     processing_time, 
                                     None, 
-                                    self._codes['wrong_procedure'], 
-                                    "The procedure received does not fit into this tool", 
-                                    img_path)
+                                    err_code=self._codes['wrong_procedure'], 
+                                    err_msg="The procedure received does not fit into this tool", 
+                                    og_img_uri=img_path)
             return
 
         try:
@@ -98,9 +93,9 @@ class Cut:
                                     'error', 
                                     processing_time, 
                                     None, 
-                                    self._codes['error_processing'], "An error occured while processing the request",
-                                    str(e), 
-                                    img_path)
+                                    err_code=self._codes['error_processing'], 
+                                    err_msg=str(e), 
+                                    og_img_uri=img_path)
                 
         
     def exec(self, args):
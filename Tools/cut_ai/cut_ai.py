@@ -1,6 +1,5 @@
 import cv2
 import sys
-import json
 import datetime
 import pytz
 import torch
@@ -10,7 +9,9 @@ import numpy as np
 
 from utils.img_handler import Img_Handler
 from utils.tool_msg import ToolMSG
+import utils.progressive as progressive
 import utils.env as env
+import utils.prefork as prefork
 
 class CutAI:
     def __init__(self):
@@ -152,16 +153,14 @@ class CutAI:
         
         self._img_handler.store_img(cropped_pil_img, store_img_path)
 
-    def cut_ai_callback(self, ch, method, properties, body):
-        json_str = body.decode()
-        info = json.loads(json_str)
-        msg_id = info['messageId']
+    def cut_ai_callback(self, ch, method, properties, info):
+        msg_id = info.messageId
         
-        timestamp = datetime.datetime.fromisoformat(info['timestamp'])
+        timestamp = info.timestamp
         
-        procedure = info['procedure']
-        img_path = info['parameters']['inputImageURI']
-        store_img_path = info['parameters']['outputImageURI']
+        procedure = info.procedure
+        img_path = info.parameters.inputImageURI
+        store_img_path = info.parameters.outputImageURI
 
         resp_msg_id = f'cut-ai-{self._counter}-{msg_id}'
         self._counter += 1
@@ -178,13 +177,17 @@ class CutAI:
                 'error',
                 processing_time,
                 None,
-                self._codes['wrong_procedure'],
-                "The procedure received does not fit into this tool",
-                img_path
+                err_code=self._codes['wrong_procedure'],
+                err_msg="The procedure received does not fit into this tool",
+                og_img_uri=img_path
             )
             return
 
         try:
+            # progressive previews: the crop of a downscaled proxy first
+            progressive.send_proxy_result(self._tool_msg, info, resp_msg_id, img_path, store_img_path,
+                                          lambda src, dst, scale: self.cut_ai(src, dst))
+
             self.cut_ai(img_path, store_img_path)
 
             cur_timestamp = datetime.datetime.now(pytz.utc)
@@ -211,15 +214,19 @@ class CutAI:
                 'error',
                 processing_time,
                 None,
-                self._codes['error_processing'],
-                str(e),
-                img_path
+                err_code=self._codes['error_processing'],
+                err_msg=str(e),
+                og_img_uri=img_path
             )
 
+    def warmup(self):
+        """One inference on a blank image, so lazy allocations happen before workers fork."""
+        self.get_saliency_map(Image.new('RGB', (224, 224)))
+
     def exec(self, args):
         while True:
             self._tool_msg.read_msg(self.cut_ai_callback)
 
 if __name__ == "__main__":
     cut_ai = CutAI()
-    cut_ai.exec(sys.argv)
\ No newline at end of file
+    prefork.serve(cut_ai, sys.argv, warmup=cut_ai.warmup)
\ No newline at end of file
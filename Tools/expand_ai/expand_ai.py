@@ -1,27 +1,49 @@
 import os
 import sys
-import json
 import datetime
 import pytz
+import threading
 from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
 
 import utils.env as env
 
-from PIL import Image, ImageOps
+from PIL import Image
 
-from utils.tool_msg import ToolMSG
+from utils.tool_msg import ToolMSG, JobCancelled
 from utils.img_handler import Img_Handler
+import utils.progressive as progressive
+
+from padding import PAD_MODES, MODE_ALIASES, pad_image
 
 # ====== RF40: Generative Expand (HTTP outpaint) ======
 # Define a URL do serviço gerativo (ex.: http://gen-ai:7860 ou http://comfyui:8188)
 # Espera-se um endpoint: POST {GEN_EXPAND_URL}/outpaint
 GEN_EXPAND_URL = os.getenv("GEN_EXPAND_URL", "").strip()
 
+# Nº de jobs de expand a correr em paralelo (= pedidos de outpaint em voo).
+# Deve acompanhar a capacidade do serviço gerativo.
+try:
+    GEN_EXPAND_CONCURRENCY = max(1, min(64, int(os.getenv("GEN_EXPAND_CONCURRENCY", "4"))))
+except ValueError:
+    GEN_EXPAND_CONCURRENCY = 4
+
+# Payload do outpaint:
+#   - "full": envia o canvas inteiro + mask (comportamento original)
+#   - "bands": envia só as margens + uma faixa de contexto do original e
+#     compõe as bandas geradas sobre o original localmente
+# Pode ser escolhido por mensagem com params.payload.
+GEN_EXPAND_PAYLOAD = os.getenv("GEN_EXPAND_PAYLOAD", "full").strip().lower()
+
 try:
     import requests  # adiciona requests ao requirements.txt do expand_ai
+    from requests.adapters import HTTPAdapter
 except Exception:
     requests = None
 
+_http_session = None
+_http_session_lock = threading.Lock()
+
 
 def _clamp_int(v, lo, hi, default):
     try:
@@ -64,32 +86,9 @@ def _make_canvas_and_mask(img: Image.Image, left: int, right: int, top: int, bot
     new_w = img.width + left + right
     new_h = img.height + top + bottom
 
-    # 1) pré-preenche com reflect (dá contexto ao inpaint)
-    # reutiliza a tua lógica reflect (ou implementa simples)
+    # 1) pré-preenche com espelho das bordas (dá contexto ao inpaint)
     base = img.convert("RGB")
-
-    canvas = Image.new("RGB", (new_w, new_h))
-    canvas.paste(base, (left, top))
-
-    if left > 0:
-        strip = base.crop((0, 0, min(left, base.width), base.height))
-        strip = ImageOps.mirror(strip)
-        canvas.paste(strip.resize((left, base.height)), (0, top))
-
-    if right > 0:
-        strip = base.crop((max(base.width - right, 0), 0, base.width, base.height))
-        strip = ImageOps.mirror(strip)
-        canvas.paste(strip.resize((right, base.height)), (left + base.width, top))
-
-    if top > 0:
-        strip = canvas.crop((0, top, new_w, top + min(top, base.height)))
-        strip = ImageOps.flip(strip)
-        canvas.paste(strip.resize((new_w, top)), (0, 0))
-
-    if bottom > 0:
-        strip = canvas.crop((0, top + base.height - min(bottom, base.height), new_w, top + base.height))
-        strip = ImageOps.flip(strip)
-        canvas.paste(strip.resize((new_w, bottom)), (0, top + base.height))
+    canvas = pad_image(base, left, right, top, bottom, "symmetric")
 
     # 2) mask igual (255 nas margens, 0 na imagem original)
     mask = Image.new("L", (new_w, new_h), 255)
@@ -105,6 +104,23 @@ def _pil_to_png_bytes(im: Image.Image) -> bytes:
     return bio.getvalue()
 
 
+def _get_http_session():
+    """
+    Sessão HTTP partilhada (keep-alive) para o GEN_EXPAND_URL.
+    O pool tem uma ligação por job concorrente, para não abrir um socket novo por pedido.
+    """
+    global _http_session
+    if _http_session is None:
+        with _http_session_lock:
+            if _http_session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=GEN_EXPAND_CONCURRENCY)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _http_session = session
+    return _http_session
+
+
 def _generative_outpaint_http(canvas: Image.Image, mask: Image.Image, params: dict) -> Image.Image:
     """
     Chama um serviço externo para outpainting/inpainting.
@@ -157,72 +173,161 @@ def _generative_outpaint_http(canvas: Image.Image, mask: Image.Image, params: di
     if seed is not None:
         data["seed"] = str(seed)
 
-    resp = requests.post(url, files=files, data=data, timeout=timeout)
+    resp = _get_http_session().post(url, files=files, data=data, timeout=timeout)
     resp.raise_for_status()
 
     out = Image.open(BytesIO(resp.content)).convert("RGB")
     return out
 
 
-def _expand_non_generative(img: Image.Image, params: dict) -> Image.Image:
+def _band_paste_mask(size, pad: int, feather: int, side: str) -> Image.Image:
     """
-    Expand "não generativo" (o que tu já tinhas):
-      - reflect: espelha bordas
-      - edge: repete pixels da borda
-      - solid: cor sólida (params.color "#RRGGBB")
+    Mask "L" para colar uma banda gerada (pad + contexto) sobre o resultado:
+      - 255 na margem gerada
+      - rampa 255 -> 0 nos primeiros `feather` px do contexto (esconde a costura)
+      - 0 no resto do contexto (fica o original intacto)
     """
-    mode = (params.get("mode") or "reflect").lower()
+    w, h = size
+    mask = Image.new("L", (w, h), 0)
+    if side in ("left", "right"):
+        mask.paste(255, (0, 0, pad, h) if side == "left" else (w - pad, 0, w, h))
+    else:
+        mask.paste(255, (0, 0, w, pad) if side == "top" else (0, h - pad, w, h))
+
+    if feather <= 0:
+        return mask
+
+    # valores da margem para o interior
+    values = [round(255 * (feather - i) / (feather + 1)) for i in range(feather)]
+    if side in ("right", "bottom"):
+        values.reverse()
+
+    if side in ("left", "right"):
+        ramp = Image.new("L", (feather, 1))
+        ramp.putdata(values)
+        ramp = ramp.resize((feather, h), Image.NEAREST)
+        mask.paste(ramp, (pad, 0) if side == "left" else (w - pad - feather, 0))
+    else:
+        ramp = Image.new("L", (1, feather))
+        ramp.putdata(values)
+        ramp = ramp.resize((w, feather), Image.NEAREST)
+        mask.paste(ramp, (0, pad) if side == "top" else (0, h - pad - feather))
+    return mask
+
+
+def _outpaint_band(src: Image.Image, side: str, pad: int, ctx: int, params: dict) -> Image.Image:
+    """
+    Gera uma única banda: `pad` px de margem do lado `side` + `ctx` px de contexto
+    do `src`. Devolve a banda (pad + ctx) em RGB.
+    """
+    w, h = src.width, src.height
+
+    # a pré-reflexão usa até `pad` px do original, o contexto enviado são `ctx` px
+    if side == "left":
+        src = src.crop((0, 0, min(w, max(ctx, pad)), h))
+        canvas, mask = _make_canvas_and_mask(src, pad, 0, 0, 0)
+        box = (0, 0, pad + ctx, h)
+    elif side == "right":
+        src = src.crop((w - min(w, max(ctx, pad)), 0, w, h))
+        canvas, mask = _make_canvas_and_mask(src, 0, pad, 0, 0)
+        box = (src.width - ctx, 0, src.width + pad, h)
+    elif side == "top":
+        src = src.crop((0, 0, w, min(h, max(ctx, pad))))
+        canvas, mask = _make_canvas_and_mask(src, 0, 0, pad, 0)
+        box = (0, 0, w, pad + ctx)
+    else:
+        src = src.crop((0, h - min(h, max(ctx, pad)), w, h))
+        canvas, mask = _make_canvas_and_mask(src, 0, 0, 0, pad)
+        box = (0, src.height - ctx, w, src.height + pad)
+
+    canvas, mask = canvas.crop(box), mask.crop(box)
+    band = _generative_outpaint_http(canvas, mask, params)
+    if band.size != canvas.size:
+        band = band.resize(canvas.size)
+    return band
+
+
+def _generative_outpaint_bands(img: Image.Image, left: int, right: int, top: int, bottom: int, params: dict) -> Image.Image:
+    """
+    Outpaint por bandas: em vez do canvas inteiro, envia ao serviço só as margens
+    (+ params.contextPx px do original) e compõe localmente, com feathering de
+    params.featherPx px na costura.
 
-    left, right, top, bottom = _compute_padding(img.width, img.height, params)
-    if left == right == top == bottom == 0:
-        return img
+    Esquerda/direita primeiro; cima/baixo depois, já com os cantos e o contexto
+    das bandas laterais.
+    """
+    base = img.convert("RGB")
+    w, h = base.width, base.height
+    new_w = w + left + right
+    new_h = h + top + bottom
 
-    if mode == "solid":
-        color = params.get("color", "#000000")
-        return ImageOps.expand(img, border=(left, top, right, bottom), fill=color)
+    ctx = _clamp_int(params.get("contextPx", 64), 8, 1024, 64)
+    feather = _clamp_int(params.get("featherPx", ctx // 2), 0, 1024, ctx // 2)
+    ctx_x, ctx_y = min(ctx, w), min(ctx, h)
 
-    if mode == "edge":
-        return ImageOps.expand(img, border=(left, top, right, bottom)).transform(
-            (img.width + left + right, img.height + top + bottom),
-            Image.EXTENT,
-            (0, 0, img.width + left + right, img.height + top + bottom),
-        )
-
-    # default: reflect
-    new_w = img.width + left + right
-    new_h = img.height + top + bottom
-    canvas = Image.new(img.mode, (new_w, new_h))
-    canvas.paste(img, (left, top))
+    out = Image.new("RGB", (new_w, new_h))
+    out.paste(base, (left, top))
 
     if left > 0:
-        strip = img.crop((0, 0, min(left, img.width), img.height))
-        strip = ImageOps.mirror(strip)
-        canvas.paste(strip.resize((left, img.height)), (0, top))
+        band = _outpaint_band(base, "left", left, ctx_x, params)
+        out.paste(band, (0, top), _band_paste_mask(band.size, left, min(feather, ctx_x), "left"))
 
     if right > 0:
-        strip = img.crop((max(img.width - right, 0), 0, img.width, img.height))
-        strip = ImageOps.mirror(strip)
-        canvas.paste(strip.resize((right, img.height)), (left + img.width, top))
+        band = _outpaint_band(base, "right", right, ctx_x, params)
+        out.paste(band, (left + w - ctx_x, top), _band_paste_mask(band.size, right, min(feather, ctx_x), "right"))
 
     if top > 0:
-        strip = canvas.crop((0, top, new_w, top + min(top, img.height)))
-        strip = ImageOps.flip(strip)
-        canvas.paste(strip.resize((new_w, top)), (0, 0))
+        middle = out.crop((0, top, new_w, top + min(h, max(ctx_y, top))))
+        band = _outpaint_band(middle, "top", top, ctx_y, params)
+        out.paste(band, (0, 0), _band_paste_mask(band.size, top, min(feather, ctx_y), "top"))
 
     if bottom > 0:
-        strip = canvas.crop((0, top + img.height - min(bottom, img.height), new_w, top + img.height))
-        strip = ImageOps.flip(strip)
-        canvas.paste(strip.resize((new_w, bottom)), (0, top + img.height))
+        middle = out.crop((0, top + h - min(h, max(ctx_y, bottom)), new_w, top + h))
+        band = _outpaint_band(middle, "bottom", bottom, ctx_y, params)
+        out.paste(band, (0, top + h - ctx_y), _band_paste_mask(band.size, bottom, min(feather, ctx_y), "bottom"))
+
+    return out
 
-    return canvas
+
+def _proxy_params(params: dict, scale: float) -> dict:
+    """
+    Parâmetros para o proxy de um pedido progressivo: as margens e faixas dadas
+    em px acompanham a escala do proxy (percent já é relativo).
+    """
+    out = dict(params)
+    for key in ("left", "right", "top", "bottom", "contextPx", "featherPx"):
+        if key in params:
+            out[key] = round(_clamp_int(params[key], 0, 4000, 0) * scale)
+    return out
+
+
+def _expand_non_generative(img: Image.Image, params: dict) -> Image.Image:
+    """
+    Expand "não generativo" (padding.pad_image, no modo da imagem original):
+      - reflect: espelha bordas (sem repetir a borda)
+      - symmetric: espelha bordas (repetindo a borda)
+      - edge: repete pixels da borda
+      - wrap: repete a imagem
+      - solid/constant: cor sólida (params.color "#RRGGBB")
+    """
+    mode = (params.get("mode") or "reflect").lower()
+    if mode not in PAD_MODES and mode not in MODE_ALIASES:
+        mode = "reflect"
+
+    left, right, top, bottom = _compute_padding(img.width, img.height, params)
+    if left == right == top == bottom == 0:
+        return img
+
+    return pad_image(img, left, right, top, bottom, mode, params.get("color", "#000000"))
 
 
 def _expand_image(img: Image.Image, params: dict) -> Image.Image:
     """
     RF40:
       - mode="generative" => cria canvas+mask e chama outpainting (HTTP)
+        (payload="bands" => só envia as margens e compõe localmente)
     Caso contrário:
-      - reflect/edge/solid => comportamento antigo (não-gerativo)
+      - reflect/symmetric/edge/wrap/solid => padding não-generativo
     """
     mode = (params.get("mode") or "reflect").lower()
 
@@ -231,6 +336,10 @@ def _expand_image(img: Image.Image, params: dict) -> Image.Image:
         return img
 
     if mode in ("generative", "inpaint", "outpaint"):
+        payload = str(params.get("payload") or GEN_EXPAND_PAYLOAD).lower()
+        if payload == "bands":
+            return _generative_outpaint_bands(img, left, right, top, bottom, params)
+
         canvas, mask = _make_canvas_and_mask(img, left, right, top, bottom)
         return _generative_outpaint_http(canvas, mask, params)
 
@@ -253,27 +362,30 @@ class ExpandAiTool:
             "wrong_procedure": 2400,
             "error_processing": 2401,
         }
+        # o consumer só despacha; prep do canvas/mask, PNG encode e HTTP correm aqui
+        self._executor = ThreadPoolExecutor(
+            max_workers=GEN_EXPAND_CONCURRENCY,
+            thread_name_prefix="expand-ai",
+        )
 
-    def expand_ai(self, img_path, store_img_path, params):
+    def expand_ai(self, img_path, store_img_path, params, info=None):
         img = self._img_handler.get_img(img_path)
 
         out = _expand_image(img, params)
 
+        # o outpaint pode ter demorado: não gastar o encode num preview já substituído
+        if info is not None and self._tool_msg.superseded(info):
+            raise JobCancelled()
+
         # guardar (mantém compatibilidade com o resto do sistema)
         self._img_handler.store_img(out, store_img_path)
 
-    def expand_ai_callback(self, ch, method, properties, body):
-        info = json.loads(body.decode())
-        msg_id = info["messageId"]
-        ts = info["timestamp"]
-
-        if ts.endswith("Z"):
-            ts = ts[:-1] + "+00:00"
-
-        timestamp = datetime.datetime.fromisoformat(ts)
+    def expand_ai_callback(self, ch, method, properties, info):
+        msg_id = info.messageId
+        timestamp = info.timestamp
 
-        procedure = info["procedure"]
-        params = info.get("parameters", {})
+        procedure = info.procedure
+        params = info.parameters
         img_path = params["inputImageURI"]
         store_img_path = params["outputImageURI"]
 
@@ -297,44 +409,84 @@ class ExpandAiTool:
                 "The procedure received does not fit into this tool",
                 img_path,
             )
+            ch.basic_ack(delivery_tag=method.delivery_tag)
             return
 
-        try:
-            self.expand_ai(img_path, store_img_path, params)
-
-            cur_timestamp = datetime.datetime.now(pytz.utc)
-            processing_time = (cur_timestamp - timestamp).total_seconds() * 1000
-            cur_timestamp = cur_timestamp.isoformat()
+        # um outpaint pode demorar minutos: não bloquear o consumer,
+        # o ack só é feito quando a resposta for publicada
+        self._executor.submit(
+            self._expand_ai_job,
+            ch,
+            method.delivery_tag,
+            info,
+            msg_id,
+            resp_msg_id,
+            timestamp,
+            img_path,
+            store_img_path,
+            params,
+        )
 
-            self._tool_msg.send_msg(
-                msg_id,
-                resp_msg_id,
-                cur_timestamp,
-                "success",
-                processing_time,
-                store_img_path,
+    def _expand_ai_job(self, ch, delivery_tag, info, msg_id, resp_msg_id, timestamp, img_path, store_img_path, params):
+        cancelled = False
+        error = None
+        try:
+            # pode ter ficado na fila do pool enquanto chegava um tombstone
+            if self._tool_msg.superseded(info):
+                raise JobCancelled()
+            # previews progressivos: primeiro o resultado sobre um proxy reduzido (reply "partial")
+            progressive.send_proxy_result(
+                self._tool_msg, info, resp_msg_id, img_path, store_img_path,
+                lambda src, dst, scale: self.expand_ai(src, dst, _proxy_params(params, scale), info),
             )
+            self.expand_ai(img_path, store_img_path, params, info)
+        except JobCancelled:
+            cancelled = True
         except Exception as e:
-            cur_timestamp = datetime.datetime.now(pytz.utc)
-            processing_time = (cur_timestamp - timestamp).total_seconds() * 1000
-            cur_timestamp = cur_timestamp.isoformat()
-
-            self._tool_msg.send_msg(
-                msg_id,
-                resp_msg_id,
-                cur_timestamp,
-                "error",
-                processing_time,
-                None,
-                "image",
-                self._codes["error_processing"],
-                str(e),
-                img_path,
-            )
+            error = str(e)
+
+        cur_timestamp = datetime.datetime.now(pytz.utc)
+        processing_time = (cur_timestamp - timestamp).total_seconds() * 1000
+        cur_timestamp = cur_timestamp.isoformat()
+
+        def reply():
+            if cancelled:
+                self._tool_msg.send_cancelled(info, processing_time)
+            elif error is None:
+                self._tool_msg.send_msg(
+                    msg_id,
+                    resp_msg_id,
+                    cur_timestamp,
+                    "success",
+                    processing_time,
+                    store_img_path,
+                )
+            else:
+                self._tool_msg.send_msg(
+                    msg_id,
+                    resp_msg_id,
+                    cur_timestamp,
+                    "error",
+                    processing_time,
+                    None,
+                    "image",
+                    self._codes["error_processing"],
+                    error,
+                    img_path,
+                )
+            ch.basic_ack(delivery_tag=delivery_tag)
+
+        # pika não é thread-safe: publish + ack correm na thread da conexão
+        self._tool_msg.run_threadsafe(reply)
 
     def exec(self, args=None):
         while True:
-            self._tool_msg.read_msg(self.expand_ai_callback)
+            # prefetch = concorrência: o broker nunca entrega mais jobs do que o pool aguenta
+            self._tool_msg.read_msg(
+                self.expand_ai_callback,
+                auto_ack=False,
+                prefetch_count=GEN_EXPAND_CONCURRENCY,
+            )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,162 @@
+"""
+Motor de padding vetorizado (NumPy) usado pelo expand não-generativo.
+
+Modos (semântica do np.pad):
+  - reflect:   espelha sem repetir o pixel da borda  (3 2 1 | 0 1 2 3 | 2 1 0)
+  - symmetric: espelha repetindo o pixel da borda    (2 1 0 | 0 1 2 3 | 3 2 1)
+  - edge:      repete o pixel da borda               (0 0 0 | 0 1 2 3 | 3 3 3)
+  - constant:  cor sólida                            (c c c | 0 1 2 3 | c c c)
+  - wrap:      repete a imagem (tiling)              (1 2 3 | 0 1 2 3 | 0 1 2)
+
+Funciona em qualquer modo PIL (RGB, RGBA, L, P, I;16, ...): uma alocação
+para o resultado e uma passagem sobre os pixels. Acima de TILED_MIN_PIXELS o
+resultado é escrito por faixas de linhas, sem materializar o array completo.
+"""
+
+import os
+
+import numpy as np
+from PIL import Image, ImageColor, ImagePalette
+
+PAD_MODES = ("reflect", "symmetric", "edge", "constant", "wrap")
+
+# nomes antigos do expand_ai
+MODE_ALIASES = {"solid": "constant"}
+
+TILED_MIN_PIXELS = int(os.getenv("EXPAND_TILED_MIN_PIXELS", 64_000_000))
+TILE_PIXELS = int(os.getenv("EXPAND_TILE_PIXELS", 4_000_000))
+
+
+def _palette_of(img: Image.Image):
+    if img.mode not in ("P", "PA"):
+        return None
+    return ImagePalette.ImagePalette(palette=img.getpalette())
+
+
+def _fill_value(img: Image.Image, color, palette):
+    """Converte a cor (#RRGGBB ou tuplo) para o valor de pixel no modo da imagem."""
+    rgb = tuple(color) if isinstance(color, (tuple, list)) else ImageColor.getrgb(color)
+
+    if palette is not None:
+        # mesma abordagem do ImageOps.expand: reserva a cor na palete da imagem
+        try:
+            index = palette.getcolor(rgb[:3], img)
+        except ValueError:
+            # palete cheia: usa a cor mais próxima
+            colors = np.frombuffer(palette.tobytes(), dtype=np.uint8).reshape(-1, 3).astype(int)
+            index = int(((colors - rgb[:3]) ** 2).sum(axis=1).argmin())
+        return (index, 255) if img.mode == "PA" else index
+
+    try:
+        return Image.new("RGB", (1, 1), rgb[:3]).convert(img.mode).getpixel((0, 0))
+    except (ValueError, OSError):
+        return 0
+
+
+def _to_image(arr: np.ndarray, like: Image.Image, palette) -> Image.Image:
+    out = Image.fromarray(arr)
+    if out.mode != like.mode and palette is None and like.mode != "1":
+        # ex.: CMYK chega como RGBA, reinterpreta os bytes no modo original
+        out = Image.frombytes(like.mode, (arr.shape[1], arr.shape[0]), arr.tobytes())
+    if palette is not None:
+        out.putpalette(palette)
+    if "transparency" in like.info:
+        out.info["transparency"] = like.info["transparency"]
+    return out
+
+
+def _source_index(n: int, before: int, after: int, mode: str) -> np.ndarray:
+    """Índice de origem (no eixo de tamanho n) para cada posição do eixo já com padding."""
+    j = np.arange(-before, n + after)
+    if mode == "edge":
+        return np.clip(j, 0, n - 1)
+    if mode == "wrap":
+        return np.mod(j, n)
+    if mode == "symmetric":
+        k = np.mod(j, 2 * n)
+        return np.where(k < n, k, 2 * n - 1 - k)
+    # reflect
+    if n == 1:
+        return np.zeros_like(j)
+    period = 2 * n - 2
+    k = np.mod(j, period)
+    return np.where(k < n, k, period - k)
+
+
+def pad_array(arr: np.ndarray, left: int, right: int, top: int, bottom: int, mode="reflect", fill=0) -> np.ndarray:
+    """Padding de um array (H, W[, C]) com os mesmos modos de pad_image."""
+    if mode == "constant":
+        h, w = arr.shape[:2]
+        out = np.empty((h + top + bottom, w + left + right) + arr.shape[2:], dtype=arr.dtype)
+        out[...] = fill
+        out[top:top + h, left:left + w] = arr
+        return out
+
+    widths = ((top, bottom), (left, right)) + ((0, 0),) * (arr.ndim - 2)
+    return np.pad(arr, widths, mode=mode)
+
+
+def pad_image_tiled(img: Image.Image, left: int, right: int, top: int, bottom: int,
+                    mode="reflect", color="#000000", tile_pixels=None) -> Image.Image:
+    """
+    Variante por tiles para canvases enormes: o resultado é alocado uma vez como
+    imagem PIL e preenchido por faixas de linhas (gather por índices), pelo que
+    a memória extra é de uma faixa e não de um array do tamanho do canvas.
+    """
+    mode = MODE_ALIASES.get(mode, mode)
+    if mode not in PAD_MODES:
+        raise ValueError(f"Unsupported padding mode: {mode}")
+
+    new_w = img.width + left + right
+    new_h = img.height + top + bottom
+    palette = _palette_of(img)
+
+    if mode == "constant":
+        out = Image.new(img.mode, (new_w, new_h), _fill_value(img, color, palette))
+        if palette is not None:
+            out.putpalette(palette)
+        out.paste(img, (left, top))
+        if "transparency" in img.info:
+            out.info["transparency"] = img.info["transparency"]
+        return out
+
+    arr = np.asarray(img)
+    rows = _source_index(img.height, top, bottom, mode)
+    cols = _source_index(img.width, left, right, mode)
+
+    tile_rows = max(1, (tile_pixels or TILE_PIXELS) // max(new_w, 1))
+
+    out = None
+    for y0 in range(0, new_h, tile_rows):
+        y1 = min(new_h, y0 + tile_rows)
+        tile = _to_image(arr[np.ix_(rows[y0:y1], cols)], img, palette)
+        if out is None:
+            out = Image.new(tile.mode, (new_w, new_h))
+            if palette is not None:
+                out.putpalette(palette)
+            out.info.update(tile.info)
+        out.paste(tile, (0, y0))
+
+    return out
+
+
+def pad_image(img: Image.Image, left: int, right: int, top: int, bottom: int,
+              mode="reflect", color="#000000") -> Image.Image:
+    """
+    Devolve uma nova imagem, no mesmo modo de `img`, com o padding pedido
+    (left/right/top/bottom em px, como devolvido por _compute_padding).
+    """
+    mode = MODE_ALIASES.get(mode, mode)
+    if mode not in PAD_MODES:
+        raise ValueError(f"Unsupported padding mode: {mode}")
+
+    new_w = img.width + left + right
+    new_h = img.height + top + bottom
+    if new_w * new_h >= TILED_MIN_PIXELS:
+        return pad_image_tiled(img, left, right, top, bottom, mode, color)
+
+    palette = _palette_of(img)
+    fill = _fill_value(img, color, palette) if mode == "constant" else 0
+
+    arr = pad_array(np.asarray(img), left, right, top, bottom, mode, fill)
+    return _to_image(arr, img, palette)
@@ -1,5 +1,4 @@
 import sys
-import json
 import datetime
 import numpy as np
 
@@ -10,6 +9,7 @@ from ultralytics import YOLO
 from utils.img_handler import Img_Handler
 from utils.tool_msg import ToolMSG
 import utils.env as env
+import utils.prefork as prefork
 
 class Object_ai:
     def __init__(self):
@@ -75,17 +75,15 @@ class Object_ai:
         
         return text_path
 
-    def object_ai_callback(self, ch, method, properties, body):
-        json_str = body.decode()
-        info = json.loads(json_str)
-        msg_id = info['messageId']
+    def object_ai_callback(self, ch, method, properties, info):
+        msg_id = info.messageId
         
-        timestamp = datetime.datetime.fromisoformat(info['timestamp'])
+        timestamp = info.timestamp
         
-        procedure = info['procedure']
-        img_path = info['parameters']['inputImageURI']
-        store_img_path = info['parameters']['outputImageURI']
-        conf_threshold = info['parameters'].get('confidenceThreshold', 0.20)
+        procedure = info.procedure
+        img_path = info.parameters.inputImageURI
+        store_img_path = info.parameters.outputImageURI
+        conf_threshold = info.parameters.confidenceThreshold
 
         resp_msg_id = f'object-ai-{self._counter}-{msg_id}'
         self._counter += 1
@@ -146,10 +144,14 @@ class Object_ai:
                 img_path
             )
 
+    def warmup(self):
+        """One inference on a blank image, so lazy allocations happen before workers fork."""
+        self.model(np.zeros((640, 640, 3), dtype=np.uint8), conf=self.conf_threshold, verbose=False)
+
     def exec(self, args):
         while True:
             self._tool_msg.read_msg(self.object_ai_callback)
 
 if __name__ == "__main__":
     object_ai = Object_ai()
-    object_ai.exec(sys.argv)
\ No newline at end of file
+    prefork.serve(object_ai, sys.argv, warmup=object_ai.warmup)
\ No newline at end of file
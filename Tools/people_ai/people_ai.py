@@ -1,5 +1,4 @@
 import sys
-import json
 import datetime
 import numpy as np
 
@@ -10,6 +9,7 @@ from ultralytics import YOLO
 from utils.img_handler import Img_Handler
 from utils.tool_msg import ToolMSG
 import utils.env as env
+import utils.prefork as prefork
 
 class People_ai:
     def __init__(self):
@@ -70,17 +70,15 @@ class People_ai:
         return text_path
     
 
-    def people_ai_callback(self, ch, method, properties, body):
-        json_str = body.decode()
-        info = json.loads(json_str)
-        msg_id = info['messageId']
+    def people_ai_callback(self, ch, method, properties, info):
+        msg_id = info.messageId
         
-        timestamp = datetime.datetime.fromisoformat(info['timestamp'])
+        timestamp = info.timestamp
         
-        procedure = info['procedure']
-        img_path = info['parameters']['inputImageURI']
-        store_img_path = info['parameters']['outputImageURI']
-        conf_threshold = info['parameters'].get('confidenceThreshold', 0.4)
+        procedure = info.procedure
+        img_path = info.parameters.inputImageURI
+        store_img_path = info.parameters.outputImageURI
+        conf_threshold = info.parameters.confidenceThreshold
 
         resp_msg_id = f'people-ai-{self._counter}-{msg_id}'
         self._counter += 1
@@ -141,10 +139,14 @@ class People_ai:
                 img_path
             )
 
+    def warmup(self):
+        """One inference on a blank image, so lazy allocations happen before workers fork."""
+        self.model(np.zeros((640, 640, 3), dtype=np.uint8), classes=[0], verbose=False)
+
     def exec(self, args):
         while True:
             self._tool_msg.read_msg(self.people_ai_callback)
 
 if __name__ == "__main__":
     people_ai = People_ai()
-    people_ai.exec(sys.argv)
\ No newline at end of file
+    prefork.serve(people_ai, sys.argv, warmup=people_ai.warmup)
\ No newline at end of file
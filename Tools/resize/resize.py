@@ -1,14 +1,32 @@
+import os
 import sys
-import json
 import datetime
 import pytz
 
 from PIL import Image
 
 from utils.img_handler import Img_Handler
+import utils.geometry as geometry
 from utils.tool_msg import ToolMSG
 import utils.env as env
 
+def variant_uri(img_uri, size):
+    root, ext = os.path.splitext(img_uri)
+    return f'{root}.{size[0]}x{size[1]}{ext}'
+
+
+def variant_targets(params):
+    """(size, output URI) of every output of the job but the main one, from `sizes` then `pyramid`."""
+    targets = [((v.width, v.height), v.outputImageURI or variant_uri(params.outputImageURI, (v.width, v.height)))
+               for v in params.sizes or ()]
+    if params.pyramid is not None:
+        for level in range(1, params.pyramid.levels + 1):
+            scale = params.pyramid.factor ** level
+            size = (max(1, round(params.width * scale)), max(1, round(params.height * scale)))
+            targets.append((size, variant_uri(params.outputImageURI, size)))
+    return targets
+
+
 class Resize:
     def __init__(self):
         self._img_handler = Img_Handler()
@@ -24,22 +42,47 @@ class Resize:
             'error_processing': 1501
         }
     
-    def resize_image(self, img_path, store_img_path, dimensions):
+    def resize_image(self, img_path, store_img_path, dimensions, backend=None, variants=()):
+        backend = geometry.backend_for('resize', backend)
+        if variants:
+            self.resize_pyramid(img_path, [(tuple(dimensions), store_img_path), *variants], backend)
+            return
+        self._img_handler.apply(img_path, store_img_path, lambda img: geometry.resize(img, dimensions, backend=backend))
+
+    def resize_pyramid(self, img_path, targets, backend):
+        """
+        Write every (size, path) of `targets` from a single decode of `img_path`.
+
+        A JPEG is decoded at the smallest DCT scale (1/2, 1/4, 1/8) still
+        covering the largest size. The outputs are made from the largest down,
+        each from the previous one when that covers it, with Pillow's
+        reducing_gap box reduction before the resampling.
+        """
         img = self._img_handler.get_img(img_path)
-        new_img = img.resize(dimensions)
-        self._img_handler.store_img(new_img, store_img_path)
+        if self._img_handler.is_animated(img):
+            # animations are streamed frame by frame: one pass per size
+            for size, path in targets:
+                self._img_handler.apply(img_path, path, lambda frame, size=size: geometry.resize(frame, size, backend=backend))
+            return
+
+        img.draft(None, (max(size[0] for size, _ in targets), max(size[1] for size, _ in targets)))
+        source = img
+        for size, path in sorted(targets, key=lambda target: target[0][0] * target[0][1], reverse=True):
+            if size[0] > source.width or size[1] > source.height:
+                source = img
+            out = geometry.resize(source, size, backend=backend, reducing_gap=env.RESIZE_REDUCING_GAP)
+            self._img_handler.store_img(out, path)
+            source = out
             
-    def resize_callback(self, ch, method, properties, body):
-        json_str = body.decode()
-        info = json.loads(json_str)
-        
-        msg_id = info['messageId']
-        timestamp = datetime.datetime.fromisoformat(info['timestamp'])
-        procedure = info['procedure']
-        img_path = info['parameters']['inputImageURI']
-        store_img_path = info['parameters']['outputImageURI']
-        width = info['parameters']['width']
-        height = info['parameters']['height']
+    def resize_callback(self, ch, method, properties, info):
+        msg_id = info.messageId
+        timestamp = info.timestamp
+        procedure = info.procedure
+        img_path = info.parameters.inputImageURI
+        store_img_path = info.parameters.outputImageURI
+        width = info.parameters.width
+        height = info.parameters.height
+        variants = variant_targets(info.parameters)
         
         resp_msg_id = f'resize-{self._counter}-{msg_id}'
         self._counter += 1
@@ -49,24 +92,25 @@ class Resize:
             processing_time = (cur_timestamp - timestamp).total_seconds() * 1000
             cur_timestamp = cur_timestamp.isoformat()
 
-            self._tool_msg.send_msg(msg_id, resp_msg_id, cur_timestamp, 'error', processing_time, None, self._codes['wrong_procedure'], "The procedure received does not fit into this tool", img_path)
+            self._tool_msg.send_msg(msg_id, resp_msg_id, cur_timestamp, 'error', processing_time, None, err_code=self._codes['wrong_procedure'], err_msg="The procedure received does not fit into this tool", og_img_uri=img_path)
             return
 
         try:
-            self.resize_image(img_path, store_img_path, (width, height))
+            self.resize_image(img_path, store_img_path, (width, height), backend=info.parameters.backend, variants=variants)
 
             cur_timestamp = datetime.datetime.now(pytz.utc)
             processing_time = (cur_timestamp - timestamp).total_seconds() * 1000
             cur_timestamp = cur_timestamp.isoformat()
             
-            self._tool_msg.send_msg(msg_id, resp_msg_id, cur_timestamp, 'success', processing_time, store_img_path)
+            self._tool_msg.send_msg(msg_id, resp_msg_id, cur_timestamp, 'success', processing_time, store_img_path,
+                                    variants=[{'width': size[0], 'height': size[1], 'imageURI': path} for size, path in variants])
         except Exception as e:
             print(e)
             cur_timestamp = datetime.datetime.now(pytz.utc)
             processing_time = (cur_timestamp - timestamp).total_seconds() * 1000
             cur_timestamp = cur_timestamp.isoformat()
             
-            self._tool_msg.send_msg(msg_id, resp_msg_id, cur_timestamp, 'error', processing_time, None, self._codes['error_processing'], "An error occured while processing the request", img_path)
+            self._tool_msg.send_msg(msg_id, resp_msg_id, cur_timestamp, 'error', processing_time, None, err_code=self._codes['error_processing'], err_msg="An error occured while processing the request", og_img_uri=img_path)
                 
     def exec(self, args):
         while True:
@@ -1,5 +1,4 @@
 import sys
-import json
 import datetime
 import pytz
 import pytz
@@ -7,9 +6,18 @@ import pytz
 from PIL import Image
 
 from utils.img_handler import Img_Handler
+import utils.jpeg_lossless as jpeg_lossless
+import utils.geometry as geometry
 from utils.tool_msg import ToolMSG
 import utils.env as env
 
+# right angles are exact pixel moves, no resampling
+TRANSPOSES = {
+    90: Image.Transpose.ROTATE_90,
+    180: Image.Transpose.ROTATE_180,
+    270: Image.Transpose.ROTATE_270,
+}
+
 class Rotate:
     def __init__(self):
         self._img_handler = Img_Handler()
@@ -20,23 +28,29 @@ class Rotate:
             'error_processing': 1601
         }
 
-    def rotate_image(self, img_path, store_img_path, degrees, expand=True):
-        img = self._img_handler.get_img(img_path)
-        new_img = img.rotate(degrees, expand=expand)
-        self._img_handler.store_img(new_img, store_img_path)
+    def rotate_image(self, img_path, store_img_path, degrees, expand=True, backend=None):
+        # JPEG to JPEG by a right angle: lossless, without decoding
+        if expand and jpeg_lossless.rotate(img_path, store_img_path, degrees):
+            return
+
+        transpose = TRANSPOSES.get(degrees % 360) if expand else None
+        if transpose is not None:
+            self._img_handler.apply(img_path, store_img_path, lambda img: img.transpose(transpose))
+            return
+        backend = geometry.backend_for('rotate', backend)
+        self._img_handler.apply(img_path, store_img_path,
+                                lambda img: geometry.rotate(img, degrees, expand=expand, backend=backend))
 
-    def rotate_callback(self, ch, method, properties, body):
+    def rotate_callback(self, ch, method, properties, info):
         print('Received msg')
-        json_str = body.decode()
-        print(json_str)
-        info = json.loads(json_str)
+        print(info)
         
-        msg_id = info['messageId']
-        timestamp = datetime.datetime.fromisoformat(info['timestamp'])
-        procedure = info['procedure']
-        img_path = info['parameters']['inputImageURI']
-        store_img_path = info['parameters']['outputImageURI']
-        degrees = info['parameters']['degrees']
+        msg_id = info.messageId
+        timestamp = info.timestamp
+        procedure = info.procedure
+        img_path = info.parameters.inputImageURI
+        store_img_path = info.parameters.outputImageURI
+        degrees = info.parameters.degrees
         
         resp_msg_id = f'rotate-{self._counter}-{msg_id}'
         self._counter += 1
@@ -46,11 +60,11 @@ class Rotate:
             processing_time = (cur_timestamp - timestamp).total_seconds() * 1000
             cur_timestamp = cur_timestamp.isoformat()
 
-            self._tool_msg.send_msg(msg_id, resp_msg_id, cur_timestamp, 'error', processing_time, None, self._codes['wrong_procedure'], "The procedure received does not fit into this tool", img_path)
+            self._tool_msg.send_msg(msg_id, resp_msg_id, cur_timestamp, 'error', processing_time, None, err_code=self._codes['wrong_procedure'], err_msg="The procedure received does not fit into this tool", og_img_uri=img_path)
             return
 
         try:
-            self.rotate_image(img_path, store_img_path, degrees)
+            self.rotate_image(img_path, store_img_path, degrees, backend=info.parameters.backend)
 
             cur_timestamp = datetime.datetime.now(pytz.utc)
             processing_time = (cur_timestamp - timestamp).total_seconds() * 1000
@@ -62,7 +76,7 @@ class Rotate:
             processing_time = (cur_timestamp - timestamp).total_seconds() * 1000
             cur_timestamp = cur_timestamp.isoformat()
             
-            self._tool_msg.send_msg(msg_id, resp_msg_id, cur_timestamp, 'error', processing_time, None, self._codes['error_processing'], "An error occurred while processing the image", img_path)
+            self._tool_msg.send_msg(msg_id, resp_msg_id, cur_timestamp, 'error', processing_time, None, err_code=self._codes['error_processing'], err_msg="An error occurred while processing the image", og_img_uri=img_path)
 
     def exec(self, args):
         while True:
@@ -1,5 +1,4 @@
 import sys
-import json
 import datetime
 import pytz
 
@@ -25,30 +24,25 @@ class Saturation:
         }
 
     def saturation_image(self, img_path, store_img_path, saturation_factor):
-        #load image
-        img = self._img_handler.get_img(img_path)
-        
-        # Only convert palette images
-        if img.mode == 'P':
-            img = img.convert('RGB')
-        
-        # apply saturation
-        enhancer = ImageEnhance.Color(img)
-        new_img = enhancer.enhance(saturation_factor)
-        
-        # store image
-        self._img_handler.store_img(new_img, store_img_path)
+        def saturate(img):
+            # Only convert palette images
+            if img.mode == 'P':
+                img = img.convert('RGB')
 
-    def saturation_callback(self, ch, method, properties, body):
-        json_str = body.decode()
-        info = json.loads(json_str)
-        
-        msg_id = info['messageId']
-        timestamp = datetime.datetime.fromisoformat(info['timestamp'])
-        procedure = info['procedure']
-        img_path = info['parameters']['inputImageURI']
-        store_img_path = info['parameters']['outputImageURI']
-        saturation_factor = info['parameters']['saturationFactor']
+            # apply saturation
+            enhancer = ImageEnhance.Color(img)
+            return enhancer.enhance(saturation_factor)
+
+        #load image, apply saturation to every frame and store it
+        self._img_handler.apply(img_path, store_img_path, saturate)
+
+    def saturation_callback(self, ch, method, properties, info):
+        msg_id = info.messageId
+        timestamp = info.timestamp
+        procedure = info.procedure
+        img_path = info.parameters.inputImageURI
+        store_img_path = info.parameters.outputImageURI
+        saturation_factor = info.parameters.saturationFactor
         
         resp_msg_id = f'saturation-{self._counter}-{msg_id}'
         self._counter += 1
@@ -64,9 +58,9 @@ class Saturation:
                                     'error', 
                                     processing_time, 
                                     None, 
-                                    self._codes['wrong_procedure'], 
-                                    "The procedure received does not fit into this tool", 
-                                    img_path)
+                                    err_code=self._codes['wrong_procedure'], 
+                                    err_msg="The procedure received does not fit into this tool", 
+                                    og_img_uri=img_path)
             return
 
         try:
@@ -93,9 +87,9 @@ class Saturation:
                                     'error',
                                     processing_time,
                                     None, 
-                                    self._codes['error_processing'], 
-                                    str(e), 
-                                    img_path)
+                                    err_code=self._codes['error_processing'], 
+                                    err_msg=str(e), 
+                                    og_img_uri=img_path)
 
     def exec(self, args):
         while True:
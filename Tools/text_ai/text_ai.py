@@ -1,5 +1,4 @@
 import sys
-import json
 import datetime
 import numpy as np
 import pytz
@@ -53,16 +52,14 @@ class Text_AI:
     
         return text_path
 
-    def ocr_callback(self, ch, method, properties, body):
-        json_str = body.decode()
-        info = json.loads(json_str)
-        msg_id = info['messageId']
+    def ocr_callback(self, ch, method, properties, info):
+        msg_id = info.messageId
 
-        timestamp = datetime.datetime.fromisoformat(info['timestamp'])
+        timestamp = info.timestamp
         
-        procedure = info['procedure']
-        img_path = info['parameters']['inputImageURI']
-        store_txt_path = info['parameters']['outputImageURI']
+        procedure = info.procedure
+        img_path = info.parameters.inputImageURI
+        store_txt_path = info.parameters.outputImageURI
 
         resp_msg_id = f'text_ai-{self._counter}-{msg_id}'
         self._counter += 1
@@ -78,9 +75,9 @@ class Text_AI:
                 'error', 
                 processing_time, 
                 None,
-                self._codes['wrong_procedure'], 
-                "The procedure received does not fit into this tool", 
-                img_path
+                err_code=self._codes['wrong_procedure'], 
+                err_msg="The procedure received does not fit into this tool", 
+                og_img_uri=img_path
             )
 
             return
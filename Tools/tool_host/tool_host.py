@@ -0,0 +1,316 @@
+"""
+Tool host: runs several tools in one container instead of one container each.
+
+The host process imports the tools listed in TOOL_HOST_TOOLS, forks a pool of
+TOOL_HOST_WORKERS processes (they share the imported PIL/NumPy code pages)
+and keeps a single RabbitMQ connection. It pulls jobs from the tool queues
+only when a worker is free, so a worker goes to whichever queue needs it
+most: the one with the largest backlog (depth x recent service time) per job
+already in flight. Replies and acks are sent by the host on that connection.
+
+A worker that dies mid-job (OOM kill, a crash in a native library) breaks
+the pool: its jobs, and any other in flight, are answered with an error and
+the pool is forked anew, so the host keeps its workers, budget and acks.
+
+With TOOL_MEMORY_BUDGET_MB set, the budget covers the whole host: a job only
+starts once its estimated memory (utils/admission.py) fits next to the jobs
+already running, and jobs wait in order for it.
+
+Each tool's callback runs unchanged in a worker; its replies are recorded
+there and published by the host with the tool's own ToolMSG, so expiry,
+cancellation, priorities and wait metrics behave as in a per-tool container.
+"""
+
+import os
+import sys
+import json
+import time
+import functools
+import collections
+import importlib.util
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# in the image the tool folders sit next to this file, in the repo one level up
+TOOLS_DIR = HERE if os.path.isdir(os.path.join(HERE, 'utils')) else os.path.dirname(HERE)
+if TOOLS_DIR not in sys.path:
+    sys.path.insert(0, TOOLS_DIR)
+
+import utils.env as env
+import utils.tool_msg as tool_msg_module
+import utils.compose as compose
+from utils.admission import MemoryBudget
+from utils.tool_msg import ToolMSG, MAX_PRIORITY
+from utils.messages import InvalidMessage
+
+# tool -> (module file relative to the tools dir, class, queue callback)
+TOOLS = {
+    'binarization': ('binarization/binarization.py', 'Binarization', 'binarization_callback'),
+    'border': ('border/border.py', 'Border', 'border_callback'),
+    'brightness': ('brightness/brightness.py', 'Brightness', 'brightness_callback'),
+    'contrast': ('contrast/contrast.py', 'Contrast', 'contrast_callback'),
+    'cut': ('cut/cut.py', 'Cut', 'cut_callback'),
+    'resize': ('resize/resize.py', 'Resize', 'resize_callback'),
+    'rotate': ('rotate/rotate.py', 'Rotate', 'rotate_callback'),
+    'saturation': ('saturation/saturation.py', 'Saturation', 'saturation_callback'),
+    'watermark': ('watermark/watermark.py', 'Watermark', 'watermark_callback'),
+}
+
+HOST_TOOLS = [t for t in os.getenv('TOOL_HOST_TOOLS', ','.join(TOOLS)).split(',') if t]
+HOST_WORKERS = int(os.getenv('TOOL_HOST_WORKERS', os.cpu_count() or 1))
+# how often queue depths are re-read while idle, and the allocation is logged
+DEPTH_INTERVAL = float(os.getenv('TOOL_HOST_DEPTH_INTERVAL', 0.2))
+STATS_INTERVAL = float(os.getenv('TOOL_HOST_STATS_INTERVAL', 30))
+# service time assumed for a tool before its first job finishes
+INITIAL_SERVICE_S = 0.1
+SERVICE_EWMA = 0.2
+
+
+def load_tool_module(tool):
+    rel_path = TOOLS[tool][0]
+    path = os.path.join(TOOLS_DIR, rel_path)
+    # tools import siblings from their own folder (e.g. cut -> processor)
+    tool_dir = os.path.dirname(path)
+    if tool_dir not in sys.path:
+        sys.path.append(tool_dir)
+
+    name = f'tool_host_{tool}'
+    if name not in sys.modules:
+        spec = importlib.util.spec_from_file_location(name, path)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        spec.loader.exec_module(module)
+    return sys.modules[name]
+
+
+def build_tool(tool, tool_msg_factory):
+    """Instantiate a tool with `tool_msg_factory` standing in for ToolMSG."""
+    module = load_tool_module(tool)
+    module.ToolMSG = tool_msg_factory
+    return getattr(module, TOOLS[tool][1])()
+
+
+# ---------------------------------------------------------------- worker side
+
+class _ReplyRecorder:
+    """ToolMSG stand-in inside a worker: replies go back to the host, not to RabbitMQ."""
+
+    def __init__(self, *args, **kwargs):
+        self.sent = []
+
+    def send_msg(self, *args, **kwargs):
+        self.sent.append((args, kwargs))
+
+    def send_failed(self, info, error):
+        # failed composed jobs (utils/compose.py): the host answers them, as any job that raised
+        raise error
+
+
+_worker_tools = {}
+
+
+def _init_worker(tools):
+    for tool in tools:
+        _worker_tools[tool] = build_tool(tool, _ReplyRecorder)
+
+
+def _run_job(tool, info):
+    instance = _worker_tools[tool]
+    instance._tool_msg.sent = []
+    started = time.perf_counter()
+    # composed geometric jobs are rendered by utils/compose.py, as in ToolMSG.read_msg
+    compose.wrap(instance._tool_msg, getattr(instance, TOOLS[tool][2]))(None, None, None, info)
+    return instance._tool_msg.sent, time.perf_counter() - started
+
+
+# ------------------------------------------------------------------ host side
+
+class ToolHost:
+    def __init__(self, tools=None, workers=None, rabbit_mq=None):
+        self._tools = list(tools or HOST_TOOLS)
+        unknown = [t for t in self._tools if t not in TOOLS]
+        if unknown:
+            raise ValueError(f"Unknown tools for the tool host: {', '.join(unknown)}")
+        self._workers = workers or HOST_WORKERS
+
+        # import before forking so the workers share the loaded modules
+        for tool in self._tools:
+            load_tool_module(tool)
+        self._pool = self._new_pool()
+        # the executor forks on its first job: before the connection and its threads exist
+        self._pool.submit(int).result()
+
+        self._rabbit_mq = rabbit_mq or tool_msg_module.Rabbit_MQ(
+            env.RABBITMQ_HOST, int(env.RABBITMQ_PORT), env.RABBITMQ_USERNAME, env.RABBITMQ_PASSWORD, MAX_PRIORITY
+        )
+        # each tool's own ToolMSG (same microservice name and queue), all on one connection
+        shared = functools.partial(ToolMSG, rabbit_mq=self._rabbit_mq)
+        self._tool_msgs = {}
+        for tool in self._tools:
+            instance = build_tool(tool, shared)
+            instance._tool_msg.codes = instance._codes
+            self._tool_msgs[tool] = instance._tool_msg
+        # <tool>_large_queue on a TOOL_LARGE_WORKER host
+        self._queues = {tool: self._tool_msgs[tool].queue for tool in self._tools}
+
+        self._free = self._workers
+        self._unacked = {}  # delivery tag -> jobs of it still running
+        self._budget = MemoryBudget()
+        self._held = collections.deque()  # (tool, tag, job, estimate) waiting for memory
+        self._inflight = {tool: 0 for tool in self._tools}
+        self._depth = {tool: 0 for tool in self._tools}
+        self._service_s = {tool: INITIAL_SERVICE_S for tool in self._tools}
+        self._done = {tool: 0 for tool in self._tools}
+        self._last_depth = 0.0
+        self._last_stats = time.monotonic()
+
+    def _new_pool(self):
+        return ProcessPoolExecutor(
+            self._workers, mp_context=multiprocessing.get_context('fork'),
+            initializer=_init_worker, initargs=(self._tools,)
+        )
+
+    def _replace_pool(self, broken):
+        """Fork a new pool in place of `broken`, unless that was done already."""
+        if broken is not self._pool:
+            return
+        print(json.dumps({
+            'metric': 'tool_host_pool_broken',
+            'workers': self._workers,
+            'inflight': self._inflight,
+        }), flush=True)
+        broken.shutdown(wait=False, cancel_futures=True)
+        self._pool = self._new_pool()
+
+    def _refresh_depths(self):
+        for tool, queue in self._queues.items():
+            self._depth[tool] = self._rabbit_mq.queue_depth(queue)
+        self._last_depth = time.monotonic()
+
+    def _pick_tool(self):
+        """Queue with the most waiting work (depth x service time) per job in flight."""
+        best, best_score = None, 0.0
+        for tool in self._tools:
+            if self._depth[tool] <= 0:
+                continue
+            score = self._depth[tool] * self._service_s[tool] / (self._inflight[tool] + 1)
+            if score > best_score:
+                best, best_score = tool, score
+        return best
+
+    def _dispatch(self):
+        # jobs waiting for memory start first and in order; nothing new is pulled meanwhile
+        while self._held and self._free > 0 and self._budget.fits(self._held[0][3]):
+            self._start(*self._held.popleft())
+
+        while self._free > 0 and not self._held:
+            tool = self._pick_tool()
+            if tool is None:
+                return
+            got = self._rabbit_mq.get_rabbit_msg(self._queues[tool])
+            if got is None:
+                self._depth[tool] = 0
+                continue
+            method, properties, body = got
+            self._depth[tool] = method.message_count
+
+            tool_msg = self._tool_msgs[tool]
+            try:
+                info = tool_msg.decode(body, properties.content_type)
+            except InvalidMessage as e:
+                tool_msg.send_rejected(body, properties.content_type, e)
+                self._rabbit_mq.ack(method.delivery_tag)
+                continue
+            jobs = []
+            for job in tool_msg.begin_batch(info) if info.is_batch else [info]:
+                if tool_msg.drop_if_stale(job):
+                    continue
+                estimate = tool_msg.admit(job, properties.content_type)
+                if estimate is not None:
+                    jobs.append((job, estimate))
+            tag = method.delivery_tag
+            if not jobs:
+                self._rabbit_mq.ack(tag)
+                continue
+
+            # a batch is acked after its last item; its items may briefly overcommit the pool
+            self._unacked[tag] = len(jobs)
+            for job, estimate in jobs:
+                if self._held or not self._budget.fits(estimate):
+                    self._held.append((tool, tag, job, estimate))
+                else:
+                    self._start(tool, tag, job, estimate)
+
+    def _start(self, tool, tag, job, estimate):
+        self._free -= 1
+        self._inflight[tool] += 1
+        self._budget.take(estimate)
+        try:
+            future = self._pool.submit(_run_job, tool, job)
+        except BrokenProcessPool:
+            # broken since the last job finished: its own jobs are answered in _finish
+            self._replace_pool(self._pool)
+            future = self._pool.submit(_run_job, tool, job)
+        pool = self._pool
+        # pool management thread -> connection thread
+        future.add_done_callback(lambda f: self._rabbit_mq.add_callback_threadsafe(
+            functools.partial(self._finish, tool, tag, job, estimate, pool, f)))
+
+    def _finish(self, tool, delivery_tag, job, estimate, pool, future):
+        error = future.exception()
+        if isinstance(error, BrokenProcessPool):
+            # a worker died: every job still in that pool ends here, and none would finish
+            self._replace_pool(pool)
+        if error is None:
+            replies, elapsed = future.result()
+            for args, kwargs in replies:
+                self._tool_msgs[tool].send_msg(*args, **kwargs)
+            self._service_s[tool] += SERVICE_EWMA * (elapsed - self._service_s[tool])
+        else:
+            # the job is answered with an error, not retried
+            self._tool_msgs[tool].send_failed(job, error)
+        self._unacked[delivery_tag] -= 1
+        if self._unacked[delivery_tag] == 0:
+            del self._unacked[delivery_tag]
+            self._rabbit_mq.ack(delivery_tag)
+        self._free += 1
+        self._inflight[tool] -= 1
+        self._done[tool] += 1
+        self._budget.release(estimate)
+
+    def _log_stats(self):
+        print(json.dumps({
+            'metric': 'tool_host_allocation',
+            'workers': self._workers,
+            'inflight': self._inflight,
+            'depth': self._depth,
+            'service_ms': {t: round(s * 1000, 1) for t, s in self._service_s.items()},
+            'done': self._done,
+            'memory_mb': round(self._budget.in_use / 2**20, 1),
+            'held': len(self._held),
+        }), flush=True)
+        self._last_stats = time.monotonic()
+
+    def run(self):
+        for queue in self._queues.values():
+            self._rabbit_mq.declare_queue(queue)
+        next(iter(self._tool_msgs.values())).start_cancel_listener()
+
+        try:
+            while True:
+                if time.monotonic() - self._last_depth >= DEPTH_INTERVAL:
+                    self._refresh_depths()
+                self._dispatch()
+                if time.monotonic() - self._last_stats >= STATS_INTERVAL:
+                    self._log_stats()
+                # services the connection and runs the finished-job callbacks
+                self._rabbit_mq.sleep(DEPTH_INTERVAL / 4 if self._free else 0.01)
+        finally:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+if __name__ == '__main__':
+    print(f"tool host: {', '.join(HOST_TOOLS)} on {HOST_WORKERS} workers", flush=True)
+    ToolHost().run()
@@ -1,5 +1,4 @@
 import datetime
-import json
 import sys
 
 import numpy as np
@@ -10,6 +9,7 @@ import pytz
 
 from utils.img_handler import Img_Handler
 from utils.tool_msg import ToolMSG
+import utils.progressive as progressive
 import utils.env as env
 
 class Upgrade_ai:
@@ -102,16 +102,14 @@ class Upgrade_ai:
         # final_pil.save(output_path, quality=95, optimize=True)
         self._img_handler.store_img(final_pil, store_img_path)
 
-    def upgrade_ai_callback(self, ch, method, properties, body):
-        json_str = body.decode()
-        info = json.loads(json_str)
-        msg_id = info['messageId']
+    def upgrade_ai_callback(self, ch, method, properties, info):
+        msg_id = info.messageId
 
-        timestamp = datetime.datetime.fromisoformat(info['timestamp'])
+        timestamp = info.timestamp
 
-        procedure = info['procedure']
-        img_path = info['parameters']['inputImageURI']
-        store_img_path = info['parameters']['outputImageURI']
+        procedure = info.procedure
+        img_path = info.parameters.inputImageURI
+        store_img_path = info.parameters.outputImageURI
 
         resp_msg_id = f'upgrade-ai-{self._counter}-{msg_id}'
         self._counter += 1
@@ -128,14 +126,18 @@ class Upgrade_ai:
                 'error',
                 processing_time,
                 None,
-                self._codes['wrong_procedure'], 
-                "The procedure received does not fit into this tool", 
-                img_path
+                err_code=self._codes['wrong_procedure'], 
+                err_msg="The procedure received does not fit into this tool", 
+                og_img_uri=img_path
             )
             
             return
 
         try:
+            # progressive previews: the result on a downscaled proxy first
+            progressive.send_proxy_result(self._tool_msg, info, resp_msg_id, img_path, store_img_path,
+                                          lambda src, dst, scale: self.enhance_image(src, dst))
+
             self.enhance_image(img_path, store_img_path)
 
             cur_timestamp = datetime.datetime.now(pytz.utc)
@@ -162,9 +164,9 @@ class Upgrade_ai:
                 'error',
                 processing_time,
                 None,
-                self._codes['error_processing'],
-                str(e),
-                img_path
+                err_code=self._codes['error_processing'],
+                err_msg=str(e),
+                og_img_uri=img_path
             )
 
     def exec(self, args):
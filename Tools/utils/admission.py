@@ -0,0 +1,114 @@
+"""
+Memory admission control for tool jobs.
+
+Before a job is run, only the header of its input image is read (size, mode,
+frame count) and the job's peak memory is estimated from the tool's cost per
+megapixel. A job that cannot fit the worker's TOOL_MEMORY_BUDGET_MB even on
+its own is republished to the tool's large queue, served by workers with
+TOOL_LARGE_WORKER=1 and more memory; where several jobs run at once (the tool
+host), a job only starts once it fits next to the ones already running.
+
+Images over TOOL_MAX_IMAGE_PIXELS (Pillow's decompression-bomb limit) are
+refused with ImageTooLarge.
+"""
+
+import math
+import warnings
+from typing import NamedTuple
+
+from PIL import Image
+
+from . import env
+from .img_handler import Img_Handler
+
+MIB = 1024 * 1024
+
+# tool -> (MiB per megapixel of input, fixed MiB) over the interpreter and
+# libraries, from `python -m benchmarks.memory` (memory_model.json, highest of
+# the measured modes, rounded up). Unmeasured tools use DEFAULT_COST.
+COSTS = {
+    'binarization': (6, 1),
+    'border': (8, 2),
+    'brightness': (13, 1),
+    'contrast': (13, 7),
+    'cut': (6, 1),
+    'expand_ai': (17, 22),
+    'resize': (11, 1),
+    'rotate': (10, 1),
+    'saturation': (13, 1),
+    'upgrade_ai': (35, 9),
+    'watermark': (13, 2),
+}
+DEFAULT_COST = (32, 16)
+
+# Pillow raises DecompressionBombError itself at twice this many pixels
+Image.MAX_IMAGE_PIXELS = env.TOOL_MAX_IMAGE_PIXELS
+
+
+class ImageTooLarge(Exception):
+    """The input image is over the decompression-bomb limit."""
+
+
+class ImageHeader(NamedTuple):
+    width: int
+    height: int
+    mode: str
+    frames: int
+
+    @property
+    def megapixels(self):
+        return self.width * self.height / 1e6
+
+
+def read_header(img_path):
+    """The image's header, without decoding any pixels; raises ImageTooLarge."""
+    img_handler = Img_Handler()
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', Image.DecompressionBombWarning)
+            # s3:// inputs: a ranged read of the first few KiB
+            with img_handler.get_img(img_path) as img:
+                # only streamed animations can have several frames in memory
+                frames = img.n_frames if img_handler.is_animated(img) else 1
+                header = ImageHeader(img.width, img.height, img.mode, frames)
+    except Image.DecompressionBombError as e:
+        raise ImageTooLarge(str(e)) from e
+
+    if header.width * header.height > env.TOOL_MAX_IMAGE_PIXELS:
+        raise ImageTooLarge(
+            f"Image of {header.width}x{header.height} pixels is over the limit of "
+            f"{env.TOOL_MAX_IMAGE_PIXELS} pixels"
+        )
+    return header
+
+
+def estimate_bytes(tool, header):
+    """Peak memory of running `tool` on an image with this header."""
+    per_mp, fixed = COSTS.get(tool, DEFAULT_COST)
+    frames = 1
+    if header.frames > 1 and env.TOOL_FRAME_WORKERS > 1 and header.frames >= env.TOOL_FRAME_PARALLEL_MIN:
+        # frames transformed in parallel are in memory at the same time
+        frames = min(header.frames, 2 * env.TOOL_FRAME_WORKERS)
+    return math.ceil((fixed + per_mp * header.megapixels * frames) * MIB)
+
+
+class MemoryBudget:
+    """Estimated bytes of the running jobs against a budget (0 = no limit)."""
+
+    def __init__(self, budget_mb=None):
+        self.budget = (env.TOOL_MEMORY_BUDGET_MB if budget_mb is None else budget_mb) * MIB
+        self.in_use = 0
+
+    def too_large(self, estimate):
+        """True if the job could not run here even alone."""
+        return bool(self.budget) and estimate > self.budget
+
+    def fits(self, estimate):
+        # a job over the budget still runs once it is alone (on a large worker)
+        return not self.budget or self.in_use == 0 or self.in_use + estimate <= self.budget
+
+    def take(self, estimate):
+        self.in_use += estimate
+
+    def release(self, estimate):
+        self.in_use -= estimate
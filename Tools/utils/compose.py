@@ -0,0 +1,304 @@
+"""
+Composed geometric chains: consecutive rotate, resize, cut and border steps
+rendered with a single resample.
+
+The projects service sends a run of such steps as one job: the first step's
+message carries the following ones in "compose" (see ToolRequest), and any of
+the four tools renders the whole run. The steps are folded into one affine
+map from output to input pixels plus the output size (the window left by the
+cuts), and the input is sampled once, only where the output needs it:
+
+  - the input is first cropped to the area the output maps to, and when the
+    chain shrinks it by RESIZE_REDUCING_GAP or more, box-reduced by a whole
+    factor (as Image.resize's reducing_gap does), so the work follows the
+    output's size and not the intermediate ones;
+  - borders are painted on the output where each one's frame lands, and what
+    an intermediate image's bounds hid from a later rotate or cut (the
+    corners a rotation fills, a cut past the edge) is blacked out again.
+
+Leading cuts, borders and quarter turns are applied as they are, before the
+plan: they only move pixels.
+
+Chains with a resize (or any non-integer map) are sampled bicubically, like
+the resize tool; rotations alone keep the rotate tool's nearest neighbour.
+Modes other than L, LA, RGB and RGBA (P, 1, I, ...) run the steps one by one,
+as the tools themselves would.
+"""
+
+import math
+import datetime
+
+from PIL import Image, ImageOps
+
+from . import env
+from . import geometry
+from .img_handler import Img_Handler
+
+COMPOSED_MODES = {'L', 'LA', 'RGB', 'RGBA'}
+IDENTITY = (1.0, 0.0, 0.0, 0.0, 1.0, 0.0)
+# input pixels kept around the sampled area, for the bicubic kernel
+MARGIN = 3
+# counter-clockwise quarter turn -> output -> input map of Image.transpose, for an input of (width, height)
+QUARTER_TURNS = {
+    90.0: lambda width, height: (0.0, -1.0, width, 1.0, 0.0, 0.0),
+    180.0: lambda width, height: (-1.0, 0.0, width, 0.0, -1.0, height),
+    270.0: lambda width, height: (0.0, 1.0, 0.0, -1.0, 0.0, height),
+}
+
+
+def wrap(tool_msg, callback, acks=False):
+    """
+    `callback` for a tool's queue, with composed jobs (a "compose" list)
+    rendered here instead. acks: `callback` acks its messages itself, so a
+    composed job's message is acked here too.
+    """
+    def run_or_callback(ch, method, properties, info):
+        if not info.compose:
+            return callback(ch, method, properties, info)
+        try:
+            run(tool_msg, info)
+        finally:
+            if acks:
+                ch.basic_ack(delivery_tag=method.delivery_tag)
+    return run_or_callback
+
+
+def run(tool_msg, info):
+    """Render the job's steps and answer it like a single tool would."""
+    steps = [(info.procedure, info.parameters), *((step.procedure, step.parameters) for step in info.compose)]
+    img_path = info.parameters.inputImageURI
+    store_img_path = info.parameters.outputImageURI
+    try:
+        Img_Handler().apply(img_path, store_img_path, lambda img: render(img, steps))
+    except Exception as e:
+        tool_msg.send_failed(info, e)
+        return
+
+    cur_timestamp = datetime.datetime.now(datetime.timezone.utc)
+    processing_time = (cur_timestamp - info.timestamp).total_seconds() * 1000
+    tool_msg.send_msg(info.messageId, f'compose-{len(steps)}-{info.messageId}', cur_timestamp.isoformat(),
+                      'success', processing_time, store_img_path)
+
+
+def render(img, steps):
+    """`img` after the (procedure, parameters) steps, sampled once."""
+    if img.mode not in COMPOSED_MODES:
+        for procedure, params in steps:
+            img = apply_step(img, procedure, params)
+        return img
+
+    steps = list(steps)
+    # leading cuts, borders and quarter turns only move pixels: done as is, they leave no overlay to paint
+    while steps and _moves_pixels(*steps[0]):
+        img = apply_step(img, *steps.pop(0))
+    if not steps:
+        return img
+
+    plan = Plan(img.size)
+    for procedure, params in steps:
+        plan.add(procedure, params)
+    return plan.render(img)
+
+
+def _moves_pixels(procedure, params):
+    return procedure in ('cut', 'border') or (procedure == 'rotate' and params.degrees % 90 == 0)
+
+
+def apply_step(img, procedure, params):
+    """One step on its own, as its tool does it."""
+    match procedure:
+        case 'rotate':
+            return geometry.rotate(img, params.degrees)
+        case 'resize':
+            return img.resize((params.width, params.height))
+        case 'cut':
+            return img.crop((params.left, params.top, params.right, params.bottom))
+        case 'border':
+            return ImageOps.expand(img, border=params.borderWidth, fill=(params.r, params.g, params.b))
+    raise ValueError(f"'{procedure}' can't be composed")
+
+
+def _then(first, second):
+    # the map applying `second`, then `first`
+    a, b, c, d, e, f = first
+    p, q, r, s, t, u = second
+    return (a * p + b * s, a * q + b * t, a * r + b * u + c,
+            d * p + e * s, d * q + e * t, d * r + e * u + f)
+
+
+def _apply(matrix, x, y):
+    a, b, c, d, e, f = matrix
+    return a * x + b * y + c, d * x + e * y + f
+
+
+class Plan:
+    """The steps so far as one output -> input affine map, the output size and the overlays."""
+
+    def __init__(self, size):
+        self.size = size
+        self.matrix = IDENTITY
+        # in step order, (output -> that step's image map, its size, border width, color):
+        # a border's frame to paint (width > 0), or the bounds of an image a later
+        # rotate or cut looks past (width 0), outside which the output is black
+        self.overlays = []
+        self.resized = False
+
+    def _step(self, matrix, size):
+        self.matrix = _then(self.matrix, matrix)
+        self.overlays = [(_then(frame, matrix), *rest) for frame, *rest in self.overlays]
+        self.size = size
+
+    def _clip(self):
+        # the image so far bounds what the next step shows (the input's own bounds need no overlay)
+        if self.matrix != IDENTITY:
+            self.overlays.append((IDENTITY, self.size, 0, None))
+
+    def add(self, procedure, params):
+        width, height = self.size
+        match procedure:
+            case 'rotate':
+                angle = params.degrees % 360.0
+                if angle in QUARTER_TURNS:
+                    # Image.rotate transposes these; its matrix would be off by half a pixel on odd sides
+                    self._step(QUARTER_TURNS[angle](width, height), (height, width) if angle != 180 else (width, height))
+                elif angle:
+                    self._clip()
+                    size, matrix = geometry.rotate_matrix(self.size, angle, True)
+                    self._step(tuple(matrix), size)
+            case 'resize':
+                if params.width < 1 or params.height < 1:
+                    raise ValueError("height and width must be > 0")
+                self._step((width / params.width, 0.0, 0.0, 0.0, height / params.height, 0.0),
+                           (params.width, params.height))
+                self.resized = True
+            case 'cut':
+                # rounded like Image.crop
+                left, top, right, bottom = (int(round(v)) for v in (params.left, params.top, params.right, params.bottom))
+                if right < left or bottom < top:
+                    raise ValueError("Coordinate 'right' is less than 'left'" if right < left
+                                     else "Coordinate 'lower' is less than 'upper'")
+                if not (0 <= left and 0 <= top and right <= width and bottom <= height):
+                    self._clip()
+                self._step((1.0, 0.0, left, 0.0, 1.0, top), (right - left, bottom - top))
+            case 'border':
+                border = params.borderWidth
+                if border > 0:
+                    self._step((1.0, 0.0, -border, 0.0, 1.0, -border), (width + 2 * border, height + 2 * border))
+                    self.overlays.append((IDENTITY, self.size, border, (params.r, params.g, params.b)))
+            case _:
+                raise ValueError(f"'{procedure}' can't be composed")
+
+    def resample(self):
+        a, b, c, d, e, f = self.matrix
+        # quarter turns, flips and whole-pixel shifts only move pixels
+        moves_pixels = all(v in (-1.0, 0.0, 1.0) for v in (a, b, d, e)) and c == int(c) and f == int(f)
+        if self.resized and not moves_pixels:
+            return Image.Resampling.BICUBIC
+        return Image.Resampling.NEAREST
+
+    def reduction(self):
+        """Whole factor the input can be box-reduced by first (1 = none)."""
+        a, b, _, d, e, _ = self.matrix
+        # smallest singular value: input pixels per output pixel along the least shrunk direction
+        p = a * a + b * b + d * d + e * e
+        q = abs(a * e - b * d)
+        least = math.sqrt(max(p - math.sqrt(max(p * p - 4 * q * q, 0.0)), 0.0) / 2)
+        return max(1, int(least / env.RESIZE_REDUCING_GAP))
+
+    def render(self, img):
+        width, height = self.size
+        resample = self.resample()
+        matrix = self.matrix
+        src = img
+
+        factor = self.reduction() if resample != Image.Resampling.NEAREST else 1
+        # the part of the input the output maps to
+        xs, ys = zip(*(_apply(matrix, x, y) for x, y in ((0, 0), (width, 0), (width, height), (0, height))))
+        margin = MARGIN * factor
+        box = (max(0, math.floor(min(xs)) - margin), max(0, math.floor(min(ys)) - margin),
+               min(img.width, math.ceil(max(xs)) + margin), min(img.height, math.ceil(max(ys)) + margin))
+        if box[0] < box[2] and box[1] < box[3] and box != (0, 0, img.width, img.height):
+            src = img.crop(box)
+            matrix = _then((1.0, 0.0, -box[0], 0.0, 1.0, -box[1]), matrix)
+        if factor > 1:
+            src = src.reduce(factor)
+            matrix = tuple(v / factor for v in matrix)
+
+        a, b, c, d, e, f = matrix
+        if (a, b, d, e) == (1.0, 0.0, 0.0, 1.0) and c == int(c) and f == int(f):
+            # cuts and borders only: a shifted window of the input
+            out = src.crop((int(c), int(f), int(c) + width, int(f) + height))
+        else:
+            out = src.transform(self.size, Image.Transform.AFFINE, matrix, resample=resample)
+        overlays = [overlay for overlay in self.overlays if overlay[2] or not _covers(overlay, self.size)]
+        if overlays:
+            out = _paint(out, overlays)
+        out.info = img.info.copy()
+        return out
+
+
+def _covers(overlay, size):
+    # whether the bounds contain every output pixel centre (an affine map keeps the corners' hull)
+    frame, (width, height), _, _ = overlay
+    corners = ((0.5, 0.5), (size[0] - 0.5, 0.5), (size[0] - 0.5, size[1] - 0.5), (0.5, size[1] - 0.5))
+    return all(0 <= u < width and 0 <= v < height for u, v in (_apply(frame, x, y) for x, y in corners))
+
+
+def _paint(out, overlays):
+    """Black out what lies past the clipping bounds and paint the border frames, in step order."""
+    for frame, (width, height), border, color in overlays:
+        inner = (border, border, width - border, height - border)
+        if border:
+            # the border's color in the image's mode, as ImageOps.expand fills it
+            value = ImageOps.expand(Image.new(out.mode, (1, 1)), border=1, fill=color).getpixel((0, 0))
+        else:
+            value = 0
+        if frame[1] == frame[3] == 0:
+            # upright in the output: a few rectangles
+            outer = _rect(frame, (0, 0, width, height), out.size) if border else (0, 0, *out.size)
+            for box in _ring(outer, _rect(frame, inner, out.size)):
+                out.paste(value, box)
+            continue
+
+        # turned: the output pixels whose centre lands on the ring (or off the bounds), as the
+        # rotate tool's own nearest sampling decides it
+        shape = Image.new('1', (width, height), 255 if border else 0)
+        if border:
+            shape.paste(0, inner)
+        out.paste(value, mask=shape.transform(out.size, Image.Transform.AFFINE, frame,
+                                              Image.Resampling.NEAREST, fillcolor=0 if border else 255))
+    return out
+
+
+def _rect(frame, box, size):
+    # the output pixels an upright `frame` maps into `box`, as (left, top, right, bottom)
+    a, _, c, _, e, f = frame
+    left, right = _span(a, c, box[0], box[2], size[0])
+    top, bottom = _span(e, f, box[1], box[3], size[1])
+    if left >= right or top >= bottom:
+        return 0, 0, 0, 0
+    return left, top, right, bottom
+
+
+def _span(p, k, lo, hi, n):
+    # the pixels [first, end) of n whose centre x + .5 has lo <= p * (x + .5) + k < hi
+    if p > 0:
+        first, end = math.ceil((lo - k) / p - 0.5), math.ceil((hi - k) / p - 0.5)
+    elif p < 0:
+        first, end = math.floor((hi - k) / p - 0.5) + 1, math.floor((lo - k) / p - 0.5) + 1
+    else:
+        first, end = (0, n) if lo <= k < hi else (0, 0)
+    first = min(max(first, 0), n)
+    return first, max(min(end, n), first)
+
+
+def _ring(outer, inner):
+    # `outer` less `inner`, as up to four rectangles
+    left, top, right, bottom = outer
+    if inner[0] >= inner[2] or inner[1] >= inner[3]:
+        return [outer] if left < right and top < bottom else []
+    in_left, in_top = max(inner[0], left), max(inner[1], top)
+    in_right, in_bottom = min(inner[2], right), min(inner[3], bottom)
+    boxes = [(left, top, right, in_top), (left, in_bottom, right, bottom),
+             (left, in_top, in_left, in_bottom), (in_right, in_top, right, in_bottom)]
+    return [box for box in boxes if box[0] < box[2] and box[1] < box[3]]
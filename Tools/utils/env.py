@@ -9,6 +9,86 @@ RABBITMQ_USERNAME = os.getenv('RABBITMQ_USERNAME','user')  # Replace with your R
 RABBITMQ_PASSWORD = os.getenv('RABBITMQ_PASSWORD','password')  # Replace with your RabbitMQ password
 IMG_STORAGE_URL = os.getenv('RABBITMQ_PASSWORD','http://image-storage-service:3000/')
 
+# Unacked messages a tool worker holds; keep it low so queued previews can still overtake bulk jobs
+TOOL_PREFETCH = int(os.getenv('TOOL_PREFETCH', 1))
+
+# Max age in seconds per message class for messages without a "deadline" (0 = no limit)
+TOOL_MAX_AGE = {
+    'preview': float(os.getenv('TOOL_MAX_AGE_PREVIEW', 0)),
+    'request': float(os.getenv('TOOL_MAX_AGE_REQUEST', 0)),
+}
+
+# Cancel scopes whose latest tombstone a worker remembers; the least recently
+# cancelled ones are forgotten first
+TOOL_CANCEL_SCOPES = int(os.getenv('TOOL_CANCEL_SCOPES', 10000))
+
+# Consumer processes forked from one model-loading parent (utils/prefork.py); 1 = no fork
+TOOL_WORKERS = int(os.getenv('TOOL_WORKERS', 1))
+# Torch intra-op threads per forked worker (0 = cpu count / TOOL_WORKERS)
+TOOL_WORKER_THREADS = int(os.getenv('TOOL_WORKER_THREADS', 0))
+
+# Threads transforming the frames of an animated image (utils/img_handler.py), and the
+# number of frames from which they are used; 1 = one frame after the other
+TOOL_FRAME_WORKERS = int(os.getenv('TOOL_FRAME_WORKERS', 1))
+TOOL_FRAME_PARALLEL_MIN = int(os.getenv('TOOL_FRAME_PARALLEL_MIN', 16))
+
+# 1 = decode, run and encode/write consecutive jobs of a worker in overlapping stages
+# (utils/pipeline.py), holding TOOL_PIPELINE_PREFETCH unacked messages; 0 = one job at a time.
+# Stage utilization is logged every TOOL_PIPELINE_STATS_SECONDS
+TOOL_PIPELINE = int(os.getenv('TOOL_PIPELINE', 0))
+TOOL_PIPELINE_PREFETCH = int(os.getenv('TOOL_PIPELINE_PREFETCH', 4))
+TOOL_PIPELINE_STATS_SECONDS = float(os.getenv('TOOL_PIPELINE_STATS_SECONDS', 30))
+
+# Progressive requests (utils/progressive.py): inputs longer than this many pixels on their
+# longest side are first processed on a proxy of that size and answered with a "partial" reply
+PROGRESSIVE_PROXY_SIZE = int(os.getenv('PROGRESSIVE_PROXY_SIZE', 1024))
+
+# libjpeg-turbo's jpegtran, for lossless JPEG rotate/crop (utils/jpeg_lossless.py); '' = always re-encode
+JPEGTRAN = os.getenv('JPEGTRAN', 'jpegtran')
+JPEGTRAN_TIMEOUT_SECONDS = float(os.getenv('JPEGTRAN_TIMEOUT_SECONDS', 60))
+
+# Backend of the geometric tools (utils/geometry.py): 'pillow' or 'opencv' (multithreaded),
+# per tool with ROTATE_BACKEND / RESIZE_BACKEND; a message's parameters.backend wins.
+# GEOMETRY_THREADS: OpenCV's thread pool size (0 = OpenCV's default, one per core)
+GEOMETRY_BACKEND_DEFAULT = os.getenv('GEOMETRY_BACKEND', 'pillow')
+GEOMETRY_BACKEND = {
+    'rotate': os.getenv('ROTATE_BACKEND', ''),
+    'resize': os.getenv('RESIZE_BACKEND', ''),
+}
+GEOMETRY_THREADS = int(os.getenv('GEOMETRY_THREADS', 0))
+# Resize jobs with several output sizes reduce by whole factors (box filter) until the
+# image is within this factor of each size, then resample (Pillow's reducing_gap)
+RESIZE_REDUCING_GAP = float(os.getenv('RESIZE_REDUCING_GAP', 3.0))
+
+# Memory (MiB) the jobs of one worker may use at once (utils/admission.py), for a tool
+# container or a whole tool host; 0 = no admission control. Jobs that would not fit
+# even alone are republished to <tool>_large_queue
+TOOL_MEMORY_BUDGET_MB = int(os.getenv('TOOL_MEMORY_BUDGET_MB', 0))
+# 1 = consume <tool>_large_queue instead of <tool>_queue (a high-memory worker)
+TOOL_LARGE_WORKER = int(os.getenv('TOOL_LARGE_WORKER', 0))
+# Decompression-bomb limit: larger images are refused with "image_too_large"
+# (default: the size at which Pillow itself raises DecompressionBombError)
+TOOL_MAX_IMAGE_PIXELS = int(os.getenv('TOOL_MAX_IMAGE_PIXELS', 2 * 89478485))
+
+# Pre-rendered watermark overlays kept by the watermark tool, and an optional TTF font for text marks
+WATERMARK_CACHE_SIZE = int(os.getenv('WATERMARK_CACHE_SIZE', 64))
+WATERMARK_FONT = os.getenv('WATERMARK_FONT', '')
+
+# S3-compatible storage for s3://bucket/key image URIs (utils/s3.py); without an
+# endpoint they are read from and written to S3_LOCAL_ROOT/<bucket>/<key>
+S3_ENDPOINT_URL = os.getenv('S3_ENDPOINT_URL', '')
+S3_ACCESS_KEY = os.getenv('S3_ACCESS_KEY', os.getenv('MINIO_ROOT_USER', ''))
+S3_SECRET_KEY = os.getenv('S3_SECRET_KEY', os.getenv('MINIO_ROOT_PASSWORD', ''))
+S3_REGION = os.getenv('S3_REGION', 'us-east-1')
+S3_LOCAL_ROOT = os.getenv('S3_LOCAL_ROOT', './images/s3')
+# Connections kept by the process' client, largest ranged read, and multipart uploads:
+# outputs over the threshold are sent in chunks by S3_UPLOAD_CONCURRENCY threads
+S3_MAX_POOL_CONNECTIONS = int(os.getenv('S3_MAX_POOL_CONNECTIONS', 16))
+S3_READ_BLOCK_KB = int(os.getenv('S3_READ_BLOCK_KB', 4096))
+S3_MULTIPART_THRESHOLD_MB = int(os.getenv('S3_MULTIPART_THRESHOLD_MB', 16))
+S3_MULTIPART_CHUNK_MB = int(os.getenv('S3_MULTIPART_CHUNK_MB', 8))
+S3_UPLOAD_CONCURRENCY = int(os.getenv('S3_UPLOAD_CONCURRENCY', 4))
+
 # Paths to MobileNet-SSD model files
 MOBILENETSSD_PROTOTXT = os.getenv('MOBILENETSSD_PROTOTXT', './utils/models/MobileNetSSD_deploy.prototxt')
 MOBILENETSSD_CAFFEMODEL = os.getenv('MOBILENETSSD_CAFFEMODEL', './utils/models/MobileNetSSD_deploy.caffemodel')
\ No newline at end of file
@@ -0,0 +1,166 @@
+"""
+Geometric transforms (rotate, resize) with a selectable backend.
+
+'pillow' is Image.rotate / Image.resize, single-threaded. 'opencv' runs the
+same transform through cv2.warpAffine / cv2.resize, which split the rows over
+OpenCV's thread pool (GEOMETRY_THREADS), so large images scale with cores.
+
+The OpenCV path reproduces Pillow's output geometry: rotate() uses Pillow's
+own affine matrix and expanded canvas (shifted from Pillow's pixel-centre
+convention to OpenCV's), with the same nearest/bilinear/bicubic sampling and
+a transparent black fill; like Pillow, alpha is premultiplied whenever
+pixels are interpolated.
+Downscales use INTER_AREA rather than Pillow's antialiased bicubic, so resized
+pixels differ by a few levels (python -m benchmarks.geometry checks both
+backends against each other).
+
+L, LA, RGB and RGBA images go through OpenCV; other modes (P, 1, I, F, ...),
+right-angle rotations and images OpenCV cannot address fall back to Pillow,
+as does everything when cv2 is not installed.
+"""
+
+import math
+
+from PIL import Image
+
+from . import env
+
+PILLOW = 'pillow'
+OPENCV = 'opencv'
+BACKENDS = (PILLOW, OPENCV)
+
+# modes OpenCV handles as 1-4 channels of uint8
+OPENCV_MODES = {'L', 'LA', 'RGB', 'RGBA'}
+# interpolation works on premultiplied alpha, as in Pillow's own resize/transform
+PREMULTIPLIED = {'LA': 'La', 'RGBA': 'RGBa'}
+# cv2.remap/warpAffine address pixels with shorts
+OPENCV_MAX_SIDE = 32767
+
+_cv2 = None
+_np = None
+
+
+def _opencv():
+    """The cv2 module, or None if it is not installed."""
+    global _cv2, _np
+    if _cv2 is None:
+        try:
+            import cv2
+            import numpy
+            _np = numpy
+            if env.GEOMETRY_THREADS > 0:
+                cv2.setNumThreads(env.GEOMETRY_THREADS)
+            _cv2 = cv2
+        except ImportError:
+            print("opencv-python is not installed: geometric transforms use Pillow", flush=True)
+            _cv2 = False
+    return _cv2 or None
+
+
+def backend_for(tool, requested=None):
+    """The backend a job of `tool` uses: the message's own choice, else the tool's setting."""
+    backend = requested or env.GEOMETRY_BACKEND.get(tool) or env.GEOMETRY_BACKEND_DEFAULT
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown geometry backend '{backend}', expected one of {', '.join(BACKENDS)}")
+    return backend
+
+
+def _use_opencv(backend, *sizes):
+    return (backend == OPENCV
+            and all(0 < side <= OPENCV_MAX_SIDE for size in sizes for side in size)
+            and _opencv() is not None)
+
+
+def _from_array(arr, mode):
+    arr = _np.ascontiguousarray(arr)
+    height, width = arr.shape[:2]
+    return Image.frombuffer(mode, (width, height), arr, 'raw', mode, 0, 1)
+
+
+def _convert(img, mode):
+    return img.convert(mode) if mode != img.mode else img
+
+
+def _restore(out, img):
+    # back to the input's mode (from premultiplied alpha) and metadata
+    out = _convert(out, img.mode)
+    out.info = img.info.copy()
+    return out
+
+
+def rotate(img, degrees, expand=True, backend=PILLOW, resample=Image.Resampling.NEAREST):
+    """Image.rotate(degrees, resample, expand), on `backend`."""
+    angle = degrees % 360.0
+    if (img.mode not in OPENCV_MODES or angle % 90 == 0
+            or not _use_opencv(backend, img.size)):
+        # Pillow transposes right angles itself
+        return img.rotate(degrees, resample=resample, expand=expand)
+
+    cv2 = _opencv()
+    size, matrix = rotate_matrix(img.size, angle, expand)
+    if not _use_opencv(backend, size):
+        return img.rotate(degrees, resample=resample, expand=expand)
+
+    a, b, c, d, e, f = matrix
+    # Pillow maps the centre of output pixel (x, y), at (x + .5, y + .5), to
+    # input coordinates whose pixel centres are at +.5 too; OpenCV's are at 0
+    inverse = [[a, b, a * 0.5 + b * 0.5 + c - 0.5],
+               [d, e, d * 0.5 + e * 0.5 + f - 0.5]]
+    interpolation = {
+        Image.Resampling.NEAREST: cv2.INTER_NEAREST,
+        Image.Resampling.BILINEAR: cv2.INTER_LINEAR,
+        Image.Resampling.BICUBIC: cv2.INTER_CUBIC,
+    }[resample]
+    mode = img.mode if resample == Image.Resampling.NEAREST else PREMULTIPLIED.get(img.mode, img.mode)
+    out = cv2.warpAffine(_np.asarray(_convert(img, mode)), _np.array(inverse, dtype=_np.float64), size,
+                         flags=interpolation | cv2.WARP_INVERSE_MAP,
+                         borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+    return _restore(_from_array(out, mode), img)
+
+
+def rotate_matrix(size, angle, expand):
+    """Image.rotate's output size and output -> input affine matrix (about the centre), for `angle` in [0, 360)."""
+    w, h = size
+    center_x, center_y = w / 2, h / 2
+    radians = -math.radians(angle)
+    matrix = [
+        round(math.cos(radians), 15), round(math.sin(radians), 15), 0.0,
+        round(-math.sin(radians), 15), round(math.cos(radians), 15), 0.0,
+    ]
+
+    def transform(x, y):
+        a, b, c, d, e, f = matrix
+        return a * x + b * y + c, d * x + e * y + f
+
+    matrix[2], matrix[5] = transform(-center_x, -center_y)
+    matrix[2] += center_x
+    matrix[5] += center_y
+
+    if expand:
+        xx, yy = zip(*(transform(x, y) for x, y in ((0, 0), (w, 0), (w, h), (0, h))))
+        nw = math.ceil(max(xx)) - math.floor(min(xx))
+        nh = math.ceil(max(yy)) - math.floor(min(yy))
+        matrix[2], matrix[5] = transform(-(nw - w) / 2.0, -(nh - h) / 2.0)
+        w, h = nw, nh
+    return (w, h), matrix
+
+
+def resize(img, size, backend=PILLOW, reducing_gap=None):
+    """
+    Image.resize(size, reducing_gap=reducing_gap), on `backend`: INTER_AREA
+    to shrink, bicubic to enlarge. OpenCV ignores `reducing_gap` (INTER_AREA
+    is already a box reduction).
+    """
+    size = tuple(size)
+    if (img.mode not in OPENCV_MODES or size == img.size
+            or not _use_opencv(backend, img.size, size)):
+        return img.resize(size, reducing_gap=reducing_gap)
+
+    cv2 = _opencv()
+    width, height = size
+    shrink = width <= img.width and height <= img.height
+    interpolation = cv2.INTER_AREA if shrink else cv2.INTER_CUBIC
+
+    mode = PREMULTIPLIED.get(img.mode, img.mode)
+    out = cv2.resize(_np.asarray(_convert(img, mode)), size, interpolation=interpolation)
+    return _restore(_from_array(out, mode), img)
@@ -1,4 +1,43 @@
-from PIL import Image
+import os
+import threading
+import contextlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, GifImagePlugin
+
+from . import env
+from . import s3
+
+# formats whose animations/pages are processed frame by frame; other
+# multi-frame inputs (APNG, MPO, ...) keep the first frame only, as before
+ANIMATED_FORMATS = {'GIF', 'WEBP', 'TIFF'}
+
+# pipelined workers (utils/pipeline.py): the compute thread's pre-decoded inputs and held writes
+_held = threading.local()
+
+
+@contextlib.contextmanager
+def held_io(decoded):
+    """
+    Inside the block, on this thread, get_img() returns the images of `decoded`
+    (path -> image, each once) and store_img() appends (img, path) to the
+    yielded list instead of writing; the caller writes them afterwards
+    (write_img). Blocks nest: the outer one's state is restored on exit.
+    """
+    outer = getattr(_held, 'decoded', None), getattr(_held, 'writes', None)
+    _held.decoded = dict(decoded)
+    _held.writes = writes = []
+    try:
+        yield writes
+    finally:
+        _held.decoded, _held.writes = outer
+
+
+def held_img(img_path):
+    """The image held_io() holds for `img_path` on this thread, left for get_img(), or None."""
+    decoded = getattr(_held, 'decoded', None)
+    return decoded.get(img_path) if decoded else None
 
 class Img_HandlerException(Exception):
     def __init__(self, message, error_code = None):
@@ -10,7 +49,176 @@ class Img_Handler:
         pass
 
     def get_img(self, img_path:str) -> Image:
+        decoded = getattr(_held, 'decoded', None)
+        if decoded and img_path in decoded:
+            return decoded.pop(img_path)
+        # s3://bucket/key: ranged reads, only what the decoder asks for
+        if s3.is_s3_uri(img_path):
+            return Image.open(s3.open_read(img_path))
         return Image.open(img_path)
     
     def store_img(self, img: Image, img_path:str) -> None:
+        writes = getattr(_held, 'writes', None)
+        if writes is not None:
+            writes.append((img, img_path))
+            return
+        self.write_img(img, img_path)
+
+    def write_img(self, img: Image, img_path:str) -> None:
+        """store_img() that writes right away, also inside held_io()."""
+        if s3.is_s3_uri(img_path):
+            with s3.open_write(img_path) as fp:
+                img.save(fp, format=_format(img_path))
+            return
         img.save(img_path)
+
+    def is_animated(self, img: Image) -> bool:
+        return img.format in ANIMATED_FORMATS and getattr(img, 'n_frames', 1) > 1
+
+    def apply(self, img_path:str, store_img_path:str, transform) -> None:
+        """
+        Load `img_path`, run `transform(img) -> img` and store the result.
+
+        Animated GIF/WebP and multi-page TIFF inputs are transformed frame by
+        frame: each frame is decoded, transformed and handed to an incremental
+        writer before the next one is read, so memory stays at about one frame
+        whatever the length of the animation. Durations, loop count and GIF
+        disposal methods are kept.
+        """
+        img = self.get_img(img_path)
+        output_format = _format(store_img_path)
+        if not self.is_animated(img) or output_format not in ANIMATED_FORMATS:
+            self.store_img(transform(img), store_img_path)
+            return
+
+        frames = self.iter_frames(img)
+        if env.TOOL_FRAME_WORKERS > 1 and img.n_frames >= env.TOOL_FRAME_PARALLEL_MIN:
+            frames = _map_parallel(transform, frames, env.TOOL_FRAME_WORKERS)
+        else:
+            frames = ((transform(frame), duration, disposal) for frame, duration, disposal in frames)
+        self.store_frames(frames, img.n_frames, store_img_path, output_format, img.info)
+
+    def iter_frames(self, img: Image):
+        """Yield (frame, duration ms, disposal) for each frame, decoding one at a time."""
+        for index in range(img.n_frames):
+            img.seek(index)
+            # copy(): the next seek reuses the decoder's buffer
+            yield img.copy(), img.info.get('duration', 0), getattr(img, 'disposal_method', 0)
+
+    def store_frames(self, frames, n_frames:int, img_path:str, img_format:str, info:dict) -> None:
+        with self._open_output(img_path) as fp:
+            if img_format == 'GIF':
+                _write_gif(frames, fp, info)
+            else:
+                _save_sequence(frames, n_frames, fp, img_format, info)
+
+    def _open_output(self, img_path:str):
+        if s3.is_s3_uri(img_path):
+            return s3.open_write(img_path)
+        # w+b: the TIFF writer reads back what it wrote
+        return open(img_path, 'w+b')
+
+
+def _format(img_path):
+    return Image.registered_extensions().get(os.path.splitext(img_path)[1].lower())
+
+
+def _save_sequence(frames, n_frames, fp, img_format, info):
+
+    # Pillow's WebP and TIFF writers seek through a multi-frame image,
+    # so a lazy one keeps them at one frame too
+    sequence = _FrameSequence(frames, n_frames)
+    params = {'save_all': True, 'format': img_format}
+    if img_format == 'WEBP':
+        # filled in as the frames are read, before the writer looks up each duration
+        params['duration'] = sequence.durations
+        params['loop'] = info.get('loop', 0)
+        if isinstance(info.get('background'), tuple) and len(info['background']) == 4:
+            params['background'] = info['background']
+    sequence.save(fp, **params)
+
+
+def _map_parallel(transform, frames, workers):
+    # frames are transformed on a thread pool (Pillow releases the GIL in its
+    # image operations) and yielded in order; at most 2 * workers are in flight
+    with ThreadPoolExecutor(workers) as pool:
+        pending = deque()
+        for frame, duration, disposal in frames:
+            pending.append((pool.submit(transform, frame), duration, disposal))
+            if len(pending) >= 2 * workers:
+                future, duration, disposal = pending.popleft()
+                yield future.result(), duration, disposal
+        while pending:
+            future, duration, disposal = pending.popleft()
+            yield future.result(), duration, disposal
+
+
+class _FrameSequence(Image.Image):
+    """A multi-frame image whose frames are pulled from an iterator on seek()."""
+
+    def __init__(self, frames, n_frames):
+        super().__init__()
+        self.n_frames = n_frames
+        self.durations = []
+        self._frames = iter(frames)
+        self._index = -1
+        self.seek(0)
+
+    def seek(self, frame):
+        if frame <= self._index:
+            # the writers seek back to where they started once they are done;
+            # the frames are gone by then and nothing reads them again
+            return
+        if frame != self._index + 1:
+            raise ValueError('frames can only be read in order')
+        try:
+            img, duration, _ = next(self._frames)
+        except StopIteration:
+            raise EOFError('no more frames') from None
+        img.load()
+        self.im = img.im
+        self._mode = img.mode
+        self._size = img.size
+        self.palette = img.palette
+        self.info = dict(img.info, duration=duration)
+        self.durations.append(duration)
+        self._index = frame
+
+    def tell(self):
+        return self._index
+
+
+def _gif_frame(frame):
+    """The frame in a GIF mode, with the palette index of its transparent color (or None)."""
+    if frame.mode not in ('1', 'L', 'P'):
+        if Image.getmodebase(frame.mode) != 'RGB':
+            return frame.convert('L'), None
+        frame = frame.convert('P', palette=Image.Palette.ADAPTIVE)
+        if frame.palette.mode == 'RGBA':
+            for rgba, index in frame.palette.colors.items():
+                if rgba[3] == 0:
+                    return frame, index
+        return frame, None
+    transparency = frame.info.get('transparency')
+    return frame, transparency if isinstance(transparency, int) else None
+
+
+def _write_gif(frames, fp, info):
+    # Pillow's GIF writer collects every frame before writing the file; this
+    # one writes each frame as it comes, with its own palette after the first
+    for index, (frame, duration, disposal) in enumerate(frames):
+        frame, transparency = _gif_frame(frame)
+        params = {'duration': duration, 'disposal': disposal}
+        if transparency is not None:
+            params['transparency'] = transparency
+
+        if index == 0:
+            header_info = dict(params)
+            if 'loop' in info:
+                header_info['loop'] = info['loop']
+            header, _ = GifImagePlugin.getheader(frame, None, header_info)
+            fp.write(b''.join(header))
+        else:
+            params['include_color_table'] = True
+        fp.write(b''.join(GifImagePlugin.getdata(frame, (0, 0), **params)))
+    fp.write(b';')
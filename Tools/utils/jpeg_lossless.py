@@ -0,0 +1,129 @@
+"""
+Lossless JPEG rotate and crop, in the DCT domain.
+
+A JPEG -> JPEG rotation by a right angle, or a crop whose top-left corner
+falls on an MCU boundary, only moves and mirrors the stored DCT blocks. It is
+done by libjpeg-turbo's jpegtran without decoding or re-encoding a pixel: no
+generation loss, and the cost of about a file copy.
+
+rotate() and crop() return False whenever that does not apply (other formats,
+arbitrary angles, unaligned or out-of-bounds crops, a partial MCU that would
+end up on the top/left edge, jpegtran not installed); the caller then takes
+its usual decode -> transform -> encode path.
+"""
+
+import shutil
+import subprocess
+
+from . import env
+from . import s3
+from .img_handler import Img_Handler, _format, held_img
+
+DCTSIZE = 8
+# PIL angles are counter-clockwise, jpegtran's clockwise
+ROTATIONS = {90: '270', 180: '180', 270: '90'}
+
+_jpegtran = None
+
+
+def jpegtran():
+    """Path of the jpegtran binary, or None."""
+    global _jpegtran
+    if _jpegtran is None:
+        _jpegtran = (env.JPEGTRAN and shutil.which(env.JPEGTRAN)) or ''
+    return _jpegtran or None
+
+
+def _jpeg_header(img_path, store_img_path):
+    # None unless both ends are JPEG and jpegtran is there
+    if not jpegtran() or _format(store_img_path) != 'JPEG':
+        return None
+    # the pipeline's decoded input: read in place, the usual path still needs it
+    img = held_img(img_path)
+    if img is not None:
+        return (img.size, mcu_size(img)) if img.format == 'JPEG' else None
+    try:
+        with Img_Handler().get_img(img_path) as img:
+            if img.format != 'JPEG':
+                return None
+            return img.size, mcu_size(img)
+    except (OSError, ValueError):
+        # let the usual path report it
+        return None
+
+
+def mcu_size(img):
+    """(width, height) in pixels of the JPEG's MCU, from its sampling factors."""
+    # JpegImageFile.layer: (component id, h, v, quantization table) per component
+    layer = getattr(img, 'layer', None) or []
+    if len(layer) <= 1:
+        return DCTSIZE, DCTSIZE
+    return DCTSIZE * max(c[1] for c in layer), DCTSIZE * max(c[2] for c in layer)
+
+
+def rotate(img_path, store_img_path, degrees):
+    """Rotate by `degrees` counter-clockwise (expanding), if it can be done losslessly."""
+    if degrees % 90:
+        return False
+    angle = int(degrees) % 360
+    header = _jpeg_header(img_path, store_img_path)
+    if header is None:
+        return False
+
+    (width, height), (mcu_w, mcu_h) = header
+    if angle == 0:
+        return _run([], img_path, store_img_path)
+
+    rotation = ROTATIONS[angle]
+    # a partial MCU on the right/bottom edge would move to the left/top one
+    if rotation in ('90', '180') and height % mcu_h:
+        return False
+    if rotation in ('270', '180') and width % mcu_w:
+        return False
+    # -perfect: jpegtran refuses (and we fall back) rather than trimming an edge
+    return _run(['-rotate', rotation, '-perfect'], img_path, store_img_path)
+
+
+def crop(img_path, store_img_path, box):
+    """Crop to `box` (left, top, right, bottom) if its top-left corner is MCU-aligned."""
+    header = _jpeg_header(img_path, store_img_path)
+    if header is None:
+        return False
+
+    (width, height), (mcu_w, mcu_h) = header
+    # rounded like Image.crop
+    left, top, right, bottom = (int(round(v)) for v in box)
+    if not (0 <= left < right <= width and 0 <= top < bottom <= height):
+        # PIL fills what lies outside the image
+        return False
+    if left % mcu_w or top % mcu_h:
+        return False
+    # the right/bottom edges can cut through an MCU: jpegtran keeps the partial blocks
+    return _run(['-crop', f'{right - left}x{bottom - top}+{left}+{top}'], img_path, store_img_path)
+
+
+def _read(img_path):
+    if s3.is_s3_uri(img_path):
+        with s3.open_read(img_path) as fp:
+            return fp.read()
+    with open(img_path, 'rb') as fp:
+        return fp.read()
+
+
+def _write(img_path, data):
+    if s3.is_s3_uri(img_path):
+        with s3.open_write(img_path) as fp:
+            fp.write(data)
+        return
+    with open(img_path, 'wb') as fp:
+        fp.write(data)
+
+
+def _run(args, img_path, store_img_path):
+    # -copy none: no EXIF/ICC, like the images PIL writes
+    result = subprocess.run([jpegtran(), '-copy', 'none', *args], input=_read(img_path),
+                            capture_output=True, timeout=env.JPEGTRAN_TIMEOUT_SECONDS)
+    if result.returncode != 0 or not result.stdout:
+        return False
+    _write(store_img_path, result.stdout)
+    return True
@@ -0,0 +1,314 @@
+"""
+Typed tool request messages.
+
+A request is decoded straight into a ToolRequest whose `parameters` struct
+is the tool's own, so a malformed message is rejected (InvalidMessage) before
+the tool touches any image. The wire format follows the AMQP content_type:
+MessagePack for application/msgpack, JSON otherwise, which keeps producers
+that send plain JSON without a content type (the projects service) working.
+
+A batch carries `items` instead of `parameters`; ToolMSG runs them one by one
+through the tool's callback and answers each item, or all of them in one
+"batch" reply when the batch asks for reply="summary".
+"""
+
+import datetime
+from typing import Any, Generic, Optional, TypeVar
+
+import msgspec
+
+from .geometry import BACKENDS as GEOMETRY_BACKENDS
+
+JSON = 'application/json'
+MSGPACK = 'application/msgpack'
+MSGPACK_TYPES = {MSGPACK, 'application/x-msgpack'}
+
+
+class InvalidMessage(ValueError):
+    """The body could not be decoded into the tool's request type."""
+
+
+class Cancel(msgspec.Struct):
+    scope: str
+    token: float
+
+
+class Parameters(msgspec.Struct):
+    inputImageURI: str
+    outputImageURI: str
+
+
+class BinarizationParameters(Parameters):
+    threshold: float
+
+
+class BorderParameters(Parameters):
+    borderWidth: int
+    r: int
+    g: int
+    b: int
+
+
+class BrightnessParameters(Parameters):
+    brightness: float
+
+
+class ContrastParameters(Parameters):
+    contrastFactor: float
+
+
+class CutParameters(Parameters):
+    left: float
+    top: float
+    right: float
+    bottom: float
+
+
+# outputs of one resize job besides the main one, per list
+MAX_RESIZE_VARIANTS = 16
+
+
+def _check_backend(backend):
+    if backend is not None and backend not in GEOMETRY_BACKENDS:
+        raise ValueError(f"Expected `$.parameters.backend` to be one of {', '.join(GEOMETRY_BACKENDS)}")
+
+
+class ResizeVariant(msgspec.Struct):
+    width: int
+    height: int
+    # None = <outputImageURI root>.<width>x<height><ext>
+    outputImageURI: Optional[str] = None
+
+
+class ResizePyramid(msgspec.Struct):
+    # outputs below (width, height), each `factor` times the size of the one above
+    levels: int
+    factor: float = 0.5
+
+
+class ResizeParameters(Parameters):
+    width: int
+    height: int
+    # utils/geometry.py backend for this job; None = the tool's setting
+    backend: Optional[str] = None
+    # further outputs from the same decode, answered in output.variants
+    sizes: Optional[list[ResizeVariant]] = None
+    pyramid: Optional[ResizePyramid] = None
+
+    def __post_init__(self):
+        _check_backend(self.backend)
+        for size in (self, *(self.sizes or ())):
+            if size.width < 1 or size.height < 1:
+                raise ValueError("Expected `$.parameters` sizes of at least 1x1 pixels")
+        if self.pyramid is not None:
+            if not 1 <= self.pyramid.levels <= MAX_RESIZE_VARIANTS:
+                raise ValueError(f"Expected `$.parameters.pyramid.levels` between 1 and {MAX_RESIZE_VARIANTS}")
+            if not 0 < self.pyramid.factor < 1:
+                raise ValueError("Expected `$.parameters.pyramid.factor` in (0, 1)")
+        if len(self.sizes or ()) > MAX_RESIZE_VARIANTS:
+            raise ValueError(f"Expected at most {MAX_RESIZE_VARIANTS} `$.parameters.sizes`")
+
+
+class RotateParameters(Parameters):
+    degrees: float
+    backend: Optional[str] = None
+
+    def __post_init__(self):
+        _check_backend(self.backend)
+
+
+class SaturationParameters(Parameters):
+    saturationFactor: float
+
+
+WATERMARK_POSITIONS = (
+    'top-left', 'top', 'top-right',
+    'left', 'center', 'right',
+    'bottom-left', 'bottom', 'bottom-right',
+)
+
+
+class WatermarkParameters(Parameters):
+    # the toolbar sends no parameters: a small text mark in the corner
+    type: str = 'text'
+    text: str = 'PictuRAS'
+    imageURI: Optional[str] = None
+    color: str = '#FFFFFF'
+    position: str = 'bottom-right'
+    opacity: float = 0.5
+    scale: float = 0.2
+    tile: bool = False
+
+    def __post_init__(self):
+        if self.type not in ('text', 'image'):
+            raise ValueError("Expected `$.parameters.type` to be 'text' or 'image'")
+        if self.type == 'image' and not self.imageURI:
+            raise ValueError("Expected `str` for `$.parameters.imageURI`")
+        if self.position not in WATERMARK_POSITIONS:
+            raise ValueError(f"Expected `$.parameters.position` to be one of {', '.join(WATERMARK_POSITIONS)}")
+        if not 0 < self.opacity <= 1 or not 0 < self.scale <= 1:
+            raise ValueError("Expected `$.parameters.opacity` and `$.parameters.scale` in (0, 1]")
+
+
+class ObjectParameters(Parameters):
+    confidenceThreshold: float = 0.20
+
+
+class PeopleParameters(Parameters):
+    confidenceThreshold: float = 0.4
+
+
+P = TypeVar('P')
+
+# batch "reply" modes: a reply per item as it finishes, or one reply with all of them
+REPLY_ITEMS = 'items'
+REPLY_SUMMARY = 'summary'
+
+
+def _check_uris(parameters, path):
+    # free-form parameters (expand_ai) still need the image URIs
+    if isinstance(parameters, dict):
+        for key in ('inputImageURI', 'outputImageURI'):
+            if not isinstance(parameters.get(key), str):
+                raise ValueError(f"Expected `str` for `{path}.{key}`")
+
+
+# tools whose consecutive steps are rendered as one job (utils/compose.py)
+COMPOSABLE = ('rotate', 'resize', 'cut', 'border')
+
+
+class ComposeStep(msgspec.Struct):
+    procedure: str
+    # decoded into the tool's parameters type (without image URIs) by ToolRequest
+    parameters: dict[str, Any]
+
+
+def _compose_parameters(step, path):
+    if step.procedure not in COMPOSABLE:
+        raise ValueError(f"Expected `{path}.procedure` to be one of {', '.join(COMPOSABLE)}")
+    if not isinstance(step.parameters, dict):
+        # already decoded (a batch item sharing the batch's steps)
+        return step.parameters
+    try:
+        params = msgspec.convert({'inputImageURI': '', 'outputImageURI': '', **step.parameters},
+                                 PARAMETERS[step.procedure], strict=False)
+    except msgspec.ValidationError as e:
+        raise ValueError(f"Invalid `{path}.parameters`: {e}") from None
+    _check_composed(params, path)
+    return params
+
+
+def _check_composed(params, path):
+    if isinstance(params, ResizeParameters) and (params.sizes or params.pyramid):
+        raise ValueError(f"Expected no `sizes` or `pyramid` in the composed resize `{path}`")
+
+
+class BatchItem(msgspec.Struct, Generic[P]):
+    messageId: str
+    parameters: P
+
+
+class ToolRequest(msgspec.Struct, Generic[P]):
+    """
+    One job (`parameters`) or a batch of them (`items`, each with its own
+    messageId, answered as if it had been sent on its own).
+    """
+    messageId: str
+    timestamp: datetime.datetime
+    procedure: str
+    parameters: Optional[P] = None
+    items: Optional[list[BatchItem[P]]] = None
+    reply: str = REPLY_ITEMS
+    cancel: Optional[Cancel] = None
+    deadline: Optional[datetime.datetime] = None
+    # slow tools answer a downscaled proxy first, with a "partial" reply (utils/progressive.py)
+    progressive: bool = False
+    # geometric steps after this one, rendered with it in a single resample (utils/compose.py)
+    compose: Optional[list[ComposeStep]] = None
+
+    def __post_init__(self):
+        # the projects service sends UTC; a timestamp without offset is taken as UTC
+        for field in ('timestamp', 'deadline'):
+            value = getattr(self, field)
+            if value is not None and value.tzinfo is None:
+                setattr(self, field, value.replace(tzinfo=datetime.timezone.utc))
+
+        if (self.parameters is None) == (self.items is None):
+            raise ValueError("Expected exactly one of `$.parameters` and `$.items`")
+        if self.reply not in (REPLY_ITEMS, REPLY_SUMMARY):
+            raise ValueError(f"Expected `$.reply` to be '{REPLY_ITEMS}' or '{REPLY_SUMMARY}'")
+
+        _check_uris(self.parameters, '$.parameters')
+        for i, item in enumerate(self.items or ()):
+            _check_uris(item.parameters, f'$.items[{i}].parameters')
+
+        if self.compose:
+            if self.procedure not in COMPOSABLE:
+                raise ValueError(f"Expected `$.procedure` to be one of {', '.join(COMPOSABLE)} with `$.compose`")
+            for params in ([self.parameters] if self.parameters is not None else
+                           [item.parameters for item in self.items]):
+                _check_composed(params, '$.parameters')
+            for i, step in enumerate(self.compose):
+                step.parameters = _compose_parameters(step, f'$.compose[{i}]')
+
+    @property
+    def is_batch(self):
+        return self.items is not None
+
+    def expand(self):
+        """The batch's items as single requests sharing its timestamp, cancel token, deadline, progressive flag and composed steps."""
+        return [
+            msgspec.structs.replace(self, messageId=item.messageId, parameters=item.parameters, items=None,
+                                    reply=REPLY_ITEMS)
+            for item in self.items
+        ]
+
+
+# tool -> parameters type; tools not listed only carry the image URIs
+PARAMETERS = {
+    'binarization': BinarizationParameters,
+    'border': BorderParameters,
+    'brightness': BrightnessParameters,
+    'contrast': ContrastParameters,
+    'cut': CutParameters,
+    'resize': ResizeParameters,
+    'rotate': RotateParameters,
+    'saturation': SaturationParameters,
+    'watermark': WatermarkParameters,
+    'obj_ai': ObjectParameters,
+    'people_ai': PeopleParameters,
+    # the outpaint helpers read many optional, clamped keys
+    'expand_ai': dict[str, Any],
+}
+
+
+class RequestDecoder:
+    def __init__(self, tool_name):
+        msg_type = ToolRequest[PARAMETERS.get(tool_name, Parameters)]
+        # strict=False: numbers sent as strings ("1.5") are coerced instead of rejected
+        self._json = msgspec.json.Decoder(msg_type, strict=False)
+        self._msgpack = msgspec.msgpack.Decoder(msg_type, strict=False)
+
+    def decode(self, body, content_type=None):
+        decoder = self._msgpack if content_type in MSGPACK_TYPES else self._json
+        try:
+            return decoder.decode(body)
+        except msgspec.DecodeError as e:
+            raise InvalidMessage(str(e)) from e
+
+
+def decode_raw(body, content_type=None):
+    """Untyped decode (dict/list/...), None if the body is not valid at all."""
+    try:
+        if content_type in MSGPACK_TYPES:
+            return msgspec.msgpack.decode(body)
+        return msgspec.json.decode(body)
+    except msgspec.DecodeError:
+        return None
+
+
+def encode(msg, content_type=JSON):
+    """Encode a struct or plain dict for the given content type."""
+    if content_type in MSGPACK_TYPES:
+        return msgspec.msgpack.encode(msg)
+    return msgspec.json.encode(msg)
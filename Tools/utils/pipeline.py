@@ -0,0 +1,154 @@
+"""
+Staged job pipeline for a tool worker (TOOL_PIPELINE=1).
+
+Three threads joined by bounded queues overlap consecutive jobs: while job N
+runs the tool's callback, job N+1's input is read and decoded and job N-1's
+output is encoded, written and answered.
+
+    connection thread -> decode -> compute (callback) -> write -> connection thread
+
+The callback runs unchanged. Inside the compute stage Img_Handler.get_img
+returns the image decoded ahead of time, and Img_Handler.store_img and
+ToolMSG.send_msg are held: the write stage stores the images, and only then
+are the replies published and the message acked, on the connection thread
+(pika is not thread-safe). Streamed animations (Img_Handler.apply) are still
+written by the compute stage.
+
+Each stage's busy fraction is logged as `tool_pipeline_utilization` every
+TOOL_PIPELINE_STATS_SECONDS; the busiest stage is the one to scale.
+"""
+
+import json
+import time
+import queue
+import threading
+import functools
+
+from . import env
+from .img_handler import Img_Handler, held_io
+from . import tool_msg as tool_msg_module
+
+STAGES = ('decode', 'compute', 'write')
+
+
+class _Stage:
+    def __init__(self):
+        self.busy_s = 0.0
+        self.jobs = 0
+
+    def run(self, fn, *args):
+        started = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            self.busy_s += time.perf_counter() - started
+            self.jobs += 1
+
+
+class Pipeline:
+    def __init__(self, tool_msg, callback):
+        self._tool_msg = tool_msg
+        self._callback = callback
+        self._img_handler = Img_Handler()
+
+        # unbounded only in name: the prefetch count bounds what the broker delivers
+        self._received = queue.Queue()
+        # one job waiting between stages, so each stage is at most one job ahead
+        self._decoded = queue.Queue(maxsize=1)
+        self._computed = queue.Queue(maxsize=1)
+
+        self._stages = {name: _Stage() for name in STAGES}
+        self._stats_since = time.perf_counter()
+
+        for name, target in (('decode', self._decode_loop), ('compute', self._compute_loop),
+                             ('write', self._write_loop)):
+            threading.Thread(target=target, name=f'pipeline-{name}', daemon=True).start()
+
+    def submit(self, ch, method, properties, info):
+        """Called on the connection thread in place of the tool's callback; the pipeline acks the message."""
+        self._received.put((ch, method, properties, info))
+
+    def utilization(self):
+        """Busy fraction per stage since the last report."""
+        elapsed = max(time.perf_counter() - self._stats_since, 1e-9)
+        return {name: round(stage.busy_s / elapsed, 3) for name, stage in self._stages.items()}
+
+    # ------------------------------------------------------------ stages
+
+    def _decode(self, info):
+        params = info.parameters
+        img_path = params.get('inputImageURI') if isinstance(params, dict) else params.inputImageURI
+        try:
+            img = self._img_handler.get_img(img_path)
+            img.load()
+        except Exception:
+            # the callback reads it again and reports the error as usual
+            return img_path, None
+        return img_path, img
+
+    def _decode_loop(self):
+        while True:
+            job = self._received.get()
+            img_path, img = self._stages['decode'].run(self._decode, job[3])
+            self._decoded.put((job, img_path, img))
+
+    def _compute(self, job, img_path, img):
+        ch, method, properties, info = job
+        with held_io({img_path: img} if img is not None else {}) as writes, tool_msg_module.held_replies() as replies:
+            try:
+                if self._tool_msg.superseded(info):
+                    # superseded while it waited in the pipeline
+                    self._tool_msg.send_cancelled(info)
+                else:
+                    self._callback(ch, method, properties, info)
+            except Exception as e:
+                return writes, replies, e
+        return writes, replies, None
+
+    def _compute_loop(self):
+        while True:
+            job, img_path, img = self._decoded.get()
+            writes, replies, error = self._stages['compute'].run(self._compute, job, img_path, img)
+            # drop the decoded input before waiting on the write stage
+            del img
+            self._computed.put((job, writes, replies, error))
+
+    def _write(self, writes):
+        for img, img_path in writes:
+            self._img_handler.write_img(img, img_path)
+
+    def _write_loop(self):
+        while True:
+            job, writes, replies, error = self._computed.get()
+            if error is None:
+                try:
+                    self._stages['write'].run(self._write, writes)
+                except Exception as e:
+                    error = e
+            self._tool_msg.run_threadsafe(functools.partial(self._finish, job, replies, error))
+            self._log_stats()
+
+    def _finish(self, job, replies, error):
+        ch, method, properties, info = job
+        if error is None:
+            for args in replies:
+                self._tool_msg.send_msg(*args)
+        else:
+            # the output was not written: whatever the callback answered, it failed
+            self._tool_msg.send_failed(info, error)
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+
+    def _log_stats(self):
+        if time.perf_counter() - self._stats_since < env.TOOL_PIPELINE_STATS_SECONDS:
+            return
+        print(json.dumps({
+            'metric': 'tool_pipeline_utilization',
+            'microservice': self._tool_msg._microservice_name,
+            'queue': self._tool_msg.queue,
+            'jobs': self._stages['write'].jobs,
+            **self.utilization(),
+        }), flush=True)
+        for stage in self._stages.values():
+            stage.busy_s = 0.0
+            stage.jobs = 0
+        self._stats_since = time.perf_counter()
@@ -0,0 +1,134 @@
+"""
+Pre-fork serving for the model tools (cut_ai, obj_ai, people_ai).
+
+The parent builds the tool (loading the weights), runs one warm-up inference,
+freezes the GC and forks TOOL_WORKERS consumers. Tensor storage is plain
+heap memory that nothing writes to after loading, and gc.freeze() keeps the
+collector from touching the Python objects around it, so the weight pages
+stay shared copy-on-write: a replica costs a fork, not a model load.
+
+The parent never consumes; it only restarts workers that die.
+"""
+
+import gc
+import os
+import sys
+import json
+import time
+import signal
+
+from . import env
+
+# a worker that dies sooner than this is restarted with a growing delay
+MIN_UPTIME_SECONDS = 10
+MAX_RESTART_DELAY_SECONDS = 30
+
+
+def _set_torch_threads(threads):
+    # only when the tool already imported torch; other tools don't need it
+    torch = sys.modules.get('torch')
+    if torch is not None:
+        torch.set_num_threads(threads)
+
+
+def _log(metric, **fields):
+    print(json.dumps({'metric': metric, **fields}), flush=True)
+
+
+def serve(tool, args, warmup=None, workers=None):
+    """
+    Run `tool.exec(args)` in `workers` forked processes (default TOOL_WORKERS),
+    or in this process when that is 1.
+    """
+    workers = workers or env.TOOL_WORKERS
+
+    if workers <= 1:
+        if warmup is not None:
+            warmup()
+        tool.exec(args)
+        return
+
+    # a single thread in the parent: an OpenMP pool started before fork()
+    # leaves the children deadlocked on its first parallel region
+    _set_torch_threads(1)
+    if warmup is not None:
+        warmup()
+    threads = env.TOOL_WORKER_THREADS or max(1, (os.cpu_count() or 1) // workers)
+
+    # the children open their own connections
+    tool._tool_msg.close()
+    gc.collect()
+    gc.freeze()
+
+    _Supervisor(tool, args, workers, threads).run()
+
+
+class _Supervisor:
+    def __init__(self, tool, args, workers, threads):
+        self._tool = tool
+        self._args = args
+        self._workers = workers
+        self._threads = threads
+        self._children = {}  # pid -> (slot, started)
+        self._restart_delay = {slot: 1 for slot in range(workers)}
+        self._stopping = False
+
+    def _spawn(self, slot):
+        started = time.monotonic()
+        pid = os.fork()
+        if pid == 0:
+            self._child(slot)
+        self._children[pid] = (slot, started)
+
+    def _child(self, slot):
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        code = 0
+        try:
+            _set_torch_threads(self._threads)
+            self._tool._tool_msg.reconnect()
+            _log('prefork_worker_started', pid=os.getpid(), slot=slot, threads=self._threads)
+            self._tool.exec(self._args)
+        except BaseException as e:
+            print(f"worker {slot} failed: {e!r}", flush=True)
+            code = 1
+        finally:
+            sys.stdout.flush()
+            # never return into the parent's code
+            os._exit(code)
+
+    def _stop(self, signum, frame):
+        self._stopping = True
+        for pid in self._children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+
+        for slot in range(self._workers):
+            self._spawn(slot)
+
+        while self._children:
+            pid, status = os.wait()
+            if pid not in self._children:
+                continue
+            slot, started = self._children.pop(pid)
+            if self._stopping:
+                continue
+
+            uptime = time.monotonic() - started
+            _log('prefork_worker_exit', pid=pid, slot=slot, status=os.waitstatus_to_exitcode(status),
+                 uptime_s=round(uptime, 1))
+
+            if uptime < MIN_UPTIME_SECONDS:
+                delay = self._restart_delay[slot]
+                self._restart_delay[slot] = min(delay * 2, MAX_RESTART_DELAY_SECONDS)
+                time.sleep(delay)
+            else:
+                self._restart_delay[slot] = 1
+            if not self._stopping:
+                self._spawn(slot)
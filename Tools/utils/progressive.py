@@ -0,0 +1,74 @@
+"""
+Progressive results for slow tools (upgrade_ai, bg_remove_ai, cut_ai, expand_ai).
+
+A request with "progressive": true whose input is longer than
+PROGRESSIVE_PROXY_SIZE pixels on its longest side is processed twice: first on
+a downscaled proxy, whose output is written next to the final one
+(<output>.partial.<ext>) and sent at once as a "partial" reply, then at full
+resolution, answered as usual under the same correlation id. The user sees
+the proxy's result after the proxy's processing time instead of the full one.
+
+The tool's own processing function runs unchanged on the proxy: inside
+held_io() its get_img() of the input returns the proxy, and its store_img() of
+the output is redirected to the partial URI.
+"""
+
+import os
+import datetime
+
+from . import env
+from .img_handler import Img_Handler, held_io, held_img
+from .tool_msg import JobCancelled
+
+
+def partial_uri(img_uri):
+    root, ext = os.path.splitext(img_uri)
+    return f'{root}.partial{ext}'
+
+
+def proxy_scale(img):
+    """Scale of the proxy for `img`, or None if the image is already small enough."""
+    scale = env.PROGRESSIVE_PROXY_SIZE / max(img.size)
+    return scale if scale < 1 else None
+
+
+def send_proxy_result(tool_msg, info, resp_msg_id, img_path, store_img_path, process):
+    """
+    For a progressive request, run `process(img_path, store_img_path, scale)` on
+    a proxy of the input and send its output as a "partial" reply. `scale` is
+    the proxy's size relative to the input, for parameters given in pixels.
+
+    Does nothing for other requests and small inputs. A failed proxy pass is
+    only logged: the full-resolution pass still answers the job.
+    """
+    if not info.progressive:
+        return
+
+    img_handler = Img_Handler()
+    # the pipeline's decoded input stays held for the full-resolution pass
+    held = held_img(img_path)
+    try:
+        img = held if held is not None else img_handler.get_img(img_path)
+        scale = proxy_scale(img)
+        if scale is None:
+            return
+        if held is not None:
+            img = held.copy()
+        # thumbnail() lets JPEG decode at a reduced size (draft mode)
+        img.thumbnail((round(img.width * scale), round(img.height * scale)), reducing_gap=2.0)
+
+        partial_img_uri = partial_uri(store_img_path)
+        with held_io({img_path: img}) as writes:
+            process(img_path, partial_img_uri, scale)
+        if not writes:
+            return
+        for out, out_path in writes:
+            img_handler.write_img(out, out_path)
+    except JobCancelled:
+        raise
+    except Exception as e:
+        print(f"[{tool_msg.queue}] {info.messageId} proxy pass failed: {e}", flush=True)
+        return
+
+    processing_time = (datetime.datetime.now(datetime.timezone.utc) - info.timestamp).total_seconds() * 1000
+    tool_msg.send_partial(info, f'partial-{resp_msg_id}', partial_img_uri, processing_time)
@@ -8,36 +8,94 @@ def callback(ch, method, properties, body):
 """
 
 class Rabbit_MQ:
-    def __init__(self, host, port, username, password):
+    def __init__(self, host, port, username, password, max_priority=None):
         self._host = host
         self._port = port
         self._credentials = pika.PlainCredentials(username, password)
         self._connection = pika.BlockingConnection(pika.ConnectionParameters(self._host, self._port, '/', self._credentials),)
         self._channel = self._connection.channel()
         self._queue = ''
-        
+        # must match the queue's arguments in rabbitMQ/definitions.json,
+        # RabbitMQ refuses a redeclare with different x-max-priority
+        self._queue_arguments = {"x-max-priority": max_priority} if max_priority else None
+
         self._channel.exchange_declare(
             exchange="picturas",
             exchange_type=ExchangeType.direct,
             durable=True,
         )
 
-    def send_rabbit_msg(self, msg, queue):
-        self._channel.queue_declare(queue=self._queue, durable=True)
+    def send_rabbit_msg(self, msg, queue, priority=None, content_type=None):
+        # an empty name would make the broker create a new server-named queue
+        if self._queue:
+            self._channel.queue_declare(queue=self._queue, durable=True, arguments=self._queue_arguments)
 
-        self._channel.basic_publish(exchange="picturas", routing_key=queue, body=msg)
+        properties = None
+        if priority is not None or content_type is not None:
+            properties = pika.BasicProperties(priority=priority, content_type=content_type)
+        self._channel.basic_publish(exchange="picturas", routing_key=queue, body=msg, properties=properties)
 
     
-    def read_rabbit_msg(self, queue, callback):
+    def read_rabbit_msg(self, queue, callback, auto_ack=True, prefetch_count=None):
         if self._queue == "":
             self._queue = queue
 
-        self._channel.queue_declare(queue=self._queue, durable=True)
-        
+        self._channel.queue_declare(queue=self._queue, durable=True, arguments=self._queue_arguments)
+
+        # With manual acks, prefetch bounds how many unacked messages a worker holds
+        if prefetch_count is not None:
+            self._channel.basic_qos(prefetch_count=prefetch_count)
+
         self._channel.basic_consume(
             queue=self._queue,
             on_message_callback=callback,
+            auto_ack=auto_ack,
+        )
+
+        self._channel.start_consuming()
+
+    def declare_queue(self, queue):
+        self._channel.queue_declare(queue=queue, durable=True, arguments=self._queue_arguments)
+        # queues not in rabbitMQ/definitions.json (the large queues) still need their binding
+        self._channel.queue_bind(exchange="picturas", queue=queue, routing_key=queue)
+
+    def queue_depth(self, queue):
+        # passive: only reads the count, never creates the queue or re-checks its arguments
+        return self._channel.queue_declare(queue=queue, passive=True).method.message_count
+
+    def get_rabbit_msg(self, queue):
+        """Pull one message as (method, properties, body), or None; ack it with ack()."""
+        method, properties, body = self._channel.basic_get(queue=queue, auto_ack=False)
+        if method is None:
+            return None
+        return method, properties, body
+
+    def ack(self, delivery_tag):
+        self._channel.basic_ack(delivery_tag=delivery_tag)
+
+    def sleep(self, seconds):
+        # keeps the connection serviced and runs add_callback_threadsafe callbacks
+        self._connection.sleep(seconds)
+
+    def read_fanout_msg(self, exchange, callback):
+        # every consumer gets its own exclusive queue, so each worker sees every message
+        self._channel.exchange_declare(exchange=exchange, exchange_type=ExchangeType.fanout, durable=True)
+        result = self._channel.queue_declare(queue='', exclusive=True)
+        self._channel.queue_bind(exchange=exchange, queue=result.method.queue)
+
+        self._channel.basic_consume(
+            queue=result.method.queue,
+            on_message_callback=callback,
             auto_ack=True,
         )
 
         self._channel.start_consuming()
+
+    def close(self):
+        if self._connection.is_open:
+            self._connection.close()
+
+    def add_callback_threadsafe(self, callback):
+        # pika connections are not thread-safe: other threads must schedule
+        # publishes/acks to run on the connection's own thread
+        self._connection.add_callback_threadsafe(callback)
@@ -0,0 +1,235 @@
+"""
+s3://bucket/key image URIs for Img_Handler, read and written straight against
+S3-compatible storage (MinIO) instead of through the shared images volume.
+
+Reads are ranged GETs that start small and grow, so opening an image for its
+header (admission, Image.open) fetches a few KiB, and decoding it streams the
+rest in blocks. Writes are buffered in memory up to the multipart threshold
+(spilling to a temporary file past it) and uploaded with boto3's managed
+transfer, in parallel parts for large outputs.
+
+Without S3_ENDPOINT_URL the URIs resolve to S3_LOCAL_ROOT/<bucket>/<key> on
+local disk, so the same messages work on a single machine and in tests.
+"""
+
+import io
+import os
+import mimetypes
+import tempfile
+import threading
+import contextlib
+
+from . import env
+
+SCHEME = 's3://'
+# first ranged read; each following one is twice as large, up to S3_READ_BLOCK_KB
+FIRST_READ_BYTES = 64 * 1024
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def is_s3_uri(uri):
+    return isinstance(uri, str) and uri.startswith(SCHEME)
+
+
+def split_uri(uri):
+    bucket, _, key = uri[len(SCHEME):].partition('/')
+    if not bucket or not key:
+        raise ValueError(f"Invalid S3 URI, expected s3://bucket/key: {uri}")
+    return bucket, key
+
+
+def local_path(uri):
+    bucket, key = split_uri(uri)
+    return os.path.join(env.S3_LOCAL_ROOT, bucket, key)
+
+
+def client():
+    """
+    The process' S3 client. boto3 clients are thread-safe and keep a pool of
+    S3_MAX_POOL_CONNECTIONS connections; a forked worker builds its own
+    instead of sharing the parent's sockets.
+    """
+    global _client, _client_pid
+
+    with _client_lock:
+        if _client is None or _client_pid != os.getpid():
+            import boto3
+            from botocore.config import Config
+
+            _client = boto3.client(
+                's3',
+                endpoint_url=env.S3_ENDPOINT_URL,
+                aws_access_key_id=env.S3_ACCESS_KEY,
+                aws_secret_access_key=env.S3_SECRET_KEY,
+                region_name=env.S3_REGION,
+                config=Config(
+                    max_pool_connections=env.S3_MAX_POOL_CONNECTIONS,
+                    retries={'mode': 'standard'},
+                    # MinIO buckets are not DNS names on the compose network
+                    s3={'addressing_style': 'path'},
+                ),
+            )
+            _client_pid = os.getpid()
+        return _client
+
+
+def _error_code(e):
+    # botocore ClientError; anything else (connection errors) has no code
+    return getattr(e, 'response', {}).get('Error', {}).get('Code')
+
+
+def _os_error(e, uri):
+    # callers (and Pillow) handle OSError; a missing object is a missing file
+    code = _error_code(e)
+    if code in ('404', 'NoSuchKey', 'NoSuchBucket'):
+        return FileNotFoundError(f"No such object: {uri}")
+    return OSError(f"Cannot read {uri}: {e}")
+
+
+class RangedReader(io.RawIOBase):
+    """Read-only, seekable file over an S3 object, fetched with ranged GETs."""
+
+    def __init__(self, uri):
+        super().__init__()
+        self._uri = uri
+        self._bucket, self._key = split_uri(uri)
+        self._size = None
+        self._pos = 0
+        self._block = FIRST_READ_BYTES
+        # the last range fetched: bytes [self._buffer_start, + len(self._buffer))
+        self._buffer = b''
+        self._buffer_start = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    @property
+    def size(self):
+        if self._size is None:
+            try:
+                self._size = client().head_object(Bucket=self._bucket, Key=self._key)['ContentLength']
+            except Exception as e:
+                raise _os_error(e, self._uri) from e
+        return self._size
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError("negative seek position")
+        self._pos = offset
+        return self._pos
+
+    def _fetch(self, start, length):
+        if self._size is None and start > 0:
+            # a range past the end is an error: learn the size first
+            self.size
+        if self._size is not None:
+            if start >= self._size:
+                return b''
+            length = min(length, self._size - start)
+
+        try:
+            response = client().get_object(Bucket=self._bucket, Key=self._key,
+                                           Range=f'bytes={start}-{start + length - 1}')
+        except Exception as e:
+            if _error_code(e) == 'InvalidRange':
+                # an empty object has no byte 0
+                self._size = 0
+                return b''
+            raise _os_error(e, self._uri) from e
+
+        if self._size is None:
+            # the first GET also tells the object's size (Content-Range), sparing a HEAD
+            content_range = response.get('ContentRange', '')
+            self._size = int(content_range.rsplit('/', 1)[1]) if '/' in content_range else response['ContentLength']
+        return response['Body'].read()
+
+    def readinto(self, b):
+        # fills `b` (short only at the end): Pillow's header parsers expect whole reads
+        view = memoryview(b).cast('B')
+        done = 0
+        while done < len(view):
+            offset = self._pos - self._buffer_start
+            if not 0 <= offset < len(self._buffer):
+                # read-ahead grows with sequential reads, so a decode needs few requests
+                length = max(len(view) - done, self._block)
+                self._block = min(self._block * 2, env.S3_READ_BLOCK_KB * 1024)
+                self._buffer = self._fetch(self._pos, length)
+                self._buffer_start = self._pos
+                offset = 0
+                if not self._buffer:
+                    break
+
+            n = min(len(view) - done, len(self._buffer) - offset)
+            view[done:done + n] = self._buffer[offset:offset + n]
+            self._pos += n
+            done += n
+        return done
+
+
+def version(uri):
+    """
+    What changes when the object is replaced, for cache keys: its ETag (the
+    local file's mtime, without an endpoint). Costs a HEAD request.
+    """
+    if not env.S3_ENDPOINT_URL:
+        return os.path.getmtime(local_path(uri))
+    bucket, key = split_uri(uri)
+    try:
+        head = client().head_object(Bucket=bucket, Key=key)
+    except Exception as e:
+        raise _os_error(e, uri) from e
+    return head.get('ETag') or head.get('LastModified')
+
+
+def open_read(uri):
+    """A binary, seekable file for the object (the local file, without an endpoint)."""
+    if not env.S3_ENDPOINT_URL:
+        return open(local_path(uri), 'rb')
+    return RangedReader(uri)
+
+
+@contextlib.contextmanager
+def open_write(uri):
+    """
+    A binary file to write the object to; it is uploaded when the block exits
+    without an error.
+    """
+    if not env.S3_ENDPOINT_URL:
+        path = local_path(uri)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # w+b: the TIFF writer reads back what it wrote
+        with open(path, 'w+b') as fp:
+            yield fp
+        return
+
+    from boto3.s3.transfer import TransferConfig
+
+    threshold = env.S3_MULTIPART_THRESHOLD_MB * 1024 * 1024
+    with tempfile.SpooledTemporaryFile(max_size=threshold, mode='w+b') as fp:
+        yield fp
+        fp.seek(0)
+
+        bucket, key = split_uri(uri)
+        content_type = mimetypes.guess_type(key)[0] or 'application/octet-stream'
+        client().upload_fileobj(
+            fp, bucket, key,
+            ExtraArgs={'ContentType': content_type},
+            Config=TransferConfig(
+                multipart_threshold=threshold,
+                multipart_chunksize=env.S3_MULTIPART_CHUNK_MB * 1024 * 1024,
+                max_concurrency=env.S3_UPLOAD_CONCURRENCY,
+            ),
+        )
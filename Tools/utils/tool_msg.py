@@ -1,6 +1,113 @@
 import json
+import time
+import datetime
+import threading
+import traceback
+import functools
+import contextlib
+from collections import OrderedDict
 
 from .rabbit_mq import Rabbit_MQ
+from .messages import RequestDecoder, InvalidMessage, REPLY_SUMMARY, JSON, MSGPACK_TYPES, decode_raw, encode
+from . import admission
+from . import compose
+from . import env
+
+# Tool queues are declared with x-max-priority (rabbitMQ/definitions.json) so
+# interactive previews are served before bulk "apply to all images" runs.
+# The class is the message id prefix set by the projects service.
+MAX_PRIORITY = 2
+PRIORITIES = {
+    'preview': 2,
+    'request': 1,
+}
+
+
+# Numeric error codes of the replies this runtime sends on a tool's behalf, next
+# to the tools' own (<n>00 wrong_procedure, <n>01 error_processing)
+RUNTIME_CODES = {
+    # undecodable or invalid job (send_rejected)
+    'invalid_message': 9000,
+    # a callback raised (send_failed), for a tool without its own error_processing code
+    'error_processing': 9001,
+    # input over TOOL_MAX_IMAGE_PIXELS, the decompression-bomb limit (send_too_large)
+    'image_too_large': 9002,
+}
+
+
+def tool_codes(callback):
+    """The error codes (`_codes`) of the tool a bound callback belongs to, or {}."""
+    return getattr(getattr(callback, '__self__', None), '_codes', None) or {}
+
+
+def priority_class(msg_id):
+    prefix = str(msg_id).split('-', 1)[0]
+    return prefix if prefix in PRIORITIES else 'other'
+
+
+def msg_priority(msg_id):
+    return PRIORITIES.get(priority_class(msg_id), 0)
+
+
+# Tombstones {"scope": ..., "token": n} on this fanout exchange mean "every job
+# of `scope` with a token below n is superseded". Tool messages opt in with
+# "cancel": {"scope": ..., "token": ...} (e.g. scope "<project>:preview:<image>").
+CANCEL_EXCHANGE = 'picturas-cancel'
+CANCEL_RETRY_SECONDS = 5
+
+# latest tombstone token per scope, filled by the process' listener thread;
+# least recently cancelled first, at most TOOL_CANCEL_SCOPES of them
+_tombstones = OrderedDict()
+_cancel_listener = None
+_cancel_listener_lock = threading.Lock()
+
+
+class JobCancelled(Exception):
+    """Raised between a tool's stages when ToolMSG.superseded() turns true."""
+
+
+# pipelined workers (utils/pipeline.py): replies of the compute thread, held until the output is written
+_held = threading.local()
+
+
+@contextlib.contextmanager
+def held_replies():
+    """Inside the block, send_msg() on this thread appends its arguments to the yielded list."""
+    _held.replies = replies = []
+    try:
+        yield replies
+    finally:
+        _held.replies = None
+
+
+class _BatchAck:
+    """
+    Channel handed to callbacks that ack themselves (auto_ack=False) for the
+    items of a batch: the batch's delivery is acked after its last item.
+    """
+
+    def __init__(self, ch, delivery_tag, count):
+        self._ch = ch
+        self._delivery_tag = delivery_tag
+        self._left = count
+        self._lock = threading.Lock()
+
+    def basic_ack(self, delivery_tag=None, multiple=False):
+        with self._lock:
+            self._left -= 1
+            done = self._left == 0
+        if done:
+            self._ch.basic_ack(delivery_tag=self._delivery_tag)
+
+    def __getattr__(self, name):
+        return getattr(self._ch, name)
+
+
+class _BatchSummary:
+    def __init__(self, batch, item_ids):
+        self.batch = batch
+        self.pending = set(item_ids)
+        self.replies = []
 
 """
 # Callback example for those who need it
@@ -26,19 +133,441 @@ class ToolMSG:
         'obj_ai': 'obj_ai_queue',
         'people_ai': 'people_ai_queue',
         'expand_ai': 'expand_ai_queue',
+        'watermark': 'watermark_queue',
         'project': 'project_queue'
     }
     
-    def __init__(self, microservice_name, tool_name, rabbit_host, rabbit_port, username, password):
+    def __init__(self, microservice_name, tool_name, rabbit_host, rabbit_port, username, password, rabbit_mq=None):
+        """rabbit_mq: an existing Rabbit_MQ to share (tool_host runs several tools on one connection)."""
         self._microservice_name = microservice_name
+        self._tool_name = tool_name
         self._queue = self.queues[tool_name]
+        # jobs over this worker's memory budget go to high-memory workers (utils/admission.py)
+        self._large_queue = f'{tool_name}_large_queue'
+        self._large_worker = bool(env.TOOL_LARGE_WORKER)
+        if self._large_worker:
+            self._queue = self._large_queue
+        self._large_declared = False
+        self._budget = admission.MemoryBudget()
         self._proj_queue = self.queues['project']
-        self._rabbit_mq = Rabbit_MQ(rabbit_host, rabbit_port, username, password)
-    
-    def read_msg(self, callback):
-        self._rabbit_mq.read_rabbit_msg(self._queue, callback)
+        self._rabbit_mq = rabbit_mq or Rabbit_MQ(rabbit_host, rabbit_port, username, password, MAX_PRIORITY)
+        self._rabbit_args = (rabbit_host, rabbit_port, username, password)
+        self._decoder = RequestDecoder(tool_name)
+        # queue wait per priority class: {'preview': {'count', 'total_ms', 'max_ms'}, ...}
+        self.wait_stats = {}
+        self.cancelled = 0
+        # jobs dropped for their deadline, per priority class
+        self.expired_stats = {}
+        # item messageId -> _BatchSummary collecting its reply (batches with reply="summary")
+        self._summaries = {}
+        self._pipeline = None
+        # the thread consuming (and publishing) on this connection, set by read_msg()
+        self._connection_thread = None
+        # the tool's own error codes, for the replies sent on its behalf; set by read_msg()
+        self.codes = {}
+
+    @property
+    def queue(self):
+        """The queue this worker consumes."""
+        return self._queue
+
+    def read_msg(self, callback, auto_ack=True, prefetch_count=None):
+        """
+        auto_ack=True: the message is acked once `callback` returns. Acking on
+        delivery would let the broker push the whole queue to this worker, and
+        a priority can only reorder messages that are still in the broker.
+        auto_ack=False: `callback` acks itself (e.g. after handing off to a pool).
+
+        `callback` gets the decoded ToolRequest instead of the raw body, once
+        per item for a batch. Invalid, expired and superseded jobs are answered
+        with an "error"/"expired"/"cancelled" reply and acked here, without
+        calling it, and so are jobs moved to the large queue (admit()).
+
+        With TOOL_PIPELINE=1 an auto_ack `callback` runs in a staged pipeline
+        (utils/pipeline.py) that acks each message once its output is written.
+
+        Composed geometric jobs ("compose") are rendered by utils/compose.py
+        instead of `callback`.
+        """
+        self.start_cancel_listener()
+        self._connection_thread = threading.current_thread()
+        if self._large_worker:
+            # not in rabbitMQ/definitions.json: declared and bound on first use
+            self._rabbit_mq.declare_queue(self._queue)
+
+        self.codes = tool_codes(callback) or self.codes
+        callback = compose.wrap(self, callback, acks=not auto_ack)
+        if auto_ack and env.TOOL_PIPELINE:
+            from .pipeline import Pipeline
+
+            # one pipeline (and its threads) for the worker, whatever the number of read_msg() calls
+            if self._pipeline is None:
+                self._pipeline = Pipeline(self, callback)
+            callback, auto_ack = self._pipeline.submit, False
+            if prefetch_count is None:
+                prefetch_count = env.TOOL_PIPELINE_PREFETCH
+
+        def on_message(ch, method, properties, body):
+            try:
+                info = self.decode(body, properties.content_type)
+            except InvalidMessage as e:
+                self.send_rejected(body, properties.content_type, e)
+                ch.basic_ack(delivery_tag=method.delivery_tag)
+                return
+            if info.is_batch:
+                self._run_batch(callback, auto_ack, ch, method, properties, info)
+                return
+            if self.drop_if_stale(info) or self.admit(info, properties.content_type) is None:
+                ch.basic_ack(delivery_tag=method.delivery_tag)
+                return
+            try:
+                callback(ch, method, properties, info)
+            except Exception as e:
+                # answered as a failed batch item is, instead of taking the consume loop down
+                self.send_failed(info, e)
+                if not auto_ack:
+                    ch.basic_ack(delivery_tag=method.delivery_tag)
+            if auto_ack:
+                ch.basic_ack(delivery_tag=method.delivery_tag)
+
+        if auto_ack and prefetch_count is None:
+            prefetch_count = env.TOOL_PREFETCH
+
+        self._rabbit_mq.read_rabbit_msg(self._queue, on_message, False, prefetch_count)
+
+    def _run_batch(self, callback, auto_ack, ch, method, properties, batch):
+        items = self.begin_batch(batch)
+        item_ch = ch if auto_ack or not items else _BatchAck(ch, method.delivery_tag, len(items))
+
+        for item in items:
+            # checked per item: later ones can expire or be superseded while earlier ones run
+            if self.drop_if_stale(item) or self.admit(item, properties.content_type) is None:
+                if item_ch is not ch:
+                    item_ch.basic_ack()
+                continue
+            try:
+                callback(item_ch, method, properties, item)
+            except Exception as e:
+                # one broken item must not take the rest of the batch down
+                self.send_failed(item, e)
+                if item_ch is not ch:
+                    item_ch.basic_ack()
+
+        if item_ch is ch:
+            ch.basic_ack(delivery_tag=method.delivery_tag)
+
+    def begin_batch(self, batch):
+        """The batch's items as single requests; with reply="summary" their replies are collected."""
+        items = batch.expand()
+        if batch.reply == REPLY_SUMMARY:
+            summary = _BatchSummary(batch, [item.messageId for item in items])
+            for item in items:
+                self._summaries[item.messageId] = summary
+            if not items:
+                self._send_summary(summary)
+        return items
 
-    def send_msg(self, msg_id, resp_msg_id, timestamp, status, processingTime, new_img_uri, type="image", err_code=None, err_msg=None, og_img_uri=None):
+    def _send_summary(self, summary):
+        batch = summary.batch
+        now = datetime.datetime.now(datetime.timezone.utc)
+        msg = {
+            "messageId": f'summary-{batch.messageId}',
+            "correlationId": batch.messageId,
+            "timestamp": now.isoformat(),
+            "status": "batch",
+            "items": summary.replies,
+            "metadata": {
+                "processingTime": (now - batch.timestamp).total_seconds() * 1000,
+                "microservice": self._microservice_name
+            }
+        }
+        self._rabbit_mq.send_rabbit_msg(encode(msg), self._proj_queue, msg_priority(batch.messageId))
+
+    def send_failed(self, info, error):
+        """Error reply for a job whose callback raised instead of answering."""
+        print(f"[{self._queue}] {info.messageId} failed: {''.join(traceback.format_exception(error)).strip()}", flush=True)
+        params = info.parameters
+        og_img_uri = params.get('inputImageURI') if isinstance(params, dict) else params.inputImageURI
+        self.send_msg(
+            info.messageId,
+            f'failed-{info.messageId}',
+            datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'error',
+            (datetime.datetime.now(datetime.timezone.utc) - info.timestamp).total_seconds() * 1000,
+            None,
+            err_code=self.codes.get('error_processing', RUNTIME_CODES['error_processing']),
+            err_msg=str(error),
+            og_img_uri=og_img_uri,
+        )
+
+    def admit(self, info, content_type=None):
+        """
+        Read the header of the job's input image and return the job's estimated
+        memory in bytes (0 if the image can't be read here; the tool reports
+        that). Returns None if the job was answered instead, with an
+        "image_too_large" error, or moved to the large queue because it would
+        not fit this worker's budget; the caller only acks it.
+        """
+        params = info.parameters
+        img_path = params.get('inputImageURI') if isinstance(params, dict) else params.inputImageURI
+        try:
+            header = admission.read_header(img_path)
+        except admission.ImageTooLarge as e:
+            self.send_too_large(info, e)
+            return None
+        except (OSError, ValueError):
+            return 0
+
+        estimate = admission.estimate_bytes(self._tool_name, header)
+        # a large worker runs it anyway, alone
+        if self._budget.too_large(estimate) and not self._large_worker:
+            self.send_large(info, estimate, content_type)
+            return None
+        return estimate
+
+    def send_large(self, info, estimate, content_type=None):
+        """Republish the job (one item, for a batch) to the large queue."""
+        if not self._large_declared:
+            self._rabbit_mq.declare_queue(self._large_queue)
+            self._large_declared = True
+        print(json.dumps({
+            'metric': 'tool_job_rerouted',
+            'microservice': self._microservice_name,
+            'queue': self._queue,
+            'to': self._large_queue,
+            'estimate_mb': round(estimate / admission.MIB, 1),
+            'budget_mb': env.TOOL_MEMORY_BUDGET_MB,
+        }), flush=True)
+
+        # an item of a reply="summary" batch is answered on its own from now on
+        summary = self._summaries.pop(info.messageId, None)
+        if summary is not None:
+            summary.pending.discard(info.messageId)
+            if not summary.pending:
+                self._send_summary(summary)
+
+        content_type = content_type if content_type in MSGPACK_TYPES else JSON
+        self._rabbit_mq.send_rabbit_msg(encode(info, content_type), self._large_queue, msg_priority(info.messageId),
+                                        content_type)
+
+    def send_too_large(self, info, error):
+        print(json.dumps({
+            'metric': 'tool_image_too_large',
+            'microservice': self._microservice_name,
+            'queue': self._queue,
+            'error': str(error),
+        }), flush=True)
+        params = info.parameters
+        og_img_uri = params.get('inputImageURI') if isinstance(params, dict) else params.inputImageURI
+        self.send_msg(
+            info.messageId,
+            f'too-large-{info.messageId}',
+            datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'error',
+            (datetime.datetime.now(datetime.timezone.utc) - info.timestamp).total_seconds() * 1000,
+            None,
+            err_code=RUNTIME_CODES['image_too_large'],
+            err_msg=str(error),
+            og_img_uri=og_img_uri,
+        )
+
+    def decode(self, body, content_type=None):
+        """Body -> ToolRequest with this tool's parameters; raises InvalidMessage."""
+        return self._decoder.decode(body, content_type)
+
+    def send_rejected(self, body, content_type, error):
+        """Log an undecodable job and, if it has a messageId, answer it with an error."""
+        raw = decode_raw(body, content_type)
+        raw = raw if isinstance(raw, dict) else {}
+        msg_id = raw.get('messageId')
+        print(json.dumps({
+            'metric': 'tool_msg_rejected',
+            'microservice': self._microservice_name,
+            'queue': self._queue,
+            'error': str(error),
+        }), flush=True)
+        if not isinstance(msg_id, str):
+            return
+
+        params = raw.get('parameters')
+        og_img_uri = params.get('inputImageURI') if isinstance(params, dict) else None
+        self.send_msg(
+            msg_id,
+            f'rejected-{msg_id}',
+            datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'error',
+            0,
+            None,
+            err_code=RUNTIME_CODES['invalid_message'],
+            err_msg=f'Invalid message: {error}',
+            og_img_uri=og_img_uri if isinstance(og_img_uri, str) else '',
+        )
+
+    def drop_if_stale(self, info):
+        """
+        Record the job's queue wait; if it expired or was superseded, send the
+        "expired"/"cancelled" reply and return True (the caller only acks it).
+        """
+        self._record_wait(info)
+        if self.expired(info):
+            self.send_expired(info)
+            return True
+        if self.superseded(info):
+            self.send_cancelled(info)
+            return True
+        return False
+
+    def start_cancel_listener(self):
+        """One tombstone listener per process, shared by every ToolMSG in it."""
+        global _cancel_listener
+
+        with _cancel_listener_lock:
+            if _cancel_listener is not None:
+                return
+
+            def on_tombstone(ch, method, properties, body):
+                try:
+                    tombstone = json.loads(body)
+                    scope, token = str(tombstone['scope']), tombstone['token']
+                except (ValueError, KeyError, TypeError):
+                    return
+                # single writer; readers only .get(), which is atomic under the GIL
+                if token > _tombstones.get(scope, token - 1):
+                    _tombstones[scope] = token
+                    _tombstones.move_to_end(scope)
+                    while len(_tombstones) > max(1, env.TOOL_CANCEL_SCOPES):
+                        _tombstones.popitem(last=False)
+
+            def listen(rabbit_args):
+                # own connection: pika connections can't be shared between threads
+                while True:
+                    try:
+                        Rabbit_MQ(*rabbit_args).read_fanout_msg(CANCEL_EXCHANGE, on_tombstone)
+                    except Exception as e:
+                        print(f"cancel listener disconnected ({e}), retrying", flush=True)
+                    time.sleep(CANCEL_RETRY_SECONDS)
+
+            _cancel_listener = threading.Thread(target=listen, args=(self._rabbit_args,), name='cancel-listener', daemon=True)
+            _cancel_listener.start()
+
+    def superseded(self, info):
+        """True if a tombstone newer than this job's cancel token has been seen."""
+        if info.cancel is None:
+            return False
+        latest = _tombstones.get(info.cancel.scope)
+        return latest is not None and info.cancel.token < latest
+
+    def send_cancelled(self, info, processingTime=0):
+        self.cancelled += 1
+        msg_id = info.messageId
+        print(json.dumps({
+            'metric': 'tool_job_cancelled',
+            'microservice': self._microservice_name,
+            'queue': self._queue,
+            'priority': priority_class(msg_id),
+        }), flush=True)
+        self.send_msg(
+            msg_id,
+            f'cancelled-{msg_id}',
+            datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'cancelled',
+            processingTime,
+            None,
+        )
+
+    def send_partial(self, info, resp_msg_id, new_img_uri, processingTime, type="image"):
+        """
+        Interim result of a progressive job (utils/progressive.py), published
+        right away from any thread: it skips held replies and batch summaries.
+        The final reply follows under the same correlationId.
+        """
+        msg = {
+            "messageId": resp_msg_id,
+            "correlationId": info.messageId,
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "status": "partial",
+            "output": {
+                "type": type,
+                "imageURI": new_img_uri
+            },
+            "metadata": {
+                "processingTime": processingTime,
+                "microservice": self._microservice_name
+            }
+        }
+        publish = functools.partial(self._rabbit_mq.send_rabbit_msg, encode(msg), self._proj_queue,
+                                    msg_priority(info.messageId))
+        if self._connection_thread in (None, threading.current_thread()):
+            publish()
+        else:
+            # pika is not thread-safe
+            self.run_threadsafe(publish)
+
+    def expired(self, info):
+        """
+        True once the message's "deadline" has passed or, without one, once it
+        is older than the TOOL_MAX_AGE_* budget of its class (0 = no budget).
+        """
+        now = datetime.datetime.now(datetime.timezone.utc)
+        if info.deadline is not None:
+            return now > info.deadline
+
+        max_age = env.TOOL_MAX_AGE.get(priority_class(info.messageId), 0)
+        return bool(max_age) and (now - info.timestamp).total_seconds() > max_age
+
+    def send_expired(self, info):
+        msg_id = info.messageId
+        cls = priority_class(msg_id)
+        self.expired_stats[cls] = self.expired_stats.get(cls, 0) + 1
+        print(json.dumps({
+            'metric': 'tool_job_expired',
+            'microservice': self._microservice_name,
+            'queue': self._queue,
+            'priority': cls,
+            'expired_total': self.expired_stats[cls],
+        }), flush=True)
+        self.send_msg(
+            msg_id,
+            f'expired-{msg_id}',
+            datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'expired',
+            0,
+            None,
+        )
+
+    def _record_wait(self, info):
+        wait_ms = (datetime.datetime.now(datetime.timezone.utc) - info.timestamp).total_seconds() * 1000
+        cls = priority_class(info.messageId)
+
+        stats = self.wait_stats.setdefault(cls, {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+        stats['count'] += 1
+        stats['total_ms'] += wait_ms
+        stats['max_ms'] = max(stats['max_ms'], wait_ms)
+
+        # one JSON line per message, picked up by the gelf log driver for Kibana
+        print(json.dumps({
+            'metric': 'tool_queue_wait',
+            'microservice': self._microservice_name,
+            'queue': self._queue,
+            'priority': cls,
+            'wait_ms': round(wait_ms, 1),
+        }), flush=True)
+
+    def close(self):
+        self._rabbit_mq.close()
+
+    def reconnect(self):
+        """New connection, e.g. in a forked worker: a parent's socket must not be shared."""
+        self._rabbit_mq = Rabbit_MQ(*self._rabbit_args, MAX_PRIORITY)
+
+    def run_threadsafe(self, callback):
+        self._rabbit_mq.add_callback_threadsafe(callback)
+
+    def send_msg(self, msg_id, resp_msg_id, timestamp, status, processingTime, new_img_uri, type="image", err_code=None, err_msg=None, og_img_uri=None, variants=None):
+        replies = getattr(_held, 'replies', None)
+        if replies is not None:
+            replies.append((msg_id, resp_msg_id, timestamp, status, processingTime, new_img_uri, type, err_code, err_msg, og_img_uri, variants))
+            return
 
         msg = {}
         
@@ -58,6 +587,9 @@ class ToolMSG:
                         "microservice": self._microservice_name
                     }
                 }
+                # further outputs of the same job (resize pyramids): [{width, height, imageURI}]
+                if variants:
+                    msg["output"]["variants"] = variants
             case "error":
                 if err_code is None or err_msg is None or og_img_uri is None:
                     raise Exception("Make sure, in case of error status, err_code, err_msg and og_img_uri are not None")
@@ -79,11 +611,31 @@ class ToolMSG:
                         "microservice": self._microservice_name
                     }
                 }
+            case "cancelled" | "expired":
+                msg = {
+                    "messageId": resp_msg_id,
+                    "correlationId": msg_id,
+                    "timestamp": timestamp,
+                    "status": status,
+                    "metadata": {
+                        "processingTime": processingTime,
+                        "microservice": self._microservice_name
+                    }
+                }
             case _:
                 msg = {}
                 
-        msg = json.dumps(msg)    
+        # an item of a reply="summary" batch: held until the whole batch has answered
+        summary = self._summaries.pop(msg_id, None)
+        if summary is not None:
+            summary.replies.append(msg)
+            summary.pending.discard(msg_id)
+            if not summary.pending:
+                self._send_summary(summary)
+            return
+
+        msg = encode(msg)    
             
-        self._rabbit_mq.send_rabbit_msg(msg, self._proj_queue)
+        self._rabbit_mq.send_rabbit_msg(msg, self._proj_queue, msg_priority(msg_id))
         
     
\ No newline at end of file
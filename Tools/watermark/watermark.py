@@ -0,0 +1,227 @@
+import os
+import sys
+import datetime
+from collections import OrderedDict
+
+import pytz
+
+from PIL import Image, ImageColor, ImageDraw, ImageFont
+
+from utils.img_handler import Img_Handler
+from utils.tool_msg import ToolMSG
+import utils.env as env
+import utils.s3 as s3
+
+# target sizes are rounded up to this many pixels, so the images of a project
+# (mostly a handful of camera resolutions) share a few cached overlays
+SIZE_BUCKET = 64
+MARGIN = 0.02
+# gap between tiles, as a fraction of the mark size
+TILE_GAP = 0.5
+# position -> (x, y) fraction of the free space left of / above the mark
+POSITIONS = {
+    'top-left': (0, 0), 'top': (0.5, 0), 'top-right': (1, 0),
+    'left': (0, 0.5), 'center': (0.5, 0.5), 'right': (1, 0.5),
+    'bottom-left': (0, 1), 'bottom': (0.5, 1), 'bottom-right': (1, 1),
+}
+# font size the text is measured at before scaling it to the target width
+REFERENCE_FONT_SIZE = 100
+
+
+def _bucket(value):
+    return -(-value // SIZE_BUCKET) * SIZE_BUCKET
+
+
+class Watermark:
+    def __init__(self):
+        self._img_handler = Img_Handler()
+        self._tool_msg = ToolMSG('picturas-watermark-tool-ms',
+                                 'watermark',
+                                 env.RABBITMQ_HOST,
+                                 env.RABBITMQ_PORT,
+                                 env.RABBITMQ_USERNAME,
+                                 env.RABBITMQ_PASSWORD)
+        self._counter = 0
+        self._codes = {
+            'wrong_procedure': 2500,
+            'error_processing': 2501
+        }
+        # (mark spec, size bucket) -> RGBA overlay, least recently used first
+        self._overlays = OrderedDict()
+        self._cache_size = env.WATERMARK_CACHE_SIZE
+
+    def _font(self, size):
+        if env.WATERMARK_FONT:
+            return ImageFont.truetype(env.WATERMARK_FONT, size)
+        return ImageFont.load_default(size)
+
+    def _render_text(self, params, width):
+        # measure once at a reference size, then render at the size that makes
+        # the text `scale` of the image width
+        left, top, right, bottom = self._font(REFERENCE_FONT_SIZE).getbbox(params.text)
+        size = max(1, round(REFERENCE_FONT_SIZE * params.scale * width / max(1, right - left)))
+        font = self._font(size)
+        left, top, right, bottom = font.getbbox(params.text)
+
+        r, g, b = ImageColor.getrgb(params.color)[:3]
+        mark = Image.new('RGBA', (max(1, right - left), max(1, bottom - top)), (r, g, b, 0))
+        ImageDraw.Draw(mark).text((-left, -top), params.text, font=font,
+                                  fill=(r, g, b, round(255 * params.opacity)))
+        return mark
+
+    def _render_image(self, params, width):
+        mark = self._img_handler.get_img(params.imageURI).convert('RGBA')
+        mark_width = max(1, round(params.scale * width))
+        mark_height = max(1, round(mark.height * mark_width / mark.width))
+        mark = mark.resize((mark_width, mark_height), Image.LANCZOS)
+
+        if params.opacity < 1:
+            alpha = mark.getchannel('A').point([round(v * params.opacity) for v in range(256)])
+            mark.putalpha(alpha)
+        return mark
+
+    def _render_tiles(self, mark, size):
+        layer = Image.new('RGBA', size, (0, 0, 0, 0))
+        step_x = mark.width + max(1, round(mark.width * TILE_GAP))
+        step_y = mark.height + max(1, round(mark.height * TILE_GAP))
+        for row, y in enumerate(range(0, size[1], step_y)):
+            # every other row is shifted by half a step
+            offset = (step_x // 2) * (row % 2)
+            for x in range(-offset, size[0], step_x):
+                layer.alpha_composite(mark, (max(0, x), y), (max(0, -x), 0))
+        return layer
+
+    def _spec(self, params):
+        if params.type == 'image':
+            # a replaced mark file (or s3:// object) must not keep serving the old overlay
+            try:
+                if s3.is_s3_uri(params.imageURI):
+                    version = s3.version(params.imageURI)
+                else:
+                    version = os.path.getmtime(params.imageURI)
+            except (OSError, ValueError):
+                version = None
+            source = (params.imageURI, version)
+        else:
+            source = (params.text, params.color)
+        return (params.type, source, params.opacity, params.scale, params.tile)
+
+    def get_overlay(self, params, size):
+        """
+        The rendered mark for an image of `size`: the mark alone, or for tiled
+        marks a layer at least as large as the image. The position is not part
+        of the key, the same overlay is composited at any position.
+        """
+        width, height = _bucket(size[0]), _bucket(size[1])
+        key = (self._spec(params), width, height if params.tile else None)
+
+        overlay = self._overlays.get(key)
+        if overlay is not None:
+            self._overlays.move_to_end(key)
+            return overlay
+
+        if params.type == 'image':
+            overlay = self._render_image(params, width)
+        else:
+            overlay = self._render_text(params, width)
+        if params.tile:
+            overlay = self._render_tiles(overlay, (width, height))
+
+        self._overlays[key] = overlay
+        if len(self._overlays) > self._cache_size:
+            self._overlays.popitem(last=False)
+        return overlay
+
+    def _position(self, position, size, mark_size):
+        fx, fy = POSITIONS[position]
+        margin = round(min(size) * MARGIN)
+        x = margin + round((size[0] - mark_size[0] - 2 * margin) * fx)
+        y = margin + round((size[1] - mark_size[1] - 2 * margin) * fy)
+        return max(0, x), max(0, y)
+
+    def _composite(self, img, params):
+        # One alpha composite per image (or frame); the overlay comes from the cache
+        overlay = self.get_overlay(params, img.size)
+        new_img = img.convert('RGBA')
+        # alpha_composite clips whatever falls outside the image
+        if params.tile:
+            new_img.alpha_composite(overlay)
+        else:
+            new_img.alpha_composite(overlay, self._position(params.position, img.size, overlay.size))
+
+        # Keep the original mode; palette images are stored as RGB
+        if img.mode != 'RGBA':
+            new_img = new_img.convert('RGB' if img.mode == 'P' else img.mode)
+        return new_img
+
+    def add_watermark(self, img_path, store_img_path, params):
+        # Load the image, mark every frame and save it
+        self._img_handler.apply(img_path, store_img_path, lambda img: self._composite(img, params))
+
+    def watermark_callback(self, ch, method, properties, info):
+        msg_id = info.messageId
+        timestamp = info.timestamp
+        procedure = info.procedure
+        img_path = info.parameters.inputImageURI
+        store_img_path = info.parameters.outputImageURI
+
+        resp_msg_id = f'watermark-{self._counter}-{msg_id}'
+        self._counter += 1
+
+        if procedure != 'watermark':
+            cur_timestamp = datetime.datetime.now(pytz.utc)
+            processing_time = (cur_timestamp - timestamp).total_seconds() * 1000
+            cur_timestamp = cur_timestamp.isoformat()
+
+            self._tool_msg.send_msg(
+                msg_id,
+                resp_msg_id,
+                cur_timestamp,
+                'error',
+                processing_time,
+                None,
+                err_code=self._codes['wrong_procedure'],
+                err_msg="The procedure received does not fit into this tool",
+                og_img_uri=img_path
+            )
+            return
+
+        try:
+            self.add_watermark(img_path, store_img_path, info.parameters)
+
+            cur_timestamp = datetime.datetime.now(pytz.utc)
+            processing_time = (cur_timestamp - timestamp).total_seconds() * 1000
+            cur_timestamp = cur_timestamp.isoformat()
+
+            self._tool_msg.send_msg(
+                msg_id,
+                resp_msg_id,
+                cur_timestamp,
+                'success',
+                processing_time,
+                store_img_path
+            )
+        except Exception as e:
+            cur_timestamp = datetime.datetime.now(pytz.utc)
+            processing_time = (cur_timestamp - timestamp).total_seconds() * 1000
+            cur_timestamp = cur_timestamp.isoformat()
+
+            self._tool_msg.send_msg(
+                msg_id,
+                resp_msg_id,
+                cur_timestamp,
+                'error',
+                processing_time,
+                None,
+                err_code=self._codes['error_processing'],
+                err_msg=str(e),
+                og_img_uri=img_path
+            )
+
+    def exec(self, args):
+        while True:
+            self._tool_msg.read_msg(self.watermark_callback)
+
+if __name__ == "__main__":
+    watermark_tool = Watermark()
+    watermark_tool.exec(sys.argv)
@@ -71,7 +71,9 @@ export default function ExpandAITool({ disabled }: { disabled?: boolean }) {
             onChange={(e) => setMode(e.target.value as ExpandMode)}
           >
             <option value="reflect">Reflect (recomendado)</option>
+            <option value="symmetric">Symmetric</option>
             <option value="edge">Edge</option>
+            <option value="wrap">Wrap</option>
             <option value="solid">Solid color</option>
             <option value="generative">Generative (RF40)</option>
           </select>
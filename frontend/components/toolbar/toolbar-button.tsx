@@ -256,7 +256,10 @@ export function ToolbarButton({
     const s = socket.data;
     if (!s) return;
 
-    const onPreviewReady = () => {
+    const onPreviewReady = (msg: string) => {
+      // a progressive tool's low-res preview: the full-resolution one is still coming
+      if ((JSON.parse(msg) as { partial?: boolean }).partial) return;
+
       setWaiting(false);
       preview.setWaiting("");
     };
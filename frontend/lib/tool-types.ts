@@ -37,7 +37,13 @@ export interface SaturationToolParams {
   saturationFactor: number; // 0.0 - 2.0 (1.0 normal image)
 }
 
-export type ExpandMode = "reflect" | "edge" | "solid" | "generative";
+export type ExpandMode =
+  | "reflect"
+  | "symmetric"
+  | "edge"
+  | "wrap"
+  | "solid"
+  | "generative";
 
 export type ExpandAiParams = {
   // UI atual
@@ -1,30 +1,111 @@
 from flask import Flask, request, send_file, jsonify
 from PIL import Image
 import io
+import os
 import time
+import random
+import bisect
+import multiprocessing as mp
 
 import numpy as np
 import cv2
 
 app = Flask(__name__)
 
-@app.get("/sdapi/v1/samplers")
-def samplers():
-    return jsonify([{"name": "mock-inpaint"}])
+# ====== Configuração do mock (load-test stand-in) ======
+# Tudo pode ser definido por env (MOCK_*) e sobreposto por pedido via query
+# params com o mesmo nome da chave (ex.: POST /outpaint?mode=echo&latency=fixed&latencyMs=800)
+#
+#   mode            inpaint | echo            (echo devolve o canvas recebido, sem decode)
+#   latency         none | fixed | normal | longtail
+#   latencyMs       fixed: valor; normal: média; longtail: mediana
+#   latencyStdMs    desvio padrão (normal); 0 => latencyMs / 4
+#   latencyTail     sigma do lognormal (longtail); 1.0 => p99 ~ 10x mediana
+#   maxConcurrency  pedidos em simultâneo (todos os workers); 0 = sem limite
+#   rejectStatus    429 | 503 quando o limite é excedido
+#   errorRate       fração [0, 1] de pedidos que falham com 500
+#   seed            seed base; cada pedido usa seed + nº do pedido (reprodutível)
+DEFAULTS = {
+    "mode": os.getenv("MOCK_MODE", "inpaint"),
+    "latency": os.getenv("MOCK_LATENCY", "none"),
+    "latencyMs": float(os.getenv("MOCK_LATENCY_MS", "0")),
+    "latencyStdMs": float(os.getenv("MOCK_LATENCY_STD_MS", "0")),
+    "latencyTail": float(os.getenv("MOCK_LATENCY_TAIL", "1.0")),
+    "maxConcurrency": int(os.getenv("MOCK_MAX_CONCURRENCY", "0")),
+    "rejectStatus": int(os.getenv("MOCK_REJECT_STATUS", "429")),
+    "errorRate": float(os.getenv("MOCK_ERROR_RATE", "0")),
+    "seed": int(os.getenv("MOCK_SEED", "0")),
+}
 
-@app.post("/outpaint")
-def outpaint():
-    t0 = time.time()
+# Estado partilhado entre workers: com `gunicorn --preload` é criado no master
+# antes do fork, por isso o limite de concorrência e os contadores são globais.
+LATENCY_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000, 60000]
+COUNTERS = ["requests", "ok", "errors", "rejected"]
+
+_lock = mp.Lock()
+_counters = mp.Array("q", len(COUNTERS), lock=False)
+_inflight = mp.Value("i", 0, lock=False)
+_peak_inflight = mp.Value("i", 0, lock=False)
+_latency_hist = mp.Array("q", len(LATENCY_BUCKETS_MS) + 1, lock=False)
+_latency_sum = mp.Value("d", 0.0, lock=False)
+_latency_max = mp.Value("d", 0.0, lock=False)
+
+
+def _config():
+    """Config do pedido: query params sobrepõem-se aos defaults do env."""
+    cfg = dict(DEFAULTS)
+    for key, default in DEFAULTS.items():
+        raw = request.args.get(key)
+        if raw is None:
+            continue
+        try:
+            cfg[key] = type(default)(raw)
+        except ValueError:
+            pass
+    cfg["mode"] = cfg["mode"].lower()
+    cfg["latency"] = cfg["latency"].lower()
+    if cfg["rejectStatus"] not in (429, 503):
+        cfg["rejectStatus"] = 429
+    return cfg
+
+
+def _sample_delay_ms(cfg, rng):
+    dist = cfg["latency"]
+    base = max(cfg["latencyMs"], 0.0)
 
-    f_img = request.files["image"]
-    f_mask = request.files.get("mask")
+    if dist == "fixed":
+        return base
+    if dist == "normal":
+        std = cfg["latencyStdMs"] or base / 4
+        return max(0.0, rng.gauss(base, std))
+    if dist == "longtail":
+        return base * rng.lognormvariate(0.0, max(cfg["latencyTail"], 0.0))
+    return 0.0
 
-    prompt = request.form.get("prompt", "")
-    negative = request.form.get("negative_prompt", "")
-    steps = request.form.get("steps", "")
-    guidance = request.form.get("guidance", "")
-    seed = request.form.get("seed", "")
 
+def _record(counter, latency_ms=None):
+    with _lock:
+        _counters[COUNTERS.index(counter)] += 1
+        if latency_ms is not None:
+            _latency_hist[bisect.bisect_left(LATENCY_BUCKETS_MS, latency_ms)] += 1
+            _latency_sum.value += latency_ms
+            _latency_max.value = max(_latency_max.value, latency_ms)
+
+
+def _percentile(hist, total, q):
+    """Percentil aproximado: limite superior do bucket onde cai o q-ésimo pedido."""
+    if total == 0:
+        return None
+    target = q * total
+    seen = 0
+    for i, count in enumerate(hist):
+        seen += count
+        if seen >= target:
+            return LATENCY_BUCKETS_MS[i] if i < len(LATENCY_BUCKETS_MS) else None
+    return None
+
+
+def _inpaint(f_img, f_mask, prompt, negative, steps, guidance, seed):
     img_pil = Image.open(f_img.stream).convert("RGB")
     w, h = img_pil.size
     img = cv2.cvtColor(np.array(img_pil), cv2.COLOR_RGB2BGR)
@@ -73,16 +154,126 @@ def outpaint():
         radius = 7  # testar 5/7/9
         out_bgr = cv2.inpaint(img, mask_bin, radius, cv2.INPAINT_TELEA)
 
-    dt_ms = int((time.time() - t0) * 1000)
-    print(f"[OUTPAINT] done {dt_ms}ms", flush=True)
-
     out_rgb = cv2.cvtColor(out_bgr, cv2.COLOR_BGR2RGB)
     out_pil = Image.fromarray(out_rgb)
 
     buf = io.BytesIO()
     out_pil.save(buf, format="PNG")
     buf.seek(0)
-    return send_file(buf, mimetype="image/png")
+    return buf
+
+
+@app.get("/sdapi/v1/samplers")
+def samplers():
+    return jsonify([{"name": "mock-inpaint"}])
+
+
+@app.post("/outpaint")
+def outpaint():
+    t0 = time.time()
+    cfg = _config()
+
+    with _lock:
+        _counters[COUNTERS.index("requests")] += 1
+        request_no = _counters[COUNTERS.index("requests")]
+        rejected = cfg["maxConcurrency"] > 0 and _inflight.value >= cfg["maxConcurrency"]
+        if not rejected:
+            _inflight.value += 1
+            _peak_inflight.value = max(_peak_inflight.value, _inflight.value)
+
+    if rejected:
+        _record("rejected")
+        resp = jsonify({"error": "busy", "maxConcurrency": cfg["maxConcurrency"]})
+        resp.status_code = cfg["rejectStatus"]
+        resp.headers["Retry-After"] = "1"
+        return resp
+
+    try:
+        rng = random.Random(cfg["seed"] * 1_000_003 + request_no)
+        delay_ms = _sample_delay_ms(cfg, rng)
+        fail = rng.random() < cfg["errorRate"]
+
+        f_img = request.files["image"]
+        f_mask = request.files.get("mask")
+
+        if delay_ms > 0:
+            time.sleep(delay_ms / 1000)
+
+        if fail:
+            _record("errors", (time.time() - t0) * 1000)
+            return jsonify({"error": "injected failure"}), 500
+
+        if cfg["mode"] == "echo":
+            # caminho rápido: devolve o canvas tal como chegou
+            buf = io.BytesIO(f_img.read())
+            mimetype = f_img.mimetype or "image/png"
+        else:
+            buf = _inpaint(
+                f_img,
+                f_mask,
+                request.form.get("prompt", ""),
+                request.form.get("negative_prompt", ""),
+                request.form.get("steps", ""),
+                request.form.get("guidance", ""),
+                request.form.get("seed", ""),
+            )
+            mimetype = "image/png"
+
+        dt_ms = (time.time() - t0) * 1000
+        _record("ok", dt_ms)
+        if cfg["mode"] != "echo":
+            print(f"[OUTPAINT] done {int(dt_ms)}ms", flush=True)
+
+        return send_file(buf, mimetype=mimetype)
+    finally:
+        with _lock:
+            _inflight.value -= 1
+
+
+@app.get("/stats")
+def stats():
+    with _lock:
+        counters = {name: _counters[i] for i, name in enumerate(COUNTERS)}
+        hist = list(_latency_hist)
+        inflight = _inflight.value
+        peak = _peak_inflight.value
+        lat_sum = _latency_sum.value
+        lat_max = _latency_max.value
+
+    measured = sum(hist)
+    return jsonify({
+        **counters,
+        "inflight": inflight,
+        "peakInflight": peak,
+        "latencyMs": {
+            "count": measured,
+            "mean": (lat_sum / measured) if measured else None,
+            "max": lat_max if measured else None,
+            "p50": _percentile(hist, measured, 0.50),
+            "p95": _percentile(hist, measured, 0.95),
+            "p99": _percentile(hist, measured, 0.99),
+            "buckets": {
+                **{f"le_{b}": hist[i] for i, b in enumerate(LATENCY_BUCKETS_MS)},
+                "le_inf": hist[-1],
+            },
+        },
+        "defaults": DEFAULTS,
+    })
+
+
+@app.post("/stats/reset")
+def stats_reset():
+    with _lock:
+        for i in range(len(COUNTERS)):
+            _counters[i] = 0
+        for i in range(len(_latency_hist)):
+            _latency_hist[i] = 0
+        _latency_sum.value = 0.0
+        _latency_max.value = 0.0
+        _peak_inflight.value = _inflight.value
+    return jsonify({"reset": True})
+
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=7860, debug=False)
+    # desenvolvimento; em docker corre com gunicorn (vários workers, ver Dockerfile)
+    app.run(host="0.0.0.0", port=7860, debug=False, threaded=True)
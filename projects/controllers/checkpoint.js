@@ -0,0 +1,24 @@
+const Checkpoint = require("../models/checkpoint");
+
+module.exports.getByKeys = (user_id, keys) =>
+  Checkpoint.find({ user_id, key: { $in: keys } }).exec();
+
+module.exports.upsert = (doc) =>
+  Checkpoint.updateOne(
+    { user_id: doc.user_id, key: doc.key },
+    { $set: { ...doc, last_used_at: new Date() }, $setOnInsert: { created_at: new Date() } },
+    { upsert: true }
+  );
+
+module.exports.touchHit = (_id) =>
+  Checkpoint.updateOne({ _id }, { $set: { last_used_at: new Date() }, $inc: { hits: 1 } });
+
+module.exports.totalBytes = async () => {
+  const [total] = await Checkpoint.aggregate([{ $group: { _id: null, bytes: { $sum: "$bytes" } } }]);
+  return total ? total.bytes : 0;
+};
+
+module.exports.leastRecentlyUsed = (limit) =>
+  Checkpoint.find().sort({ last_used_at: 1 }).limit(limit).exec();
+
+module.exports.delete = (_id) => Checkpoint.deleteOne({ _id });
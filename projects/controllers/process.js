@@ -26,6 +26,10 @@ module.exports.create = async (process) => {
   return await Process.create(process);
 };
 
+module.exports.createMany = async (processes) => {
+  return await Process.insertMany(processes);
+};
+
 module.exports.update = (user_id, project_id, process_id, process) => {
   return Process.updateOne(
     { user_id: user_id, project_id: project_id, _id: process_id },
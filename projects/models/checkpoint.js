@@ -0,0 +1,26 @@
+const mongoose = require("mongoose");
+
+// Output of a tool prefix (steps 0..position) for one source image, kept so that
+// previews/runs of a chain that only changed later steps resume from it
+const checkpointSchema = new mongoose.Schema(
+  {
+    user_id: { type: mongoose.Schema.Types.ObjectId, required: true },
+    project_id: { type: mongoose.Schema.Types.ObjectId, required: true },
+
+    // makeCheckpointKey(source sha256, tools 0..position)
+    key: { type: String, required: true },
+    position: { type: Number, required: true },
+    file_uri: { type: String, required: true },
+    bytes: { type: Number, required: true },
+
+    created_at: { type: Date, default: Date.now },
+    // LRU: the least recently used ones are evicted past the byte budget
+    last_used_at: { type: Date, default: Date.now, index: true },
+    hits: { type: Number, default: 0 },
+  },
+  { versionKey: false }
+);
+
+checkpointSchema.index({ user_id: 1, key: 1 }, { unique: true });
+
+module.exports = mongoose.model("checkpoint", checkpointSchema);
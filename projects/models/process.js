@@ -12,6 +12,10 @@ var processSchema = new mongoose.Schema({
   cache_key: { type: String, required: false },
   cancelToken: { type: Number, required: false },
   token: { type: Number, required: true },
+  preview_token: { type: Number, required: false },
+  // makeToolsFingerprint of the tools the chain started with (utils/checkpoints.js);
+  // unset once a step returned text, whose later outputs are not checkpointed
+  tools_fp: { type: String, required: false },
 }, { timestamps: true });
 
 module.exports = mongoose.model("process", processSchema);
@@ -18,6 +18,11 @@ const { v4: uuidv4 } = require('uuid');
 
 const {
   send_msg_tool,
+  send_msg_tools,
+  compose_steps,
+  tool_batch_size,
+  send_msg_cancel,
+  cancel_scope,
   send_msg_client,
   send_msg_client_error,
   send_msg_client_preview,
@@ -36,6 +41,7 @@ const { ensureEditorSlot, releaseEditorSlot } = require("../utils/presence");
 const { extractImageFeatures } = require("../utils/imageFeatures");
 const PreviewCache = require("../controllers/previewCache");
 const { makePreviewCacheKey, makeToolsFingerprint } = require("../utils/cacheKey");
+const checkpoints = require("../utils/checkpoints");
 
 const {
   get_image_docker,
@@ -149,10 +155,96 @@ function toolsEqual(a, b) {
 }
 
 
+// Creates the Process records, then sends their jobs (batched per tool, see send_msg_tools)
+async function start_tool_steps(steps) {
+  if (steps.length === 0) return;
+  await Process.createMany(steps.map((s) => s.process));
+  send_msg_tools(steps.map((s) => s.job));
+}
+
 // TODO process message according to type of output
 function process_msg() {
   read_msg(async (msg) => {
+    let replies;
+    try {
+      let msg_content = JSON.parse(msg.content.toString());
+
+      // tool jobs whose RabbitMQ TTL ran out come back here unchanged (dead-letter)
+      if (!msg_content.status && msg_content.procedure) {
+        const ids = msg_content.items
+          ? msg_content.items.map((item) => item.messageId)
+          : [msg_content.messageId];
+        msg_content = { status: "batch", items: ids.map((id) => ({ status: "expired", correlationId: id })) };
+      }
+
+      // a batch job sent with reply "summary" is answered with one reply holding
+      // each image's reply; by default its images are answered one by one
+      replies = msg_content.status === "batch" ? msg_content.items : [msg_content];
+    } catch (err) {
+      console.error("[process_msg] invalid message:", err);
+      return;
+    }
 
+    // the next step of every image in this reply goes out together, so a
+    // summary batch that comes back is sent on as batches
+    const next_steps = [];
+    for (const reply of replies) {
+      await process_tool_reply(reply, next_steps);
+    }
+
+    try {
+      await start_tool_steps(next_steps);
+    } catch (err) {
+      console.error("[process_msg] error starting next steps:", err);
+      const runners = new Set(next_steps.map((s) => String(s.process.runner_id || s.process.user_id)));
+      for (const runner of runners) {
+        send_msg_client_error(
+          `update-client-process-${uuidv4()}`,
+          new Date().toISOString(),
+          runner,
+          "30000",
+          "An error happened while processing the project"
+        );
+      }
+    }
+  });
+}
+
+// A progressive tool's "partial" reply: the step's result on a downscaled proxy.
+// Only the last step of a preview is shown (a partial output is never chained to
+// the next tool), and it is not cached: the full-resolution reply replaces it.
+async function send_partial_preview(process, msg_content, timestamp, runnerId) {
+  const msg_id = msg_content.correlationId;
+  if (!/preview/.test(msg_id) || msg_content.output.type == "text") return;
+
+  const project = await Project.getOne(process.user_id, process.project_id);
+  if ((project.activeToken || 0) !== (process.token || 0)) return;
+  if (process.cur_pos + 1 < project.tools.length) return;
+
+  const file_path = path.join(__dirname, `/../${msg_content.output.imageURI}`);
+  const data = new FormData();
+  await data.append(
+    "file",
+    fs.createReadStream(file_path),
+    path.basename(file_path),
+    mime.lookup(file_path)
+  );
+
+  const resp = await post_image(process.user_id, process.project_id, "preview", data);
+  const img_key = resp.data.data.imageKey.split("/").pop();
+  const url_resp = await get_image_host(process.user_id, process.project_id, "preview", img_key);
+
+  console.log(`[T-03][RABBIT][PREVIEW-PARTIAL] msg=${msg_id} key=${(process.cache_key||"").slice(0,8)}`);
+
+  send_msg_client_preview(
+    `update-client-preview-${uuidv4()}`,
+    timestamp,
+    runnerId,
+    JSON.stringify({ imageUrl: url_resp.data.url, textResults: [], partial: true })
+  );
+}
+
+async function process_tool_reply(msg_content, next_steps) {
     const timestamp = new Date().toISOString();
     const user_msg_id = `update-client-process-${uuidv4()}`;
 
@@ -161,7 +253,6 @@ function process_msg() {
     let ownerIdSafe = null;
 
     try {
-      const msg_content = JSON.parse(msg.content.toString());
       const msg_id = msg_content.correlationId;
 
       const process = await Process.getOneByMsgId(msg_id);
@@ -170,6 +261,12 @@ function process_msg() {
       ownerIdSafe = process.user_id;
       runnerIdSafe = process.runner_id || process.user_id;
 
+      // low-res result of a progressive tool: the job is still running, its Process stays
+      if (msg_content.status === "partial") {
+        await send_partial_preview(process, msg_content, timestamp, runnerIdSafe);
+        return;
+      }
+
        console.log(
         `[T-03][RABBIT] msg=${msg_id} status=${msg_content.status} outType=${msg_content?.output?.type} curPos=${process.cur_pos} key=${(process.cache_key||"").slice(0,8)}`
       );
@@ -185,6 +282,23 @@ function process_msg() {
       const img_id = process.img_id;
       
       await Process.delete(process.user_id, process.project_id, process._id);
+
+      // a tool dropped this job because a newer preview/run superseded it
+      if (msg_content.status === "cancelled") {
+        console.log(`[CANCELLED] msg=${msg_id} curPos=${process.cur_pos}`);
+        return;
+      }
+
+      // the job outlived its deadline before a tool picked it up
+      if (msg_content.status === "expired") {
+        console.log(`[EXPIRED] msg=${msg_id} curPos=${process.cur_pos}`);
+        if (/preview/.test(msg_id)) {
+          send_msg_client_preview_error(`update-client-preview-${uuidv4()}`, timestamp, runnerId, "expired", "Preview expired before processing");
+        } else {
+          send_msg_client_error(user_msg_id, timestamp, runnerId, "expired", "Job expired before processing");
+        }
+        return;
+      }
       
       if (msg_content.status === "error") {
         console.log(JSON.stringify(msg_content));
@@ -223,6 +337,16 @@ function process_msg() {
 
       const next_pos = process.cur_pos + 1;
 
+      // keep this step's output for chains that only change after it (utils/checkpoints.js);
+      // only while the tools are still the ones the chain started with
+      if (type != "text" && next_pos < project.tools.length && process.tools_fp &&
+          process.tools_fp === makeToolsFingerprint(project.tools)) {
+        const img_sha = project.imgs.find((i) => String(i._id) === String(img_id))?.og_sha256;
+        const ordered_tools = [...project.tools].sort((a, b) => a.position - b.position);
+        await checkpoints.save(process, img_sha, ordered_tools, output_file_uri)
+          .catch((err) => console.error("[CHECKPOINT][SAVE] error:", err));
+      }
+
 if (/preview/.test(msg_id) && (type == "text" || next_pos >= project.tools.length)) {
   const file_path = path.join(__dirname, `/../${output_file_uri}`);
   const file_name = path.basename(file_path);
@@ -439,6 +563,11 @@ if (/preview/.test(msg_id) && (type == "text" || next_pos >= project.tools.lengt
 
       const tool_name = tool.procedure;
       const params = tool.params;
+      // geometric steps from here on run as one job, answered for its last step
+      const { last_pos, compose } = compose_steps(
+        [...project.tools].sort((a, b) => a.position - b.position),
+        next_pos
+      );
 
       const read_img = type == "text" ? prev_process_input_img : output_file_uri;
       const output_img = type == "text" ? prev_process_output_img : output_file_uri;
@@ -452,23 +581,33 @@ if (/preview/.test(msg_id) && (type == "text" || next_pos >= project.tools.lengt
         project_id: project._id,
         img_id: img_id,
         msg_id: new_msg_id,
-        cur_pos: next_pos,
+        cur_pos: last_pos,
         og_img_uri: read_img,
         new_img_uri: output_img,
         cancelToken: processToken,
         token: process.token,
+        preview_token: process.preview_token,
+        // outputs after a text step are not checkpointed: resuming would skip its text
+        tools_fp: type == "text" ? undefined : process.tools_fp,
       };
 
-      // Making sure database entry is created before sending message to avoid conflicts
-      await Process.create(new_process);
-      send_msg_tool(
-        new_msg_id,
-        timestamp,
-        new_process.og_img_uri,
-        new_process.new_img_uri,
-        tool_name,
-        params
-      );
+      // the database entry is created before the message is sent (start_tool_steps)
+      next_steps.push({
+        process: new_process,
+        job: {
+          msg_id: new_msg_id,
+          timestamp,
+          og_img_uri: new_process.og_img_uri,
+          new_img_uri: new_process.new_img_uri,
+          tool: tool_name,
+          params,
+          compose,
+          cancel: {
+            scope: cancel_scope(new_process.project_id, new_msg_id, new_process.img_id),
+            token: /preview/.test(new_msg_id) ? new_process.preview_token || 0 : new_process.token || 0,
+          },
+        },
+      });
     } catch (err) {
 
       console.error("[process_msg] error:", err);
@@ -484,7 +623,6 @@ if (/preview/.test(msg_id) && (type == "text" || next_pos >= project.tools.lengt
       );
       return;
     }
-  });
 }
 
 async function deleteProjectAndResources(userId, projectId) {
@@ -1025,14 +1163,10 @@ router.post("/:user/:project/preview/:img", checkSharePermission, requireEditPer
         return res.status(400).jsonp("No tools selected");
       }
 
-      const tool = project.tools.filter((t) => t.position == 0)[0];
-      if (!tool) {
+      if (!project.tools.some((t) => t.position == 0)) {
         return res.status(400).jsonp("No tools selected");
       }
 
-      const tool_name = tool.procedure;
-      const params = tool.params;
-
       const source_path = `/../images/users/${ownerId}/projects/${req.params.project}/src`;
       const result_path = `/../images/users/${ownerId}/projects/${req.params.project}/preview`;
 
@@ -1110,53 +1244,76 @@ router.post("/:user/:project/preview/:img", checkSharePermission, requireEditPer
 
       const msg_id = `preview-${uuidv4()}`;
       const timestamp = new Date().toISOString();
-      const og_img_uri = img.og_uri;
       const img_id = img._id;
-
-      const resp = await get_image_docker(
-        ownerId,
-        req.params.project,
-        "src",
-        img.og_img_key
-      );
-      const url = resp.data.url;
-
-      const img_resp = await axios.get(url, { responseType: "stream" });
-      const writer = fs.createWriteStream(og_img_uri);
-
-      await new Promise((resolve, reject) => {
-        writer.on("finish", resolve);
-        writer.on("error", reject);
-        img_resp.data.pipe(writer);
-      });
+      // newer previews of this image supersede this one inside the tools
+      const preview_token = Date.now();
 
       const img_name_parts = img.new_uri.split("/");
       const img_name = img_name_parts[img_name_parts.length - 1];
       const new_img_uri = `./images/users/${ownerId}/projects/${req.params.project}/preview/${img_name}`;
 
+      // start after the longest prefix of the chain already checkpointed for this image
+      const start_pos = await checkpoints.resume(ownerId, img.og_sha256, orderedTools, new_img_uri)
+        .catch((err) => {
+          console.error("[CHECKPOINT][RESUME] error:", err);
+          return 0;
+        });
+      const tool = orderedTools[start_pos];
+      const tool_name = tool.procedure;
+      const params = tool.params;
+      const { last_pos, compose } = compose_steps(orderedTools, start_pos);
+
+      // resumed: the checkpoint (copied to new_img_uri) is the input, the source isn't needed
+      const og_img_uri = start_pos > 0 ? new_img_uri : img.og_uri;
+
+      if (start_pos === 0) {
+        const resp = await get_image_docker(
+          ownerId,
+          req.params.project,
+          "src",
+          img.og_img_key
+        );
+        const url = resp.data.url;
+
+        const img_resp = await axios.get(url, { responseType: "stream" });
+        const writer = fs.createWriteStream(og_img_uri);
+
+        await new Promise((resolve, reject) => {
+          writer.on("finish", resolve);
+          writer.on("error", reject);
+          img_resp.data.pipe(writer);
+        });
+      }
+
       const process = {
         user_id: ownerId,        
         runner_id: runnerUserId,  
         project_id: req.params.project,
         img_id: img_id,
         msg_id: msg_id,
-        cur_pos: 0,
+        cur_pos: last_pos,
         og_img_uri: og_img_uri,
         new_img_uri: new_img_uri,
         cache_key: cacheKey,
         cancelToken: project.cancelToken || 0,
         token: project.activeToken || 0,
+        preview_token: preview_token,
+        tools_fp: makeToolsFingerprint(orderedTools),
       };
 
       Process.create(process)
         .then(() => {
+          const scope = cancel_scope(req.params.project, msg_id, img_id);
+          send_msg_cancel(scope, preview_token);
           send_msg_tool(
             msg_id,
             timestamp,
             og_img_uri,
             new_img_uri,
             tool_name,
-            params
+            params,
+            { scope: scope, token: preview_token },
+            compose
           );
           res.sendStatus(201);
         })
@@ -1438,39 +1595,66 @@ router.post("/:user/:project/process", checkSharePermission, requireEditPermissi
 
         let error = false;
 
+        // jobs of older runs still queued in the tools are dropped
+        send_msg_cancel(cancel_scope(req.params.project, "request"), runToken);
+
+        // first steps go out a batch at a time while the rest of the images download
+        let pending = [];
+        const flush = async () => {
+          const steps = pending;
+          pending = [];
+          await start_tool_steps(steps).catch(() => (error = true));
+        };
+
+        const orderedTools = [...project.tools].sort((a, b) => a.position - b.position);
+        const tools_fp = makeToolsFingerprint(orderedTools);
+
         for (let img of project.imgs) {
+          const new_img_uri = img.new_uri;
+
+          // each image starts after the longest prefix already checkpointed for it
+          const start_pos = await checkpoints.resume(ownerId, img.og_sha256, orderedTools, new_img_uri)
+            .catch((err) => {
+              console.error("[CHECKPOINT][RESUME] error:", err);
+              return 0;
+            });
+
           let url = "";
-          try {
-            const resp = await get_image_docker(
-              ownerId,
-              req.params.project,
-              "src",
-              img.og_img_key
-            );
-            url = resp.data.url;
+          if (start_pos === 0) {
+            try {
+              const resp = await get_image_docker(
+                ownerId,
+                req.params.project,
+                "src",
+                img.og_img_key
+              );
+              url = resp.data.url;
 
-            const img_resp = await axios.get(url, { responseType: "stream" });
-            const writer = fs.createWriteStream(img.og_uri);
+              const img_resp = await axios.get(url, { responseType: "stream" });
+              const writer = fs.createWriteStream(img.og_uri);
 
-            await new Promise((resolve, reject) => {
-              writer.on("finish", resolve);
-              writer.on("error", reject);
-              img_resp.data.pipe(writer);
-            });
-          } catch (_) {
-            res.status(400).jsonp("Error acquiring source images");
-            return;
+              await new Promise((resolve, reject) => {
+                writer.on("finish", resolve);
+                writer.on("error", reject);
+                img_resp.data.pipe(writer);
+              });
+            } catch (_) {
+              await flush();
+              res.status(400).jsonp("Error acquiring source images");
+              return;
+            }
           }
 
           const msg_id = `request-${uuidv4()}`;
           const timestamp = new Date().toISOString();
 
-          const og_img_uri = img.og_uri;
-          const new_img_uri = img.new_uri;
-          const tool = project.tools.filter((t) => t.position === 0)[0];
+          // resumed: the checkpoint (copied to new_img_uri) is the input
+          const og_img_uri = start_pos > 0 ? new_img_uri : img.og_uri;
+          const tool = orderedTools[start_pos];
 
           const tool_name = tool.procedure;
           const params = tool.params;
+          const { last_pos, compose } = compose_steps(orderedTools, start_pos);
 
           const process = {
             user_id: ownerId,
@@ -1478,26 +1662,30 @@ router.post("/:user/:project/process", checkSharePermission, requireEditPermissi
             project_id: req.params.project,
             img_id: img._id,
             msg_id: msg_id,
-            cur_pos: 0,
+            cur_pos: last_pos,
             og_img_uri: og_img_uri,
             new_img_uri: new_img_uri,
             cancelToken: project.cancelToken || 0,
             token: runToken,
+            tools_fp: tools_fp,
           };
 
-          await Process.create(process)
-            .then(() => {
-              send_msg_tool(
-                msg_id,
-                timestamp,
-                og_img_uri,
-                new_img_uri,
-                tool_name,
-                params
-              );
-            })
-            .catch(() => (error = true));
+          pending.push({
+            process,
+            job: {
+              msg_id,
+              timestamp,
+              og_img_uri,
+              new_img_uri,
+              tool: tool_name,
+              params,
+              compose,
+              cancel: { scope: cancel_scope(req.params.project, msg_id), token: runToken },
+            },
+          });
+          if (pending.length >= tool_batch_size) await flush();
         }
+        await flush();
 
         if (error) {
           res
@@ -2167,6 +2355,9 @@ router.delete(
 
       res.set("X-Project-Version", String(updated.version));
 
+      // as tools descartam os jobs desta execução que ainda estejam na fila ou a meio
+      send_msg_cancel(cancel_scope(projectId, "request"), updated.activeToken || 0);
+
       // limpar processos em curso
       const processes = await Process.getProject(ownerId, projectId);
       for (const p of (processes || [])) {
@@ -32,4 +32,10 @@ function makeToolsFingerprint(tools) {
   return crypto.createHash("sha256").update(JSON.stringify(payload)).digest("hex");
 }
 
-module.exports = { makePreviewCacheKey, makeToolsFingerprint };
+// checkpoint de um prefixo do pipeline: imagem de origem + fingerprint dos tools 0..k
+function makeCheckpointKey(imgSha256, prefixTools) {
+  const payload = stable({ type: "checkpoint", imgSha256, tools: makeToolsFingerprint(prefixTools) });
+  return crypto.createHash("sha256").update(JSON.stringify(payload)).digest("hex");
+}
+
+module.exports = { makePreviewCacheKey, makeToolsFingerprint, makeCheckpointKey };
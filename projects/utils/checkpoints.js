@@ -0,0 +1,106 @@
+// Prefix checkpoints: the output of steps 0..k of a chain for one source image,
+// so that a preview or run whose tools only changed after step k starts at step
+// k+1 instead of 0 (e.g. tweaking the last tool of a long chain runs one step).
+//
+// Checkpoints are copies (the tools write every step of a chain over the same
+// file) on the images volume shared with the tools, indexed in Mongo by
+// makeCheckpointKey(source sha256, tools 0..k). CHECKPOINT_BUDGET_MB bounds their
+// total size, the least recently used are evicted first; 0 turns them off.
+const fs = require("fs");
+const path = require("path");
+
+const Checkpoint = require("../controllers/checkpoint");
+const { makeCheckpointKey } = require("./cacheKey");
+
+const budget_bytes = Number(process.env.CHECKPOINT_BUDGET_MB ?? 2048) * 1024 * 1024;
+const checkpoint_dir = "./images/checkpoints";
+
+function abs(uri) {
+  return path.join(__dirname, "/../", uri);
+}
+
+function copy(from_uri, to_uri) {
+  // a reflink where the filesystem has them, a plain copy otherwise
+  return fs.promises.copyFile(abs(from_uri), abs(to_uri), fs.constants.COPYFILE_FICLONE);
+}
+
+// The last step always runs: a full-chain hit is the preview cache's job
+function prefix_keys(img_sha, ordered_tools) {
+  const keys = [];
+  for (let k = 0; k < ordered_tools.length - 1; k++) {
+    keys.push(makeCheckpointKey(img_sha, ordered_tools.slice(0, k + 1)));
+  }
+  return keys;
+}
+
+// Copies the output of the longest checkpointed prefix of `ordered_tools` to
+// `img_uri` and returns the position of the first step left to run (0: none)
+async function resume(user_id, img_sha, ordered_tools, img_uri) {
+  if (!budget_bytes || !img_sha) return 0;
+
+  const keys = prefix_keys(img_sha, ordered_tools);
+  if (keys.length === 0) return 0;
+
+  const found = await Checkpoint.getByKeys(user_id, keys);
+  found.sort((a, b) => b.position - a.position);
+
+  for (const cp of found) {
+    try {
+      await fs.promises.mkdir(path.dirname(abs(img_uri)), { recursive: true });
+      await copy(cp.file_uri, img_uri);
+    } catch (err) {
+      // the file is gone (volume cleaned up): forget it and try a shorter prefix
+      console.error(`[CHECKPOINT][LOST] key=${cp.key.slice(0, 8)} err=${err.message}`);
+      await Checkpoint.delete(cp._id);
+      continue;
+    }
+    await Checkpoint.touchHit(cp._id);
+    console.log(`[CHECKPOINT][HIT] key=${cp.key.slice(0, 8)} resume=${cp.position + 1}/${ordered_tools.length}`);
+    return cp.position + 1;
+  }
+  return 0;
+}
+
+// Keeps `output_uri`, the output of step `process.cur_pos`, as the checkpoint of
+// the tools up to that step (not for the last step, see prefix_keys)
+async function save(process, img_sha, ordered_tools, output_uri) {
+  if (!budget_bytes || !img_sha) return;
+
+  const position = process.cur_pos;
+  const key = makeCheckpointKey(img_sha, ordered_tools.slice(0, position + 1));
+  const [existing] = await Checkpoint.getByKeys(process.user_id, [key]);
+  if (existing) return;
+
+  const file_uri = `${checkpoint_dir}/${process.user_id}/${key}${path.extname(output_uri)}`;
+  await fs.promises.mkdir(path.dirname(abs(file_uri)), { recursive: true });
+  await copy(output_uri, file_uri);
+  const { size } = await fs.promises.stat(abs(file_uri));
+
+  await Checkpoint.upsert({
+    user_id: process.user_id,
+    project_id: process.project_id,
+    key,
+    position,
+    file_uri,
+    bytes: size,
+  });
+  await evict();
+}
+
+async function evict() {
+  let total = await Checkpoint.totalBytes();
+  while (total > budget_bytes) {
+    const victims = await Checkpoint.leastRecentlyUsed(16);
+    if (victims.length === 0) return;
+
+    for (const cp of victims) {
+      if (total <= budget_bytes) return;
+      await fs.promises.rm(abs(cp.file_uri), { force: true });
+      await Checkpoint.delete(cp._id);
+      total -= cp.bytes;
+      console.log(`[CHECKPOINT][EVICT] key=${cp.key.slice(0, 8)} bytes=${cp.bytes}`);
+    }
+  }
+}
+
+module.exports = { resume, save };
@@ -1,4 +1,5 @@
-const { send_rabbit_msg, read_rabbit_msg } = require('./rabbit_mq')
+const { v4: uuidv4 } = require('uuid');
+const { send_rabbit_msg, send_rabbit_broadcast, read_rabbit_msg } = require('./rabbit_mq')
 
 const queues = {
     'cut': 'cut_queue',
@@ -22,8 +23,82 @@ const queues = {
     'ws': 'ws_queue'
 }
 
-function send_msg_tool(msg_id, timestamp, og_img_uri, new_img_uri, tool, params) {
-    const queue = queues[tool];
+// Tool queues are declared with x-max-priority 2 (rabbitMQ/definitions.json):
+// previews overtake "apply to all images" runs queued on the same tool
+const priorities = {
+    'preview': 2,
+    'request': 1
+}
+
+function msg_priority(msg_id) {
+    return priorities[String(msg_id).split('-')[0]] || 0;
+}
+
+// Time budget (ms) per message class; 0 = no deadline. Tools drop jobs past their
+// "deadline" with an "expired" reply, RabbitMQ drops them on the same TTL
+// (dead-lettered back to project_queue, see rabbitMQ/definitions.json)
+const deadlines = {
+    'preview': Number(process.env.PREVIEW_DEADLINE_MS || 60_000),
+    'request': Number(process.env.REQUEST_DEADLINE_MS || 0)
+}
+
+// Tombstones: tools drop jobs whose cancel token is older than the latest one for their scope.
+// A preview only supersedes earlier previews of the same image; a run, every job of the project's runs
+const cancel_exchange = 'picturas-cancel'
+
+function cancel_scope(project_id, msg_id, img_id = null) {
+    return /preview/.test(msg_id) ? `${project_id}:preview:${img_id}` : `${project_id}:run`;
+}
+
+function send_msg_cancel(scope, token) {
+    send_rabbit_broadcast({ "scope": scope, "token": token }, cancel_exchange);
+}
+
+// Images per batch message when several jobs go to the same tool at once (bulk runs);
+// a preview queued behind a batch waits for the whole batch. 1 = no batches
+const tool_batch_size = Math.max(1, Number(process.env.TOOL_BATCH_SIZE || 8));
+
+// Slow tools answer previews progressively: a "partial" reply with the result on a
+// downscaled proxy first, then the full-resolution one (Tools/utils/progressive.py)
+const progressive_tools = new Set(
+    (process.env.PROGRESSIVE_TOOLS ?? 'upgrade_ai,bg_remove_ai,cut_ai,expand_ai')
+        .split(',').map((t) => t.trim()).filter(Boolean)
+);
+
+// Consecutive geometric steps go to the tools as one job, rendered with a single
+// resample (Tools/utils/compose.py); COMPOSE_GEOMETRY=0 sends them one by one
+const composable_tools = new Set(['rotate', 'resize', 'cut', 'border']);
+const compose_geometry = (process.env.COMPOSE_GEOMETRY ?? '1') !== '0';
+
+// The run of composable steps starting at pos (ordered by position): the job's
+// last step (the Process' cur_pos) and the steps after the first one, for "compose"
+function compose_steps(ordered_tools, pos) {
+    let last_pos = pos;
+    if (compose_geometry && composable_tools.has(ordered_tools[pos]?.procedure)) {
+        while (last_pos + 1 < ordered_tools.length && composable_tools.has(ordered_tools[last_pos + 1].procedure))
+            last_pos++;
+    }
+    const compose = ordered_tools.slice(pos + 1, last_pos + 1)
+        .map((t) => ({ "procedure": t.procedure, "parameters": t.params }));
+    return { last_pos, compose };
+}
+
+// priority, cancel token, deadline/TTL and progressive flag are shared by a job and all items of a batch
+function send_tool_envelope(msg, queue, timestamp, cancel) {
+    if (cancel) msg["cancel"] = cancel;
+    if (/preview/.test(msg.messageId) && progressive_tools.has(msg.procedure)) msg["progressive"] = true;
+
+    const options = { priority: msg_priority(msg.messageId) };
+    const budget = deadlines[String(msg.messageId).split('-')[0]] || 0;
+    if (budget > 0) {
+        msg["deadline"] = new Date(Date.parse(timestamp) + budget).toISOString();
+        options.expiration = String(budget);
+    }
+
+    send_rabbit_msg(msg, queue, options);
+}
+
+function send_msg_tool(msg_id, timestamp, og_img_uri, new_img_uri, tool, params, cancel = null, compose = null) {
     const msg = {
         "messageId": msg_id,
         "timestamp": timestamp,
@@ -34,8 +109,60 @@ function send_msg_tool(msg_id, timestamp, og_img_uri, new_img_uri, tool, params)
             ... params
         }
     };
+    if (compose && compose.length) msg["compose"] = compose;
 
-    send_rabbit_msg(msg, queue);
+    send_tool_envelope(msg, queues[tool], timestamp, cancel);
+}
+
+// One message for many images (items keep their own message ids). reply "items":
+// each item is answered on its own as it finishes; "summary": the tool answers
+// with a single "batch" reply holding every item's usual reply, once all are done
+function send_msg_tool_batch(batch_id, timestamp, tool, items, cancel = null, reply = "items") {
+    const msg = {
+        "messageId": batch_id,
+        "timestamp": timestamp,
+        "procedure": tool,
+        "reply": reply,
+        "items": items.map((item) => ({
+            "messageId": item.msg_id,
+            "parameters": {
+                "inputImageURI": item.og_img_uri,
+                "outputImageURI": item.new_img_uri,
+                ... item.params
+            }
+        }))
+    };
+
+    send_tool_envelope(msg, queues[tool], timestamp, cancel);
+}
+
+// Sends jobs ({ msg_id, timestamp, og_img_uri, new_img_uri, tool, params, cancel, compose }),
+// batching those that share tool, message class and cancel token (composed jobs go alone);
+// reply: how the batches are answered (see send_msg_tool_batch)
+function send_msg_tools(jobs, reply = "items") {
+    const groups = new Map();
+    for (const job of jobs) {
+        if (job.compose && job.compose.length) {
+            send_msg_tool(job.msg_id, job.timestamp, job.og_img_uri, job.new_img_uri, job.tool, job.params, job.cancel, job.compose);
+            continue;
+        }
+        const key = JSON.stringify([job.tool, String(job.msg_id).split('-')[0], job.cancel]);
+        if (!groups.has(key)) groups.set(key, []);
+        groups.get(key).push(job);
+    }
+
+    for (const group of groups.values()) {
+        for (let i = 0; i < group.length; i += tool_batch_size) {
+            const chunk = group.slice(i, i + tool_batch_size);
+            const first = chunk[0];
+            if (chunk.length === 1) {
+                send_msg_tool(first.msg_id, first.timestamp, first.og_img_uri, first.new_img_uri, first.tool, first.params, first.cancel);
+            } else {
+                const batch_id = `${String(first.msg_id).split('-')[0]}-batch-${uuidv4()}`;
+                send_msg_tool_batch(batch_id, first.timestamp, first.tool, chunk, first.cancel, reply);
+            }
+        }
+    }
 }
 
 function send_msg_client(msg_id, timestamp, user) {
@@ -108,4 +235,4 @@ function send_msg_project_op({ projectId, ownerId, op }) {
   send_rabbit_msg(msg, queue);
 }
 
-module.exports = { send_msg_tool, send_msg_client, send_msg_client_error, send_msg_client_preview, send_msg_client_preview_error, read_msg, send_msg_project_op };
\ No newline at end of file
+module.exports = { send_msg_tool, send_msg_tools, compose_steps, tool_batch_size, send_msg_cancel, cancel_scope, send_msg_client, send_msg_client_error, send_msg_client_preview, send_msg_client_preview_error, read_msg, send_msg_project_op };
\ No newline at end of file
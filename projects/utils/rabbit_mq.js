@@ -8,7 +8,7 @@ const exchange = "picturas";
 
 const rabbit_mq_sv = `amqp://${rabbit_username}:${rabbit_password}@${rabbit_host}:${rabbit_port}`;
 
-function send_rabbit_msg(msg, queue) {
+function send_rabbit_msg(msg, queue, options = {}) {
     amqp.connect(rabbit_mq_sv, (err_sv, connection) => {
         if (err_sv) throw err_sv;
         
@@ -19,7 +19,7 @@ function send_rabbit_msg(msg, queue) {
                 durable: true
             });
 
-            channel.publish(exchange, queue, Buffer.from(JSON.stringify(msg)));
+            channel.publish(exchange, queue, Buffer.from(JSON.stringify(msg)), { contentType: 'application/json', ...options });
         });
         
         setTimeout(() => {
@@ -29,6 +29,27 @@ function send_rabbit_msg(msg, queue) {
     
 }
 
+// Fanout: every bound queue (one per tool worker) gets a copy
+function send_rabbit_broadcast(msg, fanout_exchange) {
+    amqp.connect(rabbit_mq_sv, (err_sv, connection) => {
+        if (err_sv) throw err_sv;
+
+        connection.createChannel( (err_conn, channel) => {
+            if (err_conn) throw err_conn;
+
+            channel.assertExchange(fanout_exchange, 'fanout', {
+                durable: true
+            });
+
+            channel.publish(fanout_exchange, '', Buffer.from(JSON.stringify(msg)));
+        });
+
+        setTimeout(() => {
+            connection.close();
+        }, 500);
+    });
+}
+
 function read_rabbit_msg(queue, callback) {
     amqp.connect(rabbit_mq_sv, (err_sv, connection) => {
         if (err_sv) throw err_sv;
@@ -57,4 +78,4 @@ function read_rabbit_msg(queue, callback) {
     });
 }
 
-module.exports = { send_rabbit_msg, read_rabbit_msg };
+module.exports = { send_rabbit_msg, send_rabbit_broadcast, read_rabbit_msg };